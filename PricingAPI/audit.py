@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+AUDIT_TABLE = "pricing_apirunlog"
+
+# sync: audit rows are written before the response is returned
+# buffered: rows are kept in memory and written with BatchWriteItem once AUDIT_BUFFER_SIZE rows
+#           are waiting or the oldest has waited AUDIT_FLUSH_INTERVAL seconds, and when the process exits
+# async: rows are handed to a background thread that writes them with BatchWriteItem, the response
+#        does not wait for them
+AUDIT_MODES = ("sync", "buffered", "async")
+AUDIT_MODE = os.environ.get("AUDIT_MODE", "sync")
+AUDIT_BUFFER_SIZE = int(os.environ.get("AUDIT_BUFFER_SIZE", "25"))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "5"))
+
+# Lambda freezes or ends the container without running atexit, so buffered and queued rows are written
+# before every invocation returns, waiting at most AUDIT_FLUSH_TIMEOUT seconds for the background thread.
+# A long lived process such as server.py turns this off and relies on its own flush when it drains
+AUDIT_FLUSH_EACH_INVOCATION = os.environ.get("AUDIT_FLUSH_EACH_INVOCATION", "1") in ("1", "true", "True")
+AUDIT_FLUSH_TIMEOUT = float(os.environ.get("AUDIT_FLUSH_TIMEOUT", "2"))
+
+# BatchWriteItem accepts at most 25 put requests
+MAX_BATCH_WRITE = 25
+# The BatchWriteItem requests of a large batch are sent concurrently, so that a batch of 5000 loans
+# takes about 25 round trips instead of 200. Keep it within the connection pool of the dynamoDB client
+AUDIT_WRITE_WORKERS = int(os.environ.get("AUDIT_WRITE_WORKERS", "8"))
+
+
+class AuditWriteError(Exception):
+    """
+    Raised in sync mode when audit rows could not be written, by dynamoDB or after every retry of unprocessed items
+    """
+
+
+class AuditSink:
+    """
+    Writes the payloads built by create_dataframe to the audit table. The mode decides whether
+    a request waits for its audit row to be stored, see AUDIT_MODES
+    """
+
+    def __init__(self, client, table_name: str = AUDIT_TABLE, mode: str = AUDIT_MODE, buffer_size: int = AUDIT_BUFFER_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL, max_attempts: int = 5, sleep=time.sleep, write_workers: int = AUDIT_WRITE_WORKERS):
+        if mode not in AUDIT_MODES:
+            raise ValueError(f"Audit mode must be one of {AUDIT_MODES}")
+        self.client = client
+        self.table_name = table_name
+        self.mode = mode
+        self.buffer_size = min(buffer_size, MAX_BATCH_WRITE)
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.write_workers = write_workers
+        self._sleep = sleep
+        self._pool = None
+        self._pending = deque()
+        self._oldest = None
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self.written = 0
+        self.failed = 0
+
+    def write(self, payload: dict):
+        """
+        Function used to store the audit data of one run
+        Args:
+            payload: dynamoDB payload created by create_dataframe
+        """
+        if self.mode == "sync":
+            try:
+                self.client.put_item(TableName = self.table_name, Item = payload)
+            except Exception as e:
+                self.failed += 1
+                raise AuditWriteError(f"Audit row was not written: {e!r}") from e
+            self.written += 1
+            return
+        self.write_many([payload])
+
+    def write_many(self, payloads: list):
+        """
+        Function used to store the audit data of many runs
+        Args:
+            payloads: list of dynamoDB payloads created by create_dataframe
+        """
+        if not payloads:
+            return
+        if self.mode == "sync":
+            self._batch_write(list(payloads))
+            return
+
+        with self._condition:
+            self._pending.extend(payloads)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self.mode == "async":
+                self._start_worker()
+                self._condition.notify()
+                return
+            due = len(self._pending) >= self.buffer_size or time.monotonic() - self._oldest >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self, timeout: float = None):
+        """
+        Function used to write every buffered row, in async mode it waits for the background thread to catch up
+        Args:
+            timeout: longest time in seconds to wait for the background thread
+        Returns:
+            True when nothing is left to write
+        """
+        if self.mode == "async":
+            with self._condition:
+                return self._condition.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+        with self._condition:
+            payloads = list(self._pending)
+            self._pending.clear()
+            self._oldest = None
+        self._batch_write(payloads)
+        return True
+
+    def stats(self):
+        """
+        Function used to report how many audit rows were written, failed or are still waiting
+        """
+        return {'mode': self.mode, 'written': self.written, 'failed': self.failed, 'pending': len(self._pending) + self._in_flight}
+
+    def _start_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target = self._run, name = "audit-writer", daemon = True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                payloads = [self._pending.popleft() for _ in range(min(self.buffer_size, len(self._pending)))]
+                self._in_flight = len(payloads)
+                if not self._pending:
+                    self._oldest = None
+            try:
+                self._batch_write(payloads)
+            except Exception as e:
+                self.failed += len(payloads)
+                print(f"Unable to write {len(payloads)} audit rows: {e!r}")
+            with self._condition:
+                self._in_flight = 0
+                self._condition.notify_all()
+
+    def _batch_write(self, payloads: list):
+        """
+        Function used to write rows with BatchWriteItem, the requests of a large batch are sent concurrently.
+        A chunk that dynamoDB refuses with an error is counted as failed and the other chunks are still written,
+        only sync mode raises, a buffered row is never lost without being counted
+        Args:
+            payloads: list of dynamoDB payloads created by create_dataframe
+        """
+        chunks = [payloads[start:start + MAX_BATCH_WRITE] for start in range(0, len(payloads), MAX_BATCH_WRITE)]
+        if len(chunks) > 1 and self.write_workers > 1:
+            results = list(self._write_pool().map(self._write_chunk, chunks))
+        else:
+            results = [self._write_chunk(chunk) for chunk in chunks]
+
+        unwritten, error = [], None
+        for chunk, (remaining, chunk_error) in zip(chunks, results):
+            self.written += len(chunk) - len(remaining)
+            unwritten += remaining
+            error = chunk_error or error
+
+        if unwritten:
+            self.failed += len(unwritten)
+            run_ids = [payload.get('run_id', {}).get('S') for payload in unwritten]
+            print(f"Audit rows were not written after {self.max_attempts} attempts: {run_ids}" if error is None else f"Audit rows were not written: {run_ids}")
+            if self.mode == "sync":
+                raise AuditWriteError(f"{len(unwritten)} audit rows were not written" + (f": {error!r}" if error is not None else "")) from error
+
+    def _write_chunk(self, chunk: list):
+        """
+        Function used to write at most MAX_BATCH_WRITE rows with BatchWriteItem, unprocessed items are retried with exponential backoff
+        Args:
+            chunk: list of dynamoDB payloads
+        Returns:
+            remaining: payloads that were not written
+            error: exception dynamoDB raised, None when it only left items unprocessed
+        """
+        request = {self.table_name: [{'PutRequest': {'Item': payload}} for payload in chunk]}
+        error = None
+        try:
+            for attempt in range(self.max_attempts):
+                request = self.client.batch_write_item(RequestItems = request).get('UnprocessedItems') or {}
+                if not request:
+                    break
+                self._sleep(0.05 * 2 ** attempt)
+        except Exception as e:
+            print(f"Unable to write {len(request.get(self.table_name, []))} audit rows: {e!r}")
+            error = e
+        return [item['PutRequest']['Item'] for item in request.get(self.table_name, [])], error
+
+    def _write_pool(self):
+        with self._condition:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers = self.write_workers, thread_name_prefix = "audit-write")
+        return self._pool
@@ -0,0 +1,100 @@
+"""
+Cold start report for the lambda module.
+
+Every run imports main in a fresh interpreter, as lambda does when it starts a new
+execution environment, and records the import time and the peak memory of the process.
+A -X importtime run gives the cost of each top level package.
+
+Usage:
+    python benchmarks/coldstart.py [--runs 5] [--top 10] [--output coldstart.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PRICING_API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({'import_ms': elapsed * 1000, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'pandas_imported': 'pandas' in sys.modules}))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+    return env
+
+
+def measure_import(runs: int):
+    """
+    Function used to import main in fresh interpreters
+    Args:
+        runs: number of interpreters to start
+    Returns:
+        samples: list of dictionaries with import_ms, max_rss_mb and pandas_imported
+    """
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", CHILD], cwd=PRICING_API_DIR, env=_env(), capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return samples
+
+
+def import_breakdown(module: str = "main", top: int = 10):
+    """
+    Function used to find the packages that take the longest to import
+    Args:
+        module: module to import
+        top: number of packages to report
+    Returns:
+        packages: list of (package, cumulative milliseconds) for the packages module imports directly, slowest first.
+                  The time spent running the body of module itself is reported as "<module> (module body)"
+    """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=PRICING_API_DIR, env=_env(), capture_output=True, text=True, check=True).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # every level of nesting indents the package name by two spaces
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level == 1:
+            packages[name.strip()] = int(cumulative_us) / 1000
+        elif level == 0 and name.strip() == module:
+            packages[f"{module} (module body)"] = int(self_us) / 1000
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start import cost of the lambda module")
+    parser.add_argument('--runs', type=int, default=5, help="number of fresh interpreters to import main in")
+    parser.add_argument('--top', type=int, default=10, help="number of packages to list in the import breakdown")
+    parser.add_argument('--output', help="write the report to this json file")
+    args = parser.parse_args(argv)
+
+    samples = measure_import(args.runs)
+    import_ms = [sample['import_ms'] for sample in samples]
+    report = {
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'import_ms': {'min': min(import_ms), 'median': statistics.median(import_ms), 'max': max(import_ms)},
+        'max_rss_mb': max(sample['max_rss_mb'] for sample in samples),
+        'pandas_imported': any(sample['pandas_imported'] for sample in samples),
+        'breakdown_ms': dict(import_breakdown("main", args.top)),
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
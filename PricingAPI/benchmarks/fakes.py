@@ -0,0 +1,264 @@
+"""
+In process stand ins for the S3 and dynamoDB clients, and synthetic config tables to serve from them.
+
+The fakes answer the calls main.py makes the way boto3 does, including conditional GETs with
+IfNoneMatch, so the config cache revalidates against them exactly as it does against S3.
+An optional delay simulates the round trip to the AWS service.
+"""
+import csv
+import hashlib
+import random
+import threading
+import time
+from io import BytesIO, StringIO
+import numpy as np
+from botocore.exceptions import ClientError
+
+CREDIT_GRADES = ['Strong', 'Good', 'Satisfactory', 'Weak']
+
+# realistic is in line with the production config, stress is far beyond it
+TABLE_SIZES = {
+    'realistic': {'products': 20, 'curve_points': 120, 'size_points': 50, 'credit_bands': 12, 'market_terms': 120, 'market_simple_bands': 12},
+    'stress': {'products': 400, 'curve_points': 600, 'size_points': 400, 'credit_bands': 60, 'market_terms': 600, 'market_simple_bands': 600},
+}
+
+
+def _latency(seconds: float, jitter: float = 0.0):
+    if seconds or jitter:
+        time.sleep(max(0.0, seconds + random.uniform(-jitter, jitter)))
+
+
+class FakeS3:
+    """
+    Serves objects from a dictionary of key to bytes, the ETag of an object is the md5 of its contents
+    """
+
+    def __init__(self, objects: dict = None, latency: float = 0.0, jitter: float = 0.0):
+        self.objects = {}
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        for key, body in (objects or {}).items():
+            self.put_object(Key = key, Body = body)
+
+    def put_object(self, Key: str, Body: bytes, **kwargs):
+        self.objects[Key] = (bytes(Body), '"' + hashlib.md5(Body).hexdigest() + '"')
+        return {'ETag': self.objects[Key][1]}
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: str = None, **kwargs):
+        _latency(self.latency, self.jitter)
+        with self._lock:
+            self.calls += 1
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'GetObject')
+        body, etag = self.objects[Key]
+        if IfNoneMatch == etag:
+            with self._lock:
+                self.not_modified += 1
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        return {'Body': BytesIO(body), 'ETag': etag, 'ContentLength': len(body)}
+
+
+class FakeDynamoDB:
+    """
+    Keeps written items in memory, keyed on their run_id, or their idempotency_key for the idempotency table.
+    Conditions are evaluated when they are an OR of the attribute_not_exists(name), name <= :value and name = :value
+    terms idempotency.py writes with
+    """
+
+    KEY_ATTRIBUTES = ('run_id', 'idempotency_key')
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.items = {}
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _key(self, item: dict):
+        return next((item[name].get('S') for name in self.KEY_ATTRIBUTES if name in item), None)
+
+    @staticmethod
+    def _condition_holds(stored: dict, ConditionExpression: str, ExpressionAttributeValues: dict):
+        for term in ConditionExpression.split(" OR "):
+            if term.startswith("attribute_not_exists("):
+                if stored is None or term[len("attribute_not_exists("):-1] not in stored:
+                    return True
+                continue
+            name, operator, value = term.split()
+            if stored is None or name not in stored:
+                continue
+            value = ExpressionAttributeValues[value]
+            if operator == "<=" and float(stored[name]['N']) <= float(value['N']):
+                return True
+            if operator == "=" and stored[name] == value:
+                return True
+        return False
+
+    def _check(self, stored: dict, ConditionExpression: str, ExpressionAttributeValues: dict, operation: str):
+        if ConditionExpression and not self._condition_holds(stored, ConditionExpression, ExpressionAttributeValues):
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, operation)
+
+    def put_item(self, TableName: str, Item: dict, ConditionExpression: str = None, ExpressionAttributeValues: dict = None, **kwargs):
+        _latency(self.latency, self.jitter)
+        with self._lock:
+            self.calls += 1
+            self._check(self.items.get((TableName, self._key(Item))), ConditionExpression, ExpressionAttributeValues, 'PutItem')
+            self.items[(TableName, self._key(Item))] = Item
+        return {}
+
+    def delete_item(self, TableName: str, Key: dict, ConditionExpression: str = None, ExpressionAttributeValues: dict = None, **kwargs):
+        _latency(self.latency, self.jitter)
+        (value,) = Key.values()
+        with self._lock:
+            self.calls += 1
+            self._check(self.items.get((TableName, value.get('S'))), ConditionExpression, ExpressionAttributeValues, 'DeleteItem')
+            self.items.pop((TableName, value.get('S')), None)
+        return {}
+
+    def batch_write_item(self, RequestItems: dict, **kwargs):
+        _latency(self.latency, self.jitter)
+        with self._lock:
+            self.calls += 1
+            for table_name, requests in RequestItems.items():
+                for request in requests:
+                    item = request['PutRequest']['Item']
+                    self.items[(table_name, self._key(item))] = item
+        return {'UnprocessedItems': {}}
+
+    def get_item(self, TableName: str, Key: dict, **kwargs):
+        _latency(self.latency, self.jitter)
+        with self._lock:
+            self.calls += 1
+        (value,) = Key.values()
+        item = self.items.get((TableName, value.get('S')))
+        return {'Item': item} if item is not None else {}
+
+
+def _csv(header: list, rows):
+    output = StringIO()
+    writer = csv.writer(output, lineterminator = '\n')
+    writer.writerow(header)
+    writer.writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+def synthetic_tables(size: str = 'realistic', seed: int = 0):
+    """
+    Function used to generate config tables with the layout of the files on S3
+    Args:
+        size: key of TABLE_SIZES
+        seed: seed of the random values
+    Returns:
+        tables: dictionary of S3 key to csv bytes
+        products: names of the generated products
+    """
+    import main
+
+    dims = TABLE_SIZES[size]
+    rng = np.random.default_rng(seed)
+    products = [f"P{i:04d}" for i in range(dims['products'])]
+    max_term = dims['curve_points']
+
+    parameters = '["product", "credit_risk", "term", "amount", "loan_id", "pricing_type"]'
+    methods = '["model", "market", "market_simple"]'
+    tables = {
+        main.PRODUCT_SPECIFICATION_KEY: _csv(['Idx', 'Supported', 'Parameters', 'Pricing_Methods'], [[product, 1, parameters, methods] for product in products]),
+        main.MODEL_TABLE_KEYS[0]: _csv(['Idx', 'NIM'], [[product, round(rng.uniform(0.01, 0.06), 4)] for product in products]),
+    }
+
+    terms = np.arange(1, max_term + 1)
+    sizes = np.arange(1, dims['size_points'] + 1) * 10
+    for key, axis, points in ((main.MODEL_TABLE_KEYS[1], 'Time(in months)', terms), (main.MODEL_TABLE_KEYS[3], 'Time(in months)', terms), (main.MODEL_TABLE_KEYS[2], 'Size(in thousands)', sizes)):
+        values = np.round(rng.uniform(0, 5, (len(points), len(products))), 3)
+        tables[key] = _csv([axis] + products, [[point] + row for point, row in zip(points.tolist(), values.tolist())])
+
+    # credit premia bands split the terms of every product and grade into disjoint intervals
+    bands = dims['credit_bands']
+    edges = np.linspace(0, max_term, bands + 1).astype(int)
+    rows = []
+    for product in products:
+        for grade_index, grade in enumerate(CREDIT_GRADES):
+            for band in range(bands):
+                low = edges[band] + (1 if band else 0)
+                rows.append([product, low, edges[band + 1], grade, round(100 + 100 * grade_index + rng.uniform(0, 50), 2)])
+    tables[main.MODEL_TABLE_KEYS[4]] = _csv(['Product', 'DimOneValMin', 'DimOneValMax', 'DimTwoVal', 'Value'], rows)
+
+    market_terms = np.arange(1, dims['market_terms'] + 1)
+    tables[main.MARKET_TABLE_KEY] = _csv(['Term'] + CREDIT_GRADES, [[term] + np.round(rng.uniform(5, 50, 4), 2).tolist() for term in market_terms.tolist()])
+
+    # every term band has the same ten credit risk rows, so the nearest row is always inside the band
+    band_edges = np.linspace(0, max_term, dims['market_simple_bands'] + 1).astype(int)
+    rows = []
+    for band in range(dims['market_simple_bands']):
+        for risk in range(1, 11):
+            rows.append([band_edges[band], band_edges[band + 1], risk, round(1000 - 80 * risk + rng.uniform(0, 20), 2)])
+    tables[main.MARKET_SIMPLE_TABLE_KEY] = _csv(['DimOneValMin', 'DimOneValMax', 'DimTwoValue', 'Value'], rows)
+
+    return tables, products
+
+
+def synthetic_loans(products: list, count: int, size: str = 'realistic', seed: int = 1):
+    """
+    Function used to generate query string parameters of loans that can be priced from synthetic_tables
+    Args:
+        products: products of the synthetic tables
+        count: number of loans
+        size: key of TABLE_SIZES the tables were generated with
+        seed: seed of the random values
+    Returns:
+        loans: list of dictionaries of query string parameters, model, market and market_simple in turn
+    """
+    dims = TABLE_SIZES[size]
+    rng = np.random.default_rng(seed)
+    loans = []
+    for i in range(count):
+        pricing_type = ("model", "market", "market_simple")[i % 3]
+        term = int(rng.integers(1, min(dims['curve_points'], dims['market_terms']) + 1))
+        credit_risk = CREDIT_GRADES[int(rng.integers(4))] if pricing_type == "model" else str(round(float(rng.uniform(1, 10)), 1))
+        loans.append({
+            "product": products[int(rng.integers(len(products)))], "credit_risk": credit_risk, "term": str(term),
+            "amount": str(int(rng.integers(10, dims['size_points'] * 10) * 1000)), "loan_id": f"loan-{i}",
+            "pricing_type": pricing_type, "user_name": "bench@example.com", "source_name": "benchmark",
+        })
+    return loans
+
+
+def install_fakes(size: str = 'realistic', config_format: str = 'csv', s3_latency: float = 0.0, dynamodb_latency: float = 0.0, jitter: float = 0.0):
+    """
+    Function used to point the API at fake clients serving synthetic tables, with fresh caches
+    Args:
+        size: size of the synthetic tables, see TABLE_SIZES
+        config_format: csv to serve the csv files only, bundle to also publish a config bundle
+        s3_latency: seconds every S3 call takes
+        dynamodb_latency: seconds every dynamoDB call takes
+        jitter: the latency of a call varies by up to this many seconds either way
+    Returns:
+        s3: FakeS3 serving the tables
+        products: names of the generated products
+    """
+    import main
+    from audit import AuditSink
+    from config_bundle import write_bundle
+    from config_cache import ConfigCache
+    from csv_table import parse_csv
+    from idempotency import IdempotencyStore
+    from quote_cache import QuoteCache
+
+    tables, products = synthetic_tables(size)
+    s3 = FakeS3(tables, s3_latency, jitter)
+    if config_format == "bundle":
+        sources = {key: s3.objects[key][1] for key in tables}
+        s3.put_object(Key = main.BUNDLE_KEY, Body = write_bundle({key: parse_csv(body) for key, body in tables.items()}, sources))
+
+    main.s3 = s3
+    main.dynamodb = FakeDynamoDB(dynamodb_latency, jitter)
+    main.audit_sink = AuditSink(main.dynamodb, mode = "sync")
+    main.idempotency_store = IdempotencyStore(main.dynamodb)
+    main.config_cache = ConfigCache(spill_dir = None)
+    main.quote_cache = QuoteCache()
+    main.CONFIG_FORMAT = "auto" if config_format == "bundle" else "csv"
+    main._bundle_unavailable_until = 0.0
+    return s3, products
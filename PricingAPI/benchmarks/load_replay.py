@@ -0,0 +1,362 @@
+"""
+Load replay harness for the handler.
+
+Events are replayed against the handler from a pool of concurrent clients, either in process or
+over HTTP. By default the events are generated from synthetic config tables. --corpus replays a
+JSONL file of events in the shape API Gateway sends ({"queryStringParameters": {...}}).
+In process and through the local HTTP stand in, S3 and dynamoDB are in process fakes that
+take --s3-latency-ms and --dynamodb-latency-ms to answer, so time spent waiting on I/O shows up
+the way it does on lambda.
+
+Without --rate every client sends its next event as soon as the last one returns (closed loop).
+With --rate events arrive at that many per second whatever the state of the clients (open loop).
+The latency of an event is then measured from the time it arrived, so it includes the time it
+queued for a free client.
+
+The report gives throughput, error rate and p50/p95/p99 latency overall, by pricing type and by
+product. The concurrency figure is throughput x mean latency (Little's law), the number of lambda
+environments that would be busy at that load.
+
+Usage:
+    python benchmarks/load_replay.py [--corpus events.jsonl] [--requests 2000] [--concurrency 16] [--rate 200]
+                                     [--mix model=0.5,market=0.3,market_simple=0.2] [--target inprocess|http]
+                                     [--url http://localhost:8080/] [--s3-latency-ms 20] [--dynamodb-latency-ms 8]
+                                     [--output load.json]
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PRICING_API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PRICING_API_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+
+import numpy as np
+import main as api
+from fakes import install_fakes, synthetic_loans
+
+
+def read_corpus(path: str):
+    """
+    Function used to read a JSONL file of events
+    Args:
+        path: file with one event per line, a line of params is wrapped as the queryStringParameters of an event
+    Returns:
+        events: list of events
+    """
+    events = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                events.append(event if 'queryStringParameters' in event or 'body' in event else {'queryStringParameters': event})
+    return events
+
+
+def event_labels(event: dict):
+    """
+    Function used to find the pricing type and product an event is reported under
+    Args:
+        event: event passed to the handler
+    Returns:
+        pricing_type: pricing type of the event, batch for a batch invocation
+        product: product of the event, batch for a batch invocation
+    """
+    params = event.get('queryStringParameters')
+    if not isinstance(params, dict):
+        return "batch", "batch"
+    return str(params.get('pricing_type')), str(params.get('product'))
+
+
+def parse_mix(mix: str):
+    """
+    Function used to read the share of each pricing type
+    Args:
+        mix: comma separated pricing_type=weight pairs
+    Returns:
+        weights: dictionary of pricing type to weight
+    """
+    weights = {}
+    for part in mix.split(','):
+        pricing_type, weight = part.split('=')
+        weights[pricing_type.strip()] = float(weight)
+    return weights
+
+
+def event_stream(events: list, mix: dict = None, seed: int = 0):
+    """
+    Function used to cycle through events, drawing the pricing type of every event from mix when it is given
+    Args:
+        events: events to replay
+        mix: dictionary of pricing type to weight
+        seed: seed of the draws
+    Returns:
+        stream: endless iterator of events
+    """
+    if not mix:
+        yield from itertools.cycle(events)
+        return
+    by_type = defaultdict(list)
+    for event in events:
+        by_type[event_labels(event)[0]].append(event)
+    missing = [pricing_type for pricing_type in mix if not by_type.get(pricing_type)]
+    if missing:
+        raise ValueError(f"The corpus has no events with pricing type {missing}")
+    rng = random.Random(seed)
+    cycles = {pricing_type: itertools.cycle(by_type[pricing_type]) for pricing_type in mix}
+    pricing_types, weights = list(mix), list(mix.values())
+    while True:
+        yield next(cycles[rng.choices(pricing_types, weights)[0]])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Local stand in for API Gateway, a GET becomes an event with the query string as queryStringParameters
+    and a POST an event with the request body as body
+    """
+
+    def do_GET(self):
+        query = urllib.parse.urlsplit(self.path).query
+        self._invoke({'queryStringParameters': dict(urllib.parse.parse_qsl(query)) or None})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._invoke({'body': self.rfile.read(length).decode('utf-8')})
+
+    def _invoke(self, event: dict):
+        response = api.handler(event, None)
+        body = response.get('body', '').encode('utf-8')
+        self.send_response(response.get('statusCode', 500))
+        for name, value in (response.get('headers') or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def http_invoker(url: str):
+    """
+    Function used to build a function that sends an event to an HTTP endpoint the way a client of API Gateway would
+    Args:
+        url: address of the endpoint
+    Returns:
+        invoke: function of an event returning the status code
+    """
+    def invoke(event: dict):
+        if 'body' in event:
+            request = urllib.request.Request(url, data = event['body'].encode('utf-8'), method = 'POST', headers = {'Content-Type': 'application/json'})
+        else:
+            request = urllib.request.Request(url + '?' + urllib.parse.urlencode(event.get('queryStringParameters') or {}))
+        try:
+            with urllib.request.urlopen(request, timeout = 30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return invoke
+
+
+def inprocess_invoke(event: dict):
+    return api.handler(event, None).get('statusCode', 500)
+
+
+def replay(invoke, stream, requests: int, concurrency: int, rate: float = None, arrival: str = "poisson", seed: int = 0):
+    """
+    Function used to replay events from concurrent clients
+    Args:
+        invoke: function of an event returning the status code
+        stream: iterator of events
+        requests: number of events to send
+        concurrency: number of concurrent clients
+        rate: events arriving per second, None for a closed loop
+        arrival: poisson for exponential gaps between arrivals, uniform for even gaps
+        seed: seed of the arrival gaps
+    Returns:
+        samples: list of (pricing type, product, status code, latency in seconds)
+        seconds: duration of the replay
+    """
+    samples = []
+    lock = threading.Lock()
+
+    def send(event, arrived):
+        try:
+            status = invoke(event)
+        except Exception as e:
+            print(f"Request failed: {e!r}", file = sys.stderr)
+            status = 0
+        latency = time.perf_counter() - arrived
+        with lock:
+            samples.append(event_labels(event) + (status, latency))
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency, thread_name_prefix = "client") as pool:
+        if rate is None:
+            events = list(itertools.islice(stream, requests))
+            queue = iter(events)
+            queue_lock = threading.Lock()
+
+            def client():
+                while True:
+                    with queue_lock:
+                        event = next(queue, None)
+                    if event is None:
+                        return
+                    send(event, time.perf_counter())
+
+            for _ in range(concurrency):
+                pool.submit(client)
+        else:
+            arrival_time = start
+            for event in itertools.islice(stream, requests):
+                arrival_time += rng.expovariate(rate) if arrival == "poisson" else 1 / rate
+                delay = arrival_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, event, arrival_time)
+
+    return samples, time.perf_counter() - start
+
+
+def summarise(samples: list, seconds: float):
+    """
+    Function used to report on a group of replayed events
+    Args:
+        samples: list of (pricing type, product, status code, latency in seconds)
+        seconds: duration of the replay
+    Returns:
+        summary: dictionary of counts, throughput, error rate and latency percentiles in milliseconds
+    """
+    latencies = np.array([sample[3] for sample in samples]) * 1000
+    statuses = defaultdict(int)
+    for sample in samples:
+        statuses[str(sample[2])] += 1
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    throughput = len(samples) / seconds if seconds else 0.0
+    return {
+        'requests': len(samples),
+        'throughput_per_second': round(throughput, 1),
+        'error_rate': round(errors / len(samples), 4),
+        'status_codes': dict(statuses),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'max_ms': round(float(latencies.max()), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'concurrency': round(throughput * float(latencies.mean()) / 1000, 2),
+    }
+
+
+def report(samples: list, seconds: float, top_products: int = 20):
+    """
+    Function used to group replayed events by pricing type and product
+    Args:
+        samples: list of (pricing type, product, status code, latency in seconds)
+        seconds: duration of the replay
+        top_products: number of products with the most events that are reported on their own
+    Returns:
+        report: dictionary with the overall, by_pricing_type and by_product summaries
+    """
+    by_type, by_product = defaultdict(list), defaultdict(list)
+    for sample in samples:
+        by_type[sample[0]].append(sample)
+        by_product[sample[1]].append(sample)
+    products = sorted(by_product, key = lambda product: len(by_product[product]), reverse = True)[:top_products]
+    return {
+        'overall': summarise(samples, seconds),
+        'by_pricing_type': {pricing_type: summarise(group, seconds) for pricing_type, group in sorted(by_type.items())},
+        'by_product': {product: summarise(by_product[product], seconds) for product in products},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay events against the handler from concurrent clients and report latency percentiles")
+    parser.add_argument('--corpus', help="JSONL file of events, synthetic events are generated when it is not given")
+    parser.add_argument('--requests', type=int, default=2000, help="number of events to send")
+    parser.add_argument('--concurrency', type=int, default=16, help="number of concurrent clients")
+    parser.add_argument('--rate', type=float, help="events arriving per second, without it every client sends back to back")
+    parser.add_argument('--arrival', choices=('poisson', 'uniform'), default='poisson', help="gaps between arrivals when --rate is given")
+    parser.add_argument('--mix', help="share of each pricing type, for example model=0.5,market=0.3,market_simple=0.2")
+    parser.add_argument('--target', choices=('inprocess', 'http'), default='inprocess', help="call the handler directly or through a local HTTP stand in for API Gateway")
+    parser.add_argument('--url', help="replay over HTTP against a server that is already running instead")
+    parser.add_argument('--size', choices=('realistic', 'stress'), default='realistic', help="size of the synthetic config tables")
+    parser.add_argument('--format', choices=('csv', 'bundle'), default='csv', help="serve the csv files only or also a config bundle")
+    parser.add_argument('--s3-latency-ms', type=float, default=20.0, help="time every S3 call takes")
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=8.0, help="time every dynamoDB call takes")
+    parser.add_argument('--jitter-ms', type=float, default=2.0, help="the latency of a call varies by up to this much either way")
+    parser.add_argument('--config-ttl', type=float, help="seconds config tables are cached for, 0 reads them from S3 on every request")
+    parser.add_argument('--audit-mode', choices=('sync', 'buffered', 'async'), default='sync', help="how audit rows are written")
+    parser.add_argument('--top-products', type=int, default=20, help="number of products reported on their own")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the pricing type draws and arrival gaps")
+    parser.add_argument('--output', help="write the report to this json file")
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.url:
+        invoke = http_invoker(args.url)
+    else:
+        from audit import AuditSink
+
+        _, products = install_fakes(args.size, args.format, args.s3_latency_ms / 1000, args.dynamodb_latency_ms / 1000, args.jitter_ms / 1000)
+        api.audit_sink = AuditSink(api.dynamodb, mode = args.audit_mode)
+        if args.config_ttl is not None:
+            api.config_cache.ttl = args.config_ttl
+        if args.target == "http":
+            server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+            threading.Thread(target = server.serve_forever, daemon = True).start()
+            invoke = http_invoker(f"http://127.0.0.1:{server.server_address[1]}/")
+        else:
+            invoke = inprocess_invoke
+
+    if args.corpus:
+        events = read_corpus(args.corpus)
+    elif args.url:
+        parser.error("--corpus is needed to replay against --url, the synthetic events only price against the local fakes")
+    else:
+        events = [{'queryStringParameters': loan} for loan in synthetic_loans(products, 3000, args.size)]
+
+    stream = event_stream(events, parse_mix(args.mix) if args.mix else None, args.seed)
+    # the handler logs every response, which would drown out the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        samples, seconds = replay(invoke, stream, args.requests, args.concurrency, args.rate, args.arrival, args.seed)
+        if not args.url:
+            api.audit_sink.flush(timeout = 10)
+    if server is not None:
+        server.shutdown()
+
+    result = {
+        'settings': {key: value for key, value in vars(args).items() if key != 'output'},
+        'seconds': round(seconds, 3),
+    }
+    result.update(report(samples, seconds, args.top_products))
+
+    overall = result['overall']
+    print(f"{overall['requests']} requests in {seconds:.2f}s, {overall['throughput_per_second']}/s, error rate {overall['error_rate']:.2%}, "
+          f"p50 {overall['p50_ms']} ms p95 {overall['p95_ms']} ms p99 {overall['p99_ms']} ms", file = sys.stderr)
+    for pricing_type, summary in result['by_pricing_type'].items():
+        print(f"  {pricing_type:<14} {summary['requests']:>7} requests  error rate {summary['error_rate']:.2%}  p50 {summary['p50_ms']} ms p95 {summary['p95_ms']} ms p99 {summary['p99_ms']} ms", file = sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Microbenchmarks of the pricing functions and the handler.
+
+Synthetic config tables are served from an in process fake S3 and audit rows go to a fake
+dynamoDB, so only the code of the API is timed. Every benchmark runs cold, with the config
+and quote caches emptied before each call so the tables are downloaded and parsed again, and
+warm, with the tables cached and a different loan on every call.
+
+The report is json so that runs on two commits can be compared with --compare.
+
+Usage:
+    python benchmarks/pricing_bench.py [--size realistic|stress] [--format csv|bundle] [--repeat 200]
+                                       [--cold-repeat 20] [--output bench.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+PRICING_API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PRICING_API_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+
+import numpy as np
+import main as api
+from fakes import install_fakes, synthetic_loans
+
+
+def clear_caches():
+    api.config_cache.clear()
+    api.quote_cache.clear()
+    api._bundle_unavailable_until = 0.0
+
+
+def summarise(name: str, mode: str, samples: list):
+    """
+    Function used to turn call durations into a benchmark result
+    Args:
+        name: name of the benchmark
+        mode: cold or warm
+        samples: durations of the calls in seconds
+    Returns:
+        result: dictionary of statistics in microseconds
+    """
+    micros = np.array(samples) * 1e6
+    return {
+        'name': name,
+        'mode': mode,
+        'calls': len(samples),
+        'min_us': round(float(micros.min()), 2),
+        'median_us': round(float(np.median(micros)), 2),
+        'mean_us': round(float(micros.mean()), 2),
+        'p95_us': round(float(np.percentile(micros, 95)), 2),
+        'max_us': round(float(micros.max()), 2),
+        'ops_per_second': round(1e6 / float(np.median(micros)), 1),
+    }
+
+
+def run(name: str, call, loans: list, repeat: int, cold_repeat: int):
+    """
+    Function used to time a function cold and warm
+    Args:
+        name: name of the benchmark
+        call: function of one loan
+        loans: loans to call the function with, used in turn
+        repeat: number of warm calls
+        cold_repeat: number of cold calls
+    Returns:
+        results: cold and warm benchmark results
+    """
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        samples = []
+        for i in range(cold_repeat):
+            clear_caches()
+            loan = loans[i % len(loans)]
+            start = time.perf_counter()
+            call(loan)
+            samples.append(time.perf_counter() - start)
+        if samples:
+            results.append(summarise(name, "cold", samples))
+
+        call(loans[0])
+        samples = []
+        for i in range(repeat):
+            loan = loans[i % len(loans)]
+            start = time.perf_counter()
+            call(loan)
+            samples.append(time.perf_counter() - start)
+        results.append(summarise(name, "warm", samples))
+    return results
+
+
+def benchmarks(products: list, size: str, batch_size: int):
+    """
+    Function used to list the benchmarks
+    Args:
+        products: names of the generated products
+        size: size of the synthetic tables
+        batch_size: number of loans in the batch handler benchmark
+    Returns:
+        benchmarks: list of (name, function of one loan, loans)
+    """
+    loans = synthetic_loans(products, 3000, size)
+    by_type = {pricing_type: [loan for loan in loans if loan['pricing_type'] == pricing_type] for pricing_type in ("model", "market", "market_simple")}
+    batch = {'body': json.dumps(loans[:batch_size])}
+    s3 = lambda: api.s3
+
+    return [
+        ("product_specification", lambda loan: api.product_specification(s3(), loan['product']), loans),
+        ("open_pricingband_model", lambda loan: api.open_pricingband_model(s3()), loans),
+        ("open_pricingband_market", lambda loan: api.open_pricingband_market(s3()), loans),
+        ("open_pricingband_market_simple", lambda loan: api.open_pricingband_market_simple(s3()), loans),
+        ("pricing_calc_model", lambda loan: api.pricing_calc_model(s3(), loan['product'], loan['credit_risk'], loan['term'], loan['amount']), by_type["model"]),
+        ("pricing_calc_market", lambda loan: api.pricing_calc_market(s3(), float(loan['credit_risk']), loan['term']), by_type["market"]),
+        ("pricing_calc_market_simple", lambda loan: api.pricing_calc_market_simple(s3(), float(loan['credit_risk']), loan['term']), by_type["market_simple"]),
+        ("handler_model", lambda loan: api.handler({'queryStringParameters': loan}, None), by_type["model"]),
+        ("handler_market", lambda loan: api.handler({'queryStringParameters': loan}, None), by_type["market"]),
+        ("handler_market_simple", lambda loan: api.handler({'queryStringParameters': loan}, None), by_type["market_simple"]),
+        (f"handler_batch_{batch_size}", lambda loan: api.handler(batch, None), [batch]),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = PRICING_API_DIR, capture_output = True, text = True, check = True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(report: dict, baseline: dict):
+    """
+    Function used to compare the median of every benchmark with a baseline report
+    Args:
+        report: report of this run
+        baseline: report of an earlier run
+    Returns:
+        lines: one line per benchmark in both reports, a ratio below 1 is faster than the baseline
+    """
+    before = {(result['name'], result['mode']): result for result in baseline['results']}
+    lines = []
+    for result in report['results']:
+        old = before.get((result['name'], result['mode']))
+        if old is not None:
+            ratio = result['median_us'] / old['median_us'] if old['median_us'] else float('nan')
+            lines.append(f"{result['name']:<32} {result['mode']:<5} {old['median_us']:>12.1f} -> {result['median_us']:>12.1f} us  x{ratio:.2f}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pricing functions and the handler against in process fakes of S3 and dynamoDB")
+    parser.add_argument('--size', choices=('realistic', 'stress'), default='realistic', help="size of the synthetic config tables")
+    parser.add_argument('--format', choices=('csv', 'bundle'), default='csv', help="serve the csv files only or also a config bundle")
+    parser.add_argument('--repeat', type=int, default=200, help="number of warm calls per benchmark")
+    parser.add_argument('--cold-repeat', type=int, default=20, help="number of cold calls per benchmark")
+    parser.add_argument('--batch-size', type=int, default=500, help="number of loans in the batch handler benchmark")
+    parser.add_argument('--filter', help="only run benchmarks whose name contains this text")
+    parser.add_argument('--output', help="write the report to this json file")
+    parser.add_argument('--compare', help="json report of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    _, products = install_fakes(args.size, args.format)
+    results = []
+    for name, call, loans in benchmarks(products, args.size, args.batch_size):
+        if args.filter and args.filter not in name:
+            continue
+        timed = run(name, call, loans, args.repeat, args.cold_repeat)
+        results += timed
+        for result in timed:
+            print(f"{result['name']:<32} {result['mode']:<5} median {result['median_us']:>12.1f} us  p95 {result['p95_us']:>12.1f} us", file = sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'size': args.size,
+        'format': args.format,
+        'results': results,
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(report, json.load(f))), file = sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
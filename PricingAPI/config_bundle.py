@@ -0,0 +1,166 @@
+"""
+Binary columnar bundle of the pricing config tables.
+
+The csv config files on S3 are compiled into a single object so the lambda reads one file
+and maps its columns straight onto numpy arrays instead of decoding and parsing every csv.
+
+Layout: MAGIC | header length (uint64, little endian) | JSON header | padding | column data.
+The header holds the bundle version, the ETag of every source csv and, per table, the name,
+dtype, length and offset of each column. Columns are aligned so they can be read in place.
+
+Usage:
+    python config_bundle.py --bucket <bucket> --upload
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import struct
+import numpy as np
+from csv_table import parse_csv
+
+MAGIC = b"PRCBNDL1"
+ALIGNMENT = 64
+
+
+def _align(offset: int):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _column_array(values):
+    """
+    Function used to convert a parsed csv column into an array that can be stored in the bundle
+    Args:
+        values: column of a dataframe
+    Returns:
+        array: numpy array with a fixed size dtype, text columns are stored as unicode with missing values as ''
+    """
+    array = np.asarray(values)
+    if array.dtype == object:
+        array = np.array(['' if value is None or (isinstance(value, float) and np.isnan(value)) else str(value) for value in array.tolist()], dtype=str)
+    return np.ascontiguousarray(array)
+
+
+def write_bundle(tables: dict, sources: dict):
+    """
+    Function used to compile config tables into a bundle
+    Args:
+        tables: dictionary of S3 key to dataframe
+        sources: dictionary of S3 key to the ETag of the csv the table was parsed from
+    Returns:
+        bundle: bytes of the bundle
+    """
+    digest = hashlib.sha256()
+    header = {'tables': {}, 'sources': sources}
+    blobs = []
+    offset = 0
+    for key, table in tables.items():
+        columns = []
+        for name in list(table):
+            array = _column_array(table[name])
+            offset = _align(offset)
+            columns.append({'name': name, 'dtype': array.dtype.str, 'length': len(array), 'offset': offset})
+            blobs.append((offset, array.tobytes()))
+            digest.update(key.encode() + name.encode() + array.dtype.str.encode() + array.tobytes())
+            offset += array.nbytes
+        header['tables'][key] = columns
+    header['version'] = digest.hexdigest()[:16]
+    header['created'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+    bundle = bytearray(data_start + offset)
+    bundle[:len(MAGIC)] = MAGIC
+    bundle[len(MAGIC):len(MAGIC) + 8] = struct.pack('<Q', len(header_bytes))
+    bundle[len(MAGIC) + 8:len(MAGIC) + 8 + len(header_bytes)] = header_bytes
+    for column_offset, blob in blobs:
+        bundle[data_start + column_offset:data_start + column_offset + len(blob)] = blob
+
+    return bytes(bundle)
+
+
+class ConfigBundle:
+    """
+    Config tables read from a bundle. Each table is a dictionary of column name to a read only
+    numpy array that points into the bundle buffer (bytes or a memory mapped file) without copying
+    """
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a pricing config bundle")
+        (header_length,) = struct.unpack('<Q', view[len(MAGIC):len(MAGIC) + 8])
+        header = json.loads(bytes(view[len(MAGIC) + 8:len(MAGIC) + 8 + header_length]).decode('utf-8'))
+        data_start = _align(len(MAGIC) + 8 + header_length)
+
+        self.version = header['version']
+        self.created = header.get('created')
+        self.sources = header.get('sources', {})
+        self.tables = {}
+        for key, columns in header['tables'].items():
+            self.tables[key] = {
+                column['name']: np.frombuffer(buffer, dtype=np.dtype(column['dtype']), count=column['length'], offset=data_start + column['offset'])
+                for column in columns
+            }
+
+    def __contains__(self, key: str):
+        return key in self.tables
+
+    def table(self, key: str):
+        return self.tables[key]
+
+
+def read_bundle(buffer):
+    """
+    Function used to parse a bundle downloaded from S3 or memory mapped from disk
+    Args:
+        buffer: bytes like object holding the bundle
+    Returns:
+        bundle: ConfigBundle
+    """
+    return ConfigBundle(buffer)
+
+
+def build_bundle(s3, bucket: str, keys):
+    """
+    Function used to compile the config csv files on S3 into a bundle, the csv files are parsed exactly as the lambda parses them
+    Args:
+        s3: s3 connection
+        bucket: bucket holding the config files
+        keys: keys of the csv files to include
+    Returns:
+        bundle: bytes of the bundle
+    """
+    tables, sources = {}, {}
+    for key in keys:
+        response = s3.get_object(Bucket = bucket, Key = key)
+        tables[key] = parse_csv(response['Body'].read())
+        sources[key] = response.get('ETag')
+
+    return write_bundle(tables, sources)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the pricing config csv files into a binary bundle")
+    parser.add_argument('--bucket', required=True, help="bucket holding the config csv files")
+    parser.add_argument('--out', help="write the bundle to this local file")
+    parser.add_argument('--upload', action='store_true', help="upload the bundle next to the csv files so the API starts using it")
+    args = parser.parse_args(argv)
+
+    import boto3
+    from main import BUNDLE_KEY, CONFIG_TABLE_KEYS
+
+    s3 = boto3.client('s3')
+    bundle = build_bundle(s3, args.bucket, CONFIG_TABLE_KEYS)
+    print(f"Built bundle {ConfigBundle(bundle).version} ({len(bundle)} bytes) from {len(CONFIG_TABLE_KEYS)} tables")
+
+    if args.out:
+        with open(args.out, 'wb') as f:
+            f.write(bundle)
+    if args.upload:
+        s3.put_object(Bucket = args.bucket, Key = BUNDLE_KEY, Body = bundle, ContentType = 'application/octet-stream')
+        print(f"Uploaded to s3://{args.bucket}/{BUNDLE_KEY}")
+
+
+if __name__ == "__main__":
+    main()
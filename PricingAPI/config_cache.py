@@ -0,0 +1,283 @@
+import mmap
+import os
+import threading
+import time
+from urllib.parse import quote
+
+from botocore.exceptions import ClientError
+
+# Config tables are edited on rbCore and published to S3, a cached table is
+# served for at most CONFIG_CACHE_TTL seconds before it is revalidated
+DEFAULT_TTL = float(os.environ.get("CONFIG_CACHE_TTL", "60"))
+
+# Objects fetched with spill=True are also written here so that a new runtime in the same
+# lambda execution environment can map them from disk after a 304 instead of downloading them
+DEFAULT_SPILL_DIR = os.environ.get("CONFIG_SPILL_DIR", "/tmp/pricing-config")
+
+
+class ConfigLoadError(Exception):
+    """
+    Raised when a config table cannot be fetched from S3 or parsed
+    """
+
+
+def _not_modified(error: ClientError):
+    """
+    Function used to recognise the response S3 gives to a conditional GET when the object has not changed
+    Args:
+        error: exception raised by get_object
+    Returns:
+        True when S3 answered 304 Not Modified
+    """
+    code = str(error.response.get('Error', {}).get('Code', ''))
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in ('304', 'NotModified') or status == 304
+
+
+class _Entry:
+    __slots__ = ('value', 'etag', 'checked_at')
+
+    def __init__(self, value, etag: str, checked_at: float):
+        self.value = value
+        self.etag = etag
+        self.checked_at = checked_at
+
+
+class ConfigCache:
+    """
+    Cache of parsed S3 config tables that lives for as long as the lambda container is warm.
+    Tables are served from memory for ttl seconds, after that the cached ETag is sent with
+    If-None-Match so an unchanged table costs a 304 instead of a download and a parse.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, clock=time.monotonic, spill_dir: str = DEFAULT_SPILL_DIR):
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self._clock = clock
+        self._entries = {}
+        self._derived = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.refreshes = 0
+
+    def get(self, s3, bucket: str, key: str, parse):
+        """
+        Function used to return the parsed contents of an S3 object, downloading it only when it is new or has changed
+        Args:
+            s3: s3 connection
+            bucket: bucket the object is stored in
+            key: key of the object
+            parse: callable turning the raw object bytes into the value that is cached
+        Returns:
+            value: parsed object
+        """
+        return self.get_versioned(s3, bucket, key, parse)[0]
+
+    def fresh(self, bucket: str, key: str):
+        """
+        Function used to return a cached object whose ttl has not passed, without calling S3
+        Args:
+            bucket: bucket the object is stored in
+            key: key of the object
+        Returns:
+            cached: tuple of the parsed object and its ETag, None when the object has to be fetched or revalidated
+        """
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is None or self._clock() - entry.checked_at >= self.ttl:
+                return None
+            self.hits += 1
+            return entry.value, entry.etag
+
+    def get_versioned(self, s3, bucket: str, key: str, parse, spill: bool = False, copy: tuple = None):
+        """
+        Function used to return the parsed contents of an S3 object together with the ETag it was parsed from
+        Args:
+            s3: s3 connection
+            bucket: bucket the object is stored in
+            key: key of the object
+            parse: callable turning the raw object bytes into the value that is cached
+            spill: keep a copy of the object on local disk, parse must then also accept a memory mapped file
+            copy: optional tuple of a parsed copy of the object held elsewhere, such as a table of the config bundle, and the ETag
+                  it was made from. When S3 answers 304 for that ETag the copy is cached instead of downloading the object
+        Returns:
+            value: parsed object
+            etag: ETag of the object, None when S3 did not return one
+        """
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is not None and self._clock() - entry.checked_at < self.ttl:
+                self.hits += 1
+                return entry.value, entry.etag
+
+        # value served when S3 answers 304 and nothing is cached yet
+        unchanged = None
+        spilled = self._read_spill(bucket, key) if spill and entry is None else None
+        if spilled is not None:
+            unchanged, etag = (lambda: parse(spilled[0])), spilled[1]
+        elif entry is None and copy is not None and copy[1]:
+            unchanged, etag = (lambda: copy[0]), copy[1]
+        else:
+            etag = entry.etag if entry is not None else None
+
+        if etag is None:
+            response = s3.get_object(Bucket = bucket, Key = key)
+        else:
+            try:
+                response = s3.get_object(Bucket = bucket, Key = key, IfNoneMatch = etag)
+            except ClientError as e:
+                if not _not_modified(e):
+                    raise
+                if entry is None:
+                    entry = _Entry(unchanged(), etag, self._clock())
+                    with self._lock:
+                        self._entries[(bucket, key)] = entry
+                        self.revalidations += 1
+                    return entry.value, entry.etag
+                with self._lock:
+                    entry.checked_at = self._clock()
+                    self.revalidations += 1
+                return entry.value, entry.etag
+
+        body = response['Body'].read()
+        value = parse(body)
+        etag = response.get('ETag')
+        if spill and etag:
+            self._write_spill(bucket, key, body, etag)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.refreshes += 1
+            # Objects without an ETag cannot be revalidated so they are never cached
+            if etag and self.ttl > 0:
+                self._entries[(bucket, key)] = _Entry(value, etag, self._clock())
+            else:
+                self._entries.pop((bucket, key), None)
+
+        return value, etag
+
+    def _spill_path(self, bucket: str, key: str):
+        return os.path.join(self.spill_dir, quote(f"{bucket}/{key}", safe=''))
+
+    def _read_spill(self, bucket: str, key: str):
+        """
+        Function used to map an object that an earlier runtime spilled to disk
+        Returns:
+            contents: read only memory map of the object
+            etag: ETag of the spilled object
+            None when nothing was spilled for the object
+        """
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(bucket, key)
+        try:
+            with open(path + '.etag') as f:
+                etag = f.read()
+            with open(path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ), etag
+        except (OSError, ValueError):
+            return None
+
+    def _write_spill(self, bucket: str, key: str, body: bytes, etag: str):
+        if not self.spill_dir:
+            return
+        path = self._spill_path(bucket, key)
+        try:
+            os.makedirs(self.spill_dir, exist_ok = True)
+            # the ETag is removed first and written last so a reader never pairs an ETag with the wrong contents
+            if os.path.exists(path + '.etag'):
+                os.remove(path + '.etag')
+            for suffix, data, mode in (('', body, 'wb'), ('.etag', etag, 'w')):
+                with open(f"{path}{suffix}.{os.getpid()}", mode) as f:
+                    f.write(data)
+                os.replace(f"{path}{suffix}.{os.getpid()}", path + suffix)
+        except OSError as e:
+            print(f"Unable to spill {key} to {self.spill_dir}: {e}")
+
+    def derived(self, name: str, version: tuple, build):
+        """
+        Function used to cache a value computed from config tables, such as compiled lookup structures, for as long as the tables are unchanged
+        Args:
+            name: name of the derived value
+            version: ETags of the tables the value is built from
+            build: callable that builds the value
+        Returns:
+            value: derived value, rebuilt whenever version changes
+        """
+        if None in version or self.ttl <= 0:
+            return build()
+        with self._lock:
+            cached = self._derived.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = build()
+        with self._lock:
+            self._derived[name] = (version, value)
+        return value
+
+    def version(self, bucket: str, key: str):
+        """
+        Function used to get the ETag of the cached copy of an object
+        Args:
+            bucket: bucket the object is stored in
+            key: key of the object
+        Returns:
+            etag: ETag of the cached object, None when the object is not cached
+        """
+        entry = self._entries.get((bucket, key))
+        return None if entry is None else entry.etag
+
+    def values(self):
+        """
+        Function used to get the parsed objects held by the cache
+        Returns:
+            values: dictionary of key to parsed object
+        """
+        with self._lock:
+            return {key: entry.value for (_, key), entry in self._entries.items()}
+
+    def derived_value(self, name: str):
+        """
+        Function used to get a derived value without building it
+        Args:
+            name: name of the derived value
+        Returns:
+            value: derived value, None when it has not been built
+        """
+        with self._lock:
+            cached = self._derived.get(name)
+        return None if cached is None else cached[1]
+
+    def stats(self):
+        """
+        Function used to report cache counters
+        Returns:
+            dictionary of hit, miss, revalidation and refresh counts along with the number of cached objects
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'refreshes': self.refreshes,
+            'entries': len(self._entries),
+        }
+
+    def expire(self):
+        """
+        Function used to make every cached object stale, the next read of an object revalidates it with its ETag and keeps it when it has not changed
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                entry.checked_at = float('-inf')
+
+    def clear(self):
+        """
+        Function used to drop every cached object, counters are left as they are
+        """
+        with self._lock:
+            self._entries.clear()
+            self._derived.clear()
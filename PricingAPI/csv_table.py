@@ -0,0 +1,247 @@
+import csv
+import sys
+import threading
+from collections.abc import Mapping
+from io import StringIO
+import numpy as np
+
+# Values pandas.read_csv treats as missing by default
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+
+def _convert(values: list, convert):
+    """
+    Function used to convert every non missing value of a column, None when one of them does not convert
+    """
+    converted = []
+    for value in values:
+        if value is None:
+            converted.append(None)
+            continue
+        # python accepts digit separators that pandas does not
+        if '_' in value:
+            return None
+        try:
+            converted.append(convert(value))
+        except ValueError:
+            return None
+    return converted
+
+
+def _column(values: list):
+    """
+    Function used to turn the text of a csv column into a numpy array with the dtype pandas.read_csv would infer
+    Args:
+        values: list of the column values, None where the value is missing
+    Returns:
+        array: int64 when every value is a whole number, float64 when every value is numeric or missing, otherwise an object array of strings with NaN for missing values
+    """
+    missing = any(value is None for value in values)
+    if not missing:
+        ints = _convert(values, int)
+        if ints is not None:
+            try:
+                return np.array(ints, dtype=np.int64)
+            except OverflowError:
+                pass
+    floats = _convert(values, float)
+    if floats is not None:
+        return np.array([np.nan if value is None else value for value in floats], dtype=np.float64)
+
+    return np.array([np.nan if value is None else value for value in values], dtype=object)
+
+
+def _rows(text: str):
+    """
+    Function used to read the header and the rows of a csv file, blank lines are skipped
+    """
+    rows = (row for row in csv.reader(StringIO(text)) if row)
+    return next(rows, None), rows
+
+
+def _columns(header: list, rows, indexes: list, keep=None):
+    """
+    Function used to collect the text of some columns of a csv file
+    Args:
+        header: column names of the file
+        rows: rows of the file after the header
+        indexes: positions of the columns to collect
+        keep: optional set of row positions to collect, every row is collected when None
+    Returns:
+        columns: list of column values in the order of indexes, None where the value is missing
+    """
+    columns = [[] for _ in indexes]
+    for position, row in enumerate(rows):
+        if len(row) > len(header):
+            raise ValueError(f"Expected {len(header)} fields in a row of the csv file, saw {len(row)}")
+        if keep is not None and position not in keep:
+            continue
+        for i, column in zip(indexes, columns):
+            value = row[i] if i < len(row) else ''
+            column.append(None if value in NA_VALUES else value)
+    return columns
+
+
+def parse_csv(body: bytes):
+    """
+    Function used to parse a config csv file into columns without pandas
+    Args:
+        body: contents of the csv file
+    Returns:
+        table: dictionary of column name to numpy array, in the column order of the file
+    """
+    header, rows = _rows(bytes(body).decode('utf-8'))
+    if header is None:
+        return {}
+    columns = _columns(header, rows, list(range(len(header))))
+
+    return {name: _column(column) for name, column in zip(header, columns)}
+
+
+class LazyCsvColumns(Mapping):
+    """
+    Config csv file with an axis column and a column per product, that keeps the bytes of the file and only converts
+    a column to a numpy array the first time it is read. The file is held as it was downloaded, which is about the size
+    of the arrays parse_csv would build, and only the columns of the products a container prices are converted. Converted columns match parse_csv
+    """
+
+    def __init__(self, body: bytes):
+        self.body = bytes(body)
+        header, _ = _rows(self.body.decode('utf-8'))
+        self.header = header or []
+        self._converted = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str):
+        column = self._converted.get(name)
+        if column is None:
+            if name not in self.header:
+                raise KeyError(name)
+            self.convert([name])
+            column = self._converted[name]
+        return column
+
+    def convert(self, names):
+        """
+        Function used to convert several columns in one read of the file, only the columns asked for are collected
+        Args:
+            names: names of the columns to convert, columns that are already converted are skipped
+        """
+        names = [name for name in dict.fromkeys(names) if name in self.header and name not in self._converted]
+        if not names:
+            return
+        header, rows = _rows(self.body.decode('utf-8'))
+        columns = _columns(header, rows, [self.header.index(name) for name in names])
+        with self._lock:
+            for name, values in zip(names, columns):
+                self._converted.setdefault(name, _column(values))
+
+    def __contains__(self, name):
+        return name in self.header
+
+    def __iter__(self):
+        return iter(self.header)
+
+    def __len__(self):
+        return len(self.header)
+
+    def nbytes(self):
+        """
+        Function used to get the memory held by the bytes of the file and the converted columns
+        """
+        return sys.getsizeof(self.body) + sum(array_nbytes(column) for column in list(self._converted.values()))
+
+
+class LazyCsvTable(Mapping):
+    """
+    Config csv file with rows per product that is read once into the text of each column, and only converts a column to a numpy array the first time it is read.
+    The rows of a product can be converted without the rest of the table, so that a container only holds the arrays
+    of the rows of the products it prices. Converted columns match parse_csv
+    """
+
+    def __init__(self, body: bytes):
+        header, rows = _rows(bytes(body).decode('utf-8'))
+        self.header = header or []
+        self._raw = dict(zip(self.header, _columns(self.header, rows, list(range(len(self.header))))))
+        # repeated values, like the product of each row of a long table, share one string
+        shared = {}
+        for values in self._raw.values():
+            values[:] = [value if value is None else shared.setdefault(value, value) for value in values]
+        self._converted = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str):
+        column = self._converted.get(name)
+        if column is None:
+            if name not in self.header:
+                raise KeyError(name)
+            self.convert([name])
+            column = self._converted[name]
+        return column
+
+    def convert(self, names):
+        """
+        Function used to convert several columns, the text of a column is dropped once it is converted
+        Args:
+            names: names of the columns to convert, columns that are already converted are skipped
+        """
+        with self._lock:
+            raw = {name: self._raw[name] for name in dict.fromkeys(names) if name in self._raw}
+        for name, values in raw.items():
+            column = _column(values)
+            with self._lock:
+                self._converted.setdefault(name, column)
+                self._raw.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.header
+
+    def __iter__(self):
+        return iter(self.header)
+
+    def __len__(self):
+        return len(self.header)
+
+    def rows(self, column: str, value):
+        """
+        Function used to read the rows whose column equals a value without converting the other rows, the rows are not kept
+        Args:
+            column: name of the column to match, it is converted and kept
+            value: value to match
+        Returns:
+            table: dictionary of column name to numpy array of the matching rows
+        """
+        keep = [position for position, key in enumerate(self[column].tolist()) if key == value]
+        table = {}
+        for name in self.header:
+            with self._lock:
+                converted, values = self._converted.get(name), self._raw.get(name)
+            table[name] = converted[keep] if converted is not None else _column([values[position] for position in keep])
+        return table
+
+    def nbytes(self):
+        """
+        Function used to get the memory held by the text of the columns that are not converted yet and by the converted columns
+        """
+        with self._lock:
+            raw, converted = list(self._raw.values()), list(self._converted.values())
+        strings = {id(value): value for values in raw for value in values if value is not None}
+        text = sum(sys.getsizeof(values) for values in raw) + sum(sys.getsizeof(value) for value in strings.values())
+        return text + sum(array_nbytes(column) for column in converted)
+
+
+def array_nbytes(array):
+    """
+    Function used to get the memory held by a numpy array, including the strings of an object array, a string held several times is counted once
+    Args:
+        array: numpy array
+    Returns:
+        nbytes: size in bytes
+    """
+    array = np.asarray(array)
+    if array.dtype == object:
+        return array.nbytes + sum(sys.getsizeof(value) for value in {id(value): value for value in array.tolist()}.values())
+    return array.nbytes
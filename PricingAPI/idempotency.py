@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Seconds the response of a request is replayed to its retries, 0 turns idempotency off
+IDEMPOTENCY_WINDOW = float(os.environ.get("IDEMPOTENCY_WINDOW", "0"))
+# Most responses held in memory for replay, the least recently used is evicted first
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Table responses are stored in so that a retry that reaches another container is replayed too,
+# keyed on idempotency_key with expires_at as its TTL attribute. Empty keeps responses in memory only
+IDEMPOTENCY_TABLE = os.environ.get("IDEMPOTENCY_TABLE", "pricing_idempotency")
+# Seconds a request holds the claim on its key while it is priced, a claim left by a container that stopped
+# is taken over by the next retry once it has expired
+IDEMPOTENCY_CLAIM_TIMEOUT = float(os.environ.get("IDEMPOTENCY_CLAIM_TIMEOUT", "30"))
+
+# Header and query string parameter a client passes its own key in
+IDEMPOTENCY_HEADER = "idempotency-key"
+IDEMPOTENCY_PARAM = "idempotency_key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+class IdempotencyConflict(ValueError):
+    """
+    Raised when a client key is reused with different params, the message is returned to the client with a 422
+    """
+
+
+class IdempotencyInProgress(ValueError):
+    """
+    Raised when a retry arrives while the request that claimed its key is still being priced, the message is returned to the client with a 409
+    """
+
+
+def request_fingerprint(params: dict):
+    """
+    Function used to hash the params of a request, the same params in any order give the same fingerprint
+    Args:
+        params: query string parameters of the invocation
+    Returns:
+        fingerprint: sha256 hex digest of the params, without the client key
+    """
+    params = {key: value for key, value in params.items() if key != IDEMPOTENCY_PARAM}
+    return hashlib.sha256(json.dumps(params, sort_keys = True, default = str).encode('utf-8')).hexdigest()
+
+
+def replay_key(event: dict, params: dict):
+    """
+    Function used to get the key the retries of a request are recognised by, the key a client passes in the
+    Idempotency-Key header or the idempotency_key param, and otherwise the loan_id with the fingerprint of the params
+    Args:
+        event: event passed through API Gateway
+        params: query string parameters of the invocation
+    Returns:
+        replay: tuple of key and fingerprint, None when the request has neither a client key nor a loan_id
+    """
+    headers = {str(name).lower(): value for name, value in (event.get('headers') or {}).items()}
+    fingerprint = request_fingerprint(params)
+    client_key = headers.get(IDEMPOTENCY_HEADER) or params.get(IDEMPOTENCY_PARAM)
+    if client_key:
+        return "key#" + str(client_key), fingerprint
+    if params.get('loan_id') is not None:
+        return "loan#" + json.dumps(params['loan_id']).strip('"') + "#" + fingerprint, fingerprint
+    return None
+
+
+def _conditional_check_failed(error: Exception):
+    """
+    Function used to recognise a write refused by its condition, from other dynamoDB and connection errors
+    """
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') == "ConditionalCheckFailedException"
+
+
+class IdempotencyStore:
+    """
+    Responses of priced requests kept for IDEMPOTENCY_WINDOW seconds, so a retry is answered with the
+    original response and run_id instead of being priced and audited again. A request claims its key before
+    it is priced, in an in process LRU cache and with a conditional write of a pending item to the dynamoDB
+    table, so that of concurrent requests with the same key only one is priced and the others are answered
+    with its response once it is stored, or with a 409 while it is being priced
+    """
+
+    def __init__(self, client, table_name: str = IDEMPOTENCY_TABLE, window: float = IDEMPOTENCY_WINDOW,
+                 maxsize: int = IDEMPOTENCY_CACHE_SIZE, clock=time.time, claim_timeout: float = IDEMPOTENCY_CLAIM_TIMEOUT):
+        self.client = client
+        self.table_name = table_name
+        self.window = window
+        self.maxsize = maxsize
+        self.claim_timeout = claim_timeout
+        self._clock = clock
+        # entries are (expires_at, fingerprint, status_code, headers, body), a pending claim has no status_code
+        self._responses = OrderedDict()
+        self._claims = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.table_hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.in_progress = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def claim(self, key: str, fingerprint: str):
+        """
+        Function used to claim a key before the request is priced and audited, or to find the response of an earlier request with the same key
+        Args:
+            key: key from replay_key
+            fingerprint: fingerprint of the params of this request
+        Returns:
+            response: stored response marked as replayed, None when this request holds the claim and has to be priced
+        """
+        now = self._clock()
+        claim_id = uuid4().hex
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._responses[key]
+                entry = None
+            if entry is not None:
+                self._responses.move_to_end(key)
+            else:
+                # the claim is held in memory first, a retry that reaches this container is not priced while the table is written
+                self._put(key, (now + self.claim_timeout, fingerprint, None, None, None))
+                self._claims[key] = claim_id
+        if entry is not None:
+            response = self._replay(key, fingerprint, entry)
+            self.hits += 1
+            return response
+
+        if self.table_name:
+            try:
+                self.client.put_item(
+                    TableName = self.table_name,
+                    Item = {
+                        'idempotency_key': {'S': key},
+                        'fingerprint': {'S': fingerprint},
+                        'claim_id': {'S': claim_id},
+                        'expires_at': {'N': str(int(now + self.claim_timeout) + 1)},
+                    },
+                    ConditionExpression = "attribute_not_exists(idempotency_key) OR expires_at <= :now",
+                    ExpressionAttributeValues = {':now': {'N': str(int(now))}},
+                )
+            except (BotoCoreError, ClientError) as e:
+                stored = self._read(key, now) if _conditional_check_failed(e) else None
+                # a request is priced without a claim rather than failed when the table cannot be written
+                self._drop_claim(key, claim_id)
+                if stored is None:
+                    print(f"Unable to claim key for replay: {e!r}")
+                else:
+                    if stored[2] is not None:
+                        self._remember(key, stored)
+                    response = self._replay(key, fingerprint, stored)
+                    self.table_hits += 1
+                    return response
+        self.misses += 1
+        return None
+
+    def release(self, key: str):
+        """
+        Function used to give up the claim on a key when the request was not answered with a price, so that a retry is priced again
+        Args:
+            key: key from replay_key
+        """
+        claim_id = self._drop_claim(key)
+        if claim_id is None or not self.table_name:
+            return
+        try:
+            self.client.delete_item(
+                TableName = self.table_name,
+                Key = {'idempotency_key': {'S': key}},
+                ConditionExpression = "claim_id = :claim_id",
+                ExpressionAttributeValues = {':claim_id': {'S': claim_id}},
+            )
+        except (BotoCoreError, ClientError) as e:
+            # a claim that is not removed expires after claim_timeout
+            if not _conditional_check_failed(e):
+                print(f"Unable to release claim: {e!r}")
+
+    def store(self, key: str, fingerprint: str, response: dict):
+        """
+        Function used to keep the response of a priced request for its retries
+        Args:
+            key: key from replay_key
+            fingerprint: fingerprint of the params of the request
+            response: response returned by the handler
+        Returns:
+            response: the response to return, the stored one when a concurrent request with the same key was answered first
+        """
+        now = self._clock()
+        entry = (now + self.window, fingerprint, response['statusCode'], response['headers'], response['body'])
+        with self._lock:
+            claim_id = self._claims.pop(key, None)
+        # the claim of this request is replaced by its response
+        condition, values = "attribute_not_exists(idempotency_key) OR expires_at <= :now", {':now': {'N': str(int(now))}}
+        if claim_id is not None:
+            condition, values = condition + " OR claim_id = :claim_id", dict(values, **{':claim_id': {'S': claim_id}})
+        if self.table_name:
+            try:
+                self.client.put_item(
+                    TableName = self.table_name,
+                    Item = {
+                        'idempotency_key': {'S': key},
+                        'fingerprint': {'S': fingerprint},
+                        'status_code': {'N': str(response['statusCode'])},
+                        'headers': {'S': json.dumps(response['headers'])},
+                        'body': {'S': response['body']},
+                        'expires_at': {'N': str(int(entry[0]) + 1)},
+                    },
+                    ConditionExpression = condition,
+                    ExpressionAttributeValues = values,
+                )
+            except (BotoCoreError, ClientError) as e:
+                stored = self._read(key, now) if _conditional_check_failed(e) else None
+                if stored is None:
+                    print(f"Unable to store response for replay: {e!r}")
+                elif stored[1] == fingerprint and stored[2] is not None:
+                    self._remember(key, stored)
+                    return self._replay(key, fingerprint, stored)
+        self._remember(key, entry)
+        return response
+
+    def stats(self):
+        """
+        Function used to report replay counters
+        Returns:
+            dictionary of replays from memory and from the table, misses, conflicts, retries refused while their key was claimed and the number of responses held in memory
+        """
+        return {'hits': self.hits, 'table_hits': self.table_hits, 'misses': self.misses, 'conflicts': self.conflicts, 'in_progress': self.in_progress, 'entries': len(self._responses)}
+
+    def clear(self):
+        """
+        Function used to drop every response held in memory, counters and the table are left as they are
+        """
+        with self._lock:
+            self._responses.clear()
+            self._claims.clear()
+
+    def _remember(self, key: str, entry: tuple):
+        with self._lock:
+            self._put(key, entry)
+
+    def _put(self, key: str, entry: tuple):
+        # called with the lock held
+        if self.maxsize <= 0:
+            return
+        self._responses[key] = entry
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.maxsize:
+            self._responses.popitem(last = False)
+
+    def _drop_claim(self, key: str, claim_id: str = None):
+        with self._lock:
+            if claim_id is not None and self._claims.get(key) != claim_id:
+                return None
+            claim_id = self._claims.pop(key, None)
+            entry = self._responses.get(key)
+            if entry is not None and entry[2] is None:
+                del self._responses[key]
+        return claim_id
+
+    def _read(self, key: str, now: float):
+        if not self.table_name:
+            return None
+        try:
+            item = self.client.get_item(TableName = self.table_name, Key = {'idempotency_key': {'S': key}}, ConsistentRead = True).get('Item')
+        except (BotoCoreError, ClientError) as e:
+            # a request is priced again rather than failed when the table cannot be read
+            print(f"Unable to read stored response: {e!r}")
+            return None
+        # expired items stay in the table until the dynamoDB TTL sweep removes them
+        if not item or float(item['expires_at']['N']) <= now:
+            return None
+        if 'body' not in item:
+            return (float(item['expires_at']['N']), item['fingerprint']['S'], None, None, None)
+        return (float(item['expires_at']['N']), item['fingerprint']['S'], int(item['status_code']['N']), json.loads(item['headers']['S']), item['body']['S'])
+
+    def _replay(self, key: str, fingerprint: str, entry: tuple):
+        _, stored_fingerprint, status_code, headers, body = entry
+        if stored_fingerprint != fingerprint:
+            # a loan_id key includes the fingerprint, so only a client key can be reused with other params
+            self.conflicts += 1
+            raise IdempotencyConflict(f"Idempotency key {key.split('#', 1)[1]} was already used with different parameters")
+        if status_code is None:
+            self.in_progress += 1
+            raise IdempotencyInProgress(f"A request with idempotency key {key.split('#', 1)[1]} is still being priced, please retry")
+        return {'statusCode': status_code, 'headers': dict(headers, **{REPLAYED_HEADER: "true"}), 'body': body}
@@ -0,0 +1,122 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import time
+from contextlib import contextmanager
+from io import StringIO
+
+# Stage durations are logged as CloudWatch embedded metric format lines, which
+# CloudWatch turns into metrics of this namespace without any API calls
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "PricingAPI")
+EMIT_METRICS = os.environ.get("EMIT_METRICS", "1") not in ("0", "false", "False")
+
+# Fraction of invocations run under cProfile, a direct invocation can also ask for it with "profile": true
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "25"))
+
+
+class Spans:
+    """
+    Wall clock duration in milliseconds of each stage of one invocation, including the time spent waiting on S3 and dynamoDB
+    """
+
+    __slots__ = ('durations', 'dimensions', '_start')
+
+    def __init__(self):
+        self.durations = {}
+        self.dimensions = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Function used to time a stage, a stage entered more than once adds up
+        Args:
+            name: name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name: str, milliseconds: float):
+        self.durations[name] = round(self.durations.get(name, 0.0) + milliseconds, 3)
+
+    def total(self):
+        """
+        Function used to get the milliseconds since the invocation started
+        """
+        return round((time.perf_counter() - self._start) * 1000, 3)
+
+
+def metrics_record(spans: Spans, properties: dict = None, namespace: str = METRICS_NAMESPACE, timestamp: float = None):
+    """
+    Function used to build a CloudWatch embedded metric format record of the stages of an invocation
+    Args:
+        spans: stage durations of the invocation
+        properties: values logged with the metrics that are not metrics or dimensions
+        namespace: CloudWatch namespace of the metrics
+        timestamp: time of the invocation in seconds since the epoch, defaults to now
+    Returns:
+        record: dictionary that is logged as a single json line
+    """
+    durations = dict(spans.durations, total = spans.total())
+    record = {
+        '_aws': {
+            'Timestamp': int((time.time() if timestamp is None else timestamp) * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [sorted(spans.dimensions)],
+                'Metrics': [{'Name': f"{name}_ms", 'Unit': 'Milliseconds'} for name in durations],
+            }],
+        },
+    }
+    record.update(properties or {})
+    record.update({name: str(value) for name, value in spans.dimensions.items()})
+    record.update({f"{name}_ms": value for name, value in durations.items()})
+    return record
+
+
+def emit_metrics(spans: Spans, properties: dict = None):
+    """
+    Function used to log the stage durations of an invocation as an embedded metric format line
+    Args:
+        spans: stage durations of the invocation
+        properties: values logged with the metrics that are not metrics or dimensions
+    """
+    if EMIT_METRICS:
+        print(json.dumps(metrics_record(spans, properties)))
+
+
+def should_profile(event):
+    """
+    Function used to decide whether an invocation runs under cProfile
+    Args:
+        event: event passed to the lambda
+    Returns:
+        True when the event asks for a profile or the invocation is sampled
+    """
+    if isinstance(event, dict) and event.get('profile') is True:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def profile_call(function, *args, top: int = PROFILE_TOP):
+    """
+    Function used to run a function under cProfile
+    Args:
+        function: function to run
+        args: arguments of the function
+        top: number of functions listed in the report, by cumulative time
+    Returns:
+        result: return value of the function
+        report: pstats report of the run
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args)
+    stream = StringIO()
+    pstats.Stats(profiler, stream = stream).sort_stats('cumulative').print_stats(top)
+    return result, stream.getvalue()
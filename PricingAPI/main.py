@@ -1,21 +1,80 @@
-import pandas as pd
 import json
 from dotenv import load_dotenv
 import boto3
 import os
 import datetime
-from io import StringIO
 import numpy as np
 import time
 from uuid import uuid4
 from typing import Optional
 import ast
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from config_cache import ConfigCache, ConfigLoadError
+from config_bundle import read_bundle
+from audit import AUDIT_FLUSH_EACH_INVOCATION, AUDIT_FLUSH_TIMEOUT, AUDIT_WRITE_WORKERS, AuditSink, AuditWriteError
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, replay_key
+from pricing_tables import CompiledModelTables, MarketGrid, MarketSimpleGrid, TableLookupError
+from csv_table import LazyCsvColumns, LazyCsvTable, array_nbytes, parse_csv
+from quote_cache import QuoteCache, quote_key
+from instrumentation import Spans, emit_metrics, profile_call, should_profile
+from pricing_request import INPUT_PARAMS, PricingRequest, RequestError, param_text, register_pricing_method
 
 load_dotenv()
 AWS_BUCKET = os.environ.get("AWS_BUCKET")
 
+# Parsed config tables are kept between warm invocations of the lambda
+# and revalidated against S3 with their ETag once the TTL has passed
+config_cache = ConfigCache()
 
-def create_dataframe(product: str, credit_risk: str, term: str, amount: str, loan_id: str, run_id: str, date: str, price: str, user_name:str, source_name:str, pricing_type : str, loan_to_value: Optional[str] = 'None', de_run_id: Optional[str] = 'None'):
+# Prices of recently quoted inputs, dropped whenever the config tables they were priced from change
+quote_cache = QuoteCache()
+
+# Config tables are fetched from S3 concurrently, the s3 client connection
+# pool is sized so that every fetch in flight has its own connection
+S3_FETCH_WORKERS = int(os.environ.get("S3_FETCH_WORKERS", "8"))
+_fetch_pool = ThreadPoolExecutor(max_workers = S3_FETCH_WORKERS, thread_name_prefix = "s3-fetch")
+# Connections held open to S3 and to dynamoDB, server.py raises it so that every request it prices at the same time has one
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", str(max(10, S3_FETCH_WORKERS, AUDIT_WRITE_WORKERS))))
+
+# With PRELOAD_CONFIG=1 every config table is loaded and compiled while lambda initialises
+# the container, so that with provisioned concurrency no invocation waits for a cold config load
+PRELOAD_CONFIG = os.environ.get("PRELOAD_CONFIG", "0") in ("1", "true", "True")
+
+# Largest number of loans that can be priced in a single batch invocation
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "5000"))
+
+PRODUCT_SPECIFICATION_KEY = "CPPricer/parquetfiles/product_specifications.csv"
+MARKET_TABLE_KEY = "CPPricer/parquetfiles/term_risk_discount.csv"
+MARKET_SIMPLE_TABLE_KEY = "CPPricer/parquetfiles/market_simple_table.csv"
+MODEL_TABLE_KEYS = (
+    "CPPricer/parquetfiles/finance.csv",
+    "CPPricer/parquetfiles/fundingcurve.csv",
+    "CPPricer/parquetfiles/sizepremia.csv",
+    "CPPricer/parquetfiles/termpremia.csv",
+    "CPPricer/parquetfiles/credit_premia.csv",
+)
+# Tables with a column or rows per product, only the columns and rows of the products that are priced are converted
+PRODUCT_SCOPED_TABLE_KEYS = MODEL_TABLE_KEYS[1:]
+# the credit premia table has rows per product, the curves have a column per product
+ROW_SCOPED_TABLE_KEYS = MODEL_TABLE_KEYS[4:]
+PRICING_TABLE_KEYS = {
+    "model": MODEL_TABLE_KEYS,
+    "market": (MARKET_TABLE_KEY,),
+    "market_simple": (MARKET_SIMPLE_TABLE_KEY,),
+}
+CONFIG_TABLE_KEYS = (PRODUCT_SPECIFICATION_KEY,) + MODEL_TABLE_KEYS + (MARKET_TABLE_KEY, MARKET_SIMPLE_TABLE_KEY)
+
+# Binary bundle of every config table, published from the csv files by config_bundle.py.
+# CONFIG_FORMAT=auto reads the bundle when one is published and falls back to the csv
+# files otherwise, CONFIG_FORMAT=csv always reads the csv files
+BUNDLE_KEY = "CPPricer/parquetfiles/config_bundle.bin"
+CONFIG_FORMAT = os.environ.get("CONFIG_FORMAT", "auto")
+_bundle_unavailable_until = 0.0
+
+
+def create_dataframe(product: str, credit_risk: str, term: str, amount: str, loan_id: str, run_id: str, date: str, price: str, user_name:str, source_name:str, pricing_type : str, loan_to_value: Optional[str] = 'None', de_run_id: Optional[str] = 'None', credit_grade: Optional[str] = None):
     """
     Function used to create payload for dynamoDB Put operation for metadata
     Args:
@@ -27,6 +86,7 @@ def create_dataframe(product: str, credit_risk: str, term: str, amount: str, loa
         run_id: run id for api run tracking
         date: date that the api was run on
         price: price that the api predicted
+        credit_grade: credit risk grade the model priced in a comparison, only stored when given
     Returns:
         df: dictionary structured as dynamoDB payload
     """
@@ -45,9 +105,145 @@ def create_dataframe(product: str, credit_risk: str, term: str, amount: str, loa
         'de_run_id': {'S': de_run_id},
         'pricing_type': {'S': pricing_type}
     }
+    if credit_grade is not None:
+        df['credit_grade'] = {'S': credit_grade}
     
     return df
 
+def read_table(s3, key: str):
+    """
+    Function used to read a config table from S3 through the config cache as a dataframe
+    Args:
+        s3: s3 connection
+        key: key of the csv file in the config bucket
+    Returns:
+        df: dataframe of the csv file
+    """
+    (table,), (etag,) = read_tables(s3, (key,))
+
+    return as_dataframe(key, table, etag)
+
+def as_dataframe(key: str, table, etag: str):
+    """
+    Function used to give a config table the dataframe form it had when the csv files were read with pandas, the dataframe is cached for the config version.
+    Pricing does not need pandas so it is only imported when a dataframe is asked for
+    Args:
+        key: key of the csv file in the config bucket
+        table: dictionary of column name to numpy array
+        etag: ETag the table was read from
+    Returns:
+        df: dataframe of the table
+    """
+    import pandas as pd
+
+    return config_cache.derived(("dataframe", key), (etag,), lambda: pd.DataFrame(dict(table), copy = False))
+
+def load_bundle(s3):
+    """
+    Function used to read the config bundle through the config cache, a missing or unreadable bundle is not looked for again until the cache TTL has passed
+    Args:
+        s3: s3 connection
+    Returns:
+        bundle: ConfigBundle, None when the csv files have to be read
+        etag: ETag of the bundle
+    """
+    global _bundle_unavailable_until
+    if CONFIG_FORMAT == "csv" or time.monotonic() < _bundle_unavailable_until:
+        return None, None
+    try:
+        return config_cache.get_versioned(s3, AWS_BUCKET, BUNDLE_KEY, read_bundle, spill = True)
+    except Exception as e:
+        print(f"Config bundle unavailable, reading csv files: {e!r}")
+        _bundle_unavailable_until = time.monotonic() + config_cache.ttl
+        return None, None
+
+def _timed_read(s3, key: str, bundle=None):
+    parse_seconds = []
+    # the csv ETag the bundle was built from, a table of the bundle is only served while S3 still has that version of the csv
+    copy = (bundle.table(key), bundle.sources.get(key)) if bundle is not None and key in bundle else None
+
+    def parse(body):
+        if copy is not None and copy[1]:
+            print(f"Warning: config table {key} has changed since the config bundle was built, reading the csv file until the bundle is rebuilt")
+        start = time.perf_counter()
+        if key in ROW_SCOPED_TABLE_KEYS:
+            table = LazyCsvTable(body)
+        elif key in PRODUCT_SCOPED_TABLE_KEYS:
+            table = LazyCsvColumns(body)
+        else:
+            table = parse_csv(body)
+        parse_seconds.append(time.perf_counter() - start)
+        return table
+
+    start = time.perf_counter()
+    result = config_cache.get_versioned(s3, AWS_BUCKET, key, parse, copy = copy)
+    return result, time.perf_counter() - start, sum(parse_seconds)
+
+def read_tables(s3, keys, timings: Optional[dict] = None, parse_timings: Optional[dict] = None):
+    """
+    Function used to read several config tables from S3 through the config cache, the tables are fetched concurrently.
+    Tables of the config bundle are served once S3 confirms the csv they were built from is unchanged
+    Args:
+        s3: s3 connection
+        keys: keys of the csv files in the config bucket
+        timings: optional dictionary that the fetch duration in milliseconds of each key is written to
+        parse_timings: optional dictionary that the parse duration in milliseconds of each key that had to be parsed is written to
+    Returns:
+        tables: list of tables in the order of keys, each a dictionary of column name to numpy array
+        version: tuple of the ETags the tables were parsed from
+    """
+    # tables that are fresh in the cache are served inline, only the ones S3 has to be asked for go through the fetch pool
+    reads, stale = [], []
+    for key in keys:
+        start = time.perf_counter()
+        cached = config_cache.fresh(AWS_BUCKET, key)
+        reads.append(None if cached is None else (cached, time.perf_counter() - start, 0))
+        if cached is None:
+            stale.append(key)
+
+    futures = {}
+    if stale:
+        start = time.perf_counter()
+        bundle, _ = load_bundle(s3)
+        if bundle is not None and timings is not None:
+            timings[BUNDLE_KEY] = round((time.perf_counter() - start) * 1000, 3)
+        if len(stale) > 1:
+            futures = {key: _fetch_pool.submit(_timed_read, s3, key, bundle) for key in stale}
+
+    results = []
+    for key, read in zip(keys, reads):
+        try:
+            result, seconds, parse_seconds = read or (futures[key].result() if futures else _timed_read(s3, key, bundle))
+        except Exception as e:
+            raise ConfigLoadError(f"Unable to load config table {key}: {e!r}") from e
+        if timings is not None:
+            timings[key] = round(seconds * 1000, 3)
+        if parse_timings is not None and parse_seconds:
+            parse_timings[key] = round(parse_seconds * 1000, 3)
+        results.append(result)
+
+    return [table for table, _ in results], tuple(etag for _, etag in results)
+
+def prefetch_tables(s3, pricing_types, timings: Optional[dict] = None, parse_timings: Optional[dict] = None):
+    """
+    Function used to load the product specification and the tables of the given pricing methods into the config cache in one concurrent round of S3 requests
+    Args:
+        s3: s3 connection
+        pricing_types: pricing methods whose tables are needed
+        timings: optional dictionary that the fetch duration in milliseconds of each key is written to
+        parse_timings: optional dictionary that the parse duration in milliseconds of each key that had to be parsed is written to
+    """
+    # with caching disabled the tables would be downloaded a second time when they are used
+    if config_cache.ttl <= 0:
+        return
+    keys = [PRODUCT_SPECIFICATION_KEY]
+    for pricing_type in pricing_types:
+        keys += [key for key in PRICING_TABLE_KEYS.get(pricing_type, ()) if key not in keys]
+    start = time.perf_counter()
+    read_tables(s3, keys, timings, parse_timings)
+    if timings is not None:
+        timings['wall'] = round((time.perf_counter() - start) * 1000, 3)
+
 def product_specification(s3, product: str):
     """
     Function used to verify that a product is supported by the API and if it is to set the params that are required for the given product
@@ -55,14 +251,19 @@ def product_specification(s3, product: str):
         s3: s3 connection
         product: product that was selected at API invocation
     Returns:
-        df_product_filter['Supported'].values[0]: 0, 1 value indicating whether the product is supported
-        ast.literal_eval(df_product_filter['Parameters'].values[0]): list of params that are needed for invocation
-        ast.literal_eval(df_product_filter['Pricing_Methods'].values[0]): list of pricing methods that are valid for the product
+        prodspec['Supported'][row]: 0, 1 value indicating whether the product is supported
+        ast.literal_eval(prodspec['Parameters'][row]): list of params that are needed for invocation
+        ast.literal_eval(prodspec['Pricing_Methods'][row]): list of pricing methods that are valid for the product
     """
-    df_prodspec = pd.read_csv(StringIO(s3.get_object(Bucket = AWS_BUCKET, Key = "CPPricer/parquetfiles/product_specifications.csv")['Body'].read().decode('utf-8')))
-    df_product_filter = df_prodspec[df_prodspec['Idx'] == product].reset_index()
+    (prodspec,), version = read_tables(s3, (PRODUCT_SPECIFICATION_KEY,))
+    # products are parsed the first time they are asked for and kept until the specification changes
+    specifications = config_cache.derived("product_specification", version, dict)
+    if product not in specifications:
+        row = np.flatnonzero(prodspec['Idx'] == product)[0]
+        specifications[product] = prodspec['Supported'][row], ast.literal_eval(prodspec['Parameters'][row]), ast.literal_eval(prodspec['Pricing_Methods'][row])
+    supported, params, pricing_methods = specifications[product]
 
-    return df_product_filter['Supported'].values[0], ast.literal_eval(df_product_filter['Parameters'].values[0]), ast.literal_eval(df_product_filter['Pricing_Methods'].values[0])
+    return supported, list(params), list(pricing_methods)
 
 
 def open_pricingband_model(s3):
@@ -77,14 +278,24 @@ def open_pricingband_model(s3):
         df_termpremia: dataframe of term premia table
     """
 
-    df_finance = pd.read_csv(StringIO(s3.get_object(Bucket = AWS_BUCKET, Key = "CPPricer/parquetfiles/finance.csv")['Body'].read().decode('utf-8')))
-    df_fundingcurve = pd.read_csv(StringIO(s3.get_object(Bucket = AWS_BUCKET, Key = "CPPricer/parquetfiles/fundingcurve.csv")['Body'].read().decode('utf-8')))
-    df_sizepremia = pd.read_csv(StringIO(s3.get_object(Bucket = AWS_BUCKET, Key = "CPPricer/parquetfiles/sizepremia.csv")['Body'].read().decode('utf-8')))
-    df_termpremia = pd.read_csv(StringIO(s3.get_object(Bucket = AWS_BUCKET, Key = "CPPricer/parquetfiles/termpremia.csv")['Body'].read().decode('utf-8')))
-    df_creditpremia = pd.read_csv(StringIO(s3.get_object(Bucket = AWS_BUCKET, Key = "CPPricer/parquetfiles/credit_premia.csv")['Body'].read().decode('utf-8')))
+    tables, version = read_tables(s3, MODEL_TABLE_KEYS)
+    df_finance, df_fundingcurve, df_sizepremia, df_termpremia, df_creditpremia = [as_dataframe(key, table, etag) for key, table, etag in zip(MODEL_TABLE_KEYS, tables, version)]
 
     return df_finance, df_fundingcurve, df_sizepremia, df_termpremia, df_creditpremia
 
+def compiled_pricingband_model(s3):
+    """
+    Function used to get the compiled lookup tables for the model pricing method, they are only rebuilt when one of the underlying tables changes
+    Args:
+        s3: s3 connection
+    Returns:
+        tables: CompiledModelTables built from the finance, funding curve, size premia, term premia and credit premia tables
+        version: ETags of the tables
+    """
+    tables, version = read_tables(s3, MODEL_TABLE_KEYS)
+
+    return config_cache.derived("model", version, lambda: CompiledModelTables(*tables)), version
+
 def open_pricingband_market(s3):
     """
     Function used to open the tables needed for the pricing calculation
@@ -94,7 +305,7 @@ def open_pricingband_market(s3):
         df_discount: dataframe of term discount table
     """
 
-    df_discount = pd.read_csv(StringIO(s3.get_object(Bucket = AWS_BUCKET, Key = "CPPricer/parquetfiles/term_risk_discount.csv")['Body'].read().decode('utf-8')))
+    df_discount = read_table(s3, MARKET_TABLE_KEY)
 
     return df_discount
 
@@ -107,7 +318,7 @@ def open_pricingband_market_simple(s3):
         df_market_simple: table of simple market price
     """
 
-    df_market_simple = pd.read_csv(StringIO(s3.get_object(Bucket = AWS_BUCKET, Key = "CPPricer/parquetfiles/market_simple_table.csv")['Body'].read().decode('utf-8')))
+    df_market_simple = read_table(s3, MARKET_SIMPLE_TABLE_KEY)
 
     return df_market_simple
 
@@ -127,24 +338,83 @@ def pricing_calc_model(s3, product: str, credit_risk: str, term: int, amount: fl
     if credit_risk not in credit_risk_model:
         return {'statusCode': 400, "body": f"Credit risk must be a value in {credit_risk_model} for this pricing type"}
 
-    df_finance, df_fundingcurve, df_sizepremia, df_termpremia, df_creditpremia = open_pricingband_model(s3)
+    tables, version = compiled_pricingband_model(s3)
+    key = quote_key("model", product, credit_risk, term, amount, loan_to_value)
 
-    NIM = df_finance.loc[df_finance["Idx"] == product, "NIM"].values[0] * 100
+    return quote_cache.get_or_price("model", version, key, lambda: tables.price(product, credit_risk, term, amount, loan_to_value))
 
-    FC_premia = df_fundingcurve.loc[(np.abs(df_fundingcurve["Time(in months)"] - int(term))).idxmin(), product]/100
-    Term_Premia = df_termpremia.loc[(np.abs(df_termpremia["Time(in months)"] - int(term))).idxmin(), product]/100
-    Size_Premia = df_sizepremia.loc[(np.abs(df_sizepremia["Size(in thousands)"] - int(amount)/1000)).idxmin(), product]/100
-    
-    df_creditpremia = df_creditpremia[df_creditpremia['Product'] == product]
 
+def pricing_calc_model_batch(s3, product, credit_risk, term, amount, loan_to_value=None):
+    """
+    Vectorised version of pricing_calc_model used to price many loans at once
+    Args:
+        product: list of products
+        credit_risk: list of credit risks
+        term: numpy array of integer terms
+        amount: numpy array of integer amounts
+        loan_to_value: list of loan to values, None for loans without one
+        s3: s3 connections
+    Returns:
+        prices: numpy array of predicted prices, NaN where the loan could not be priced
+        errors: list of error messages, None where the loan was priced
+    """
     if loan_to_value is None:
-        Credit_Premia = df_creditpremia.loc[(df_creditpremia['DimOneValMin'] <= float(term)) & (df_creditpremia['DimOneValMax'] >= float(term)) & (df_creditpremia['DimTwoVal'] == credit_risk), 'Value'].values[0]/100
-    else:
-        Credit_Premia = df_creditpremia.loc[(df_creditpremia['DimOneValMin'] <= float(loan_to_value)) & (df_creditpremia['DimOneValMax'] >= float(loan_to_value)) & (df_creditpremia['DimTwoVal'] == credit_risk), 'Value'].values[0]/100
+        loan_to_value = [None] * len(term)
+    band = [float(t) if ltv is None else float(ltv) for t, ltv in zip(term, loan_to_value)]
+
+    tables, _ = compiled_pricingband_model(s3)
+
+    return tables.price_many(product, credit_risk, term, amount, band)
+
+
+def pricing_calc_model_rate_card(s3, product: str, terms, amounts, credit_risks, loan_to_values=None):
+    """
+    Function used to price a full rate card for a product with the model pricing method in one vectorised pass
+    Args:
+        product: product that we want to price for
+        terms: terms in months
+        amounts: loan amounts
+        credit_risks: credit risk grades
+        loan_to_values: optional loan to values, the term is used for the credit premia band without them
+        s3: s3 connections
+    Returns:
+        prices: numpy array of shape (terms, amounts, credit_risks) or (terms, amounts, credit_risks, loan_to_values), NaN where no credit premia band applies
+    """
+    credit_risk_model = ['Strong', 'Satisfactory', 'Good', 'Weak']
+    unknown = [credit_risk for credit_risk in credit_risks if credit_risk not in credit_risk_model]
+    if unknown:
+        raise ValueError(f"Credit risk must be a value in {credit_risk_model} for this pricing type, got {unknown}")
+
+    tables, _ = compiled_pricingband_model(s3)
+
+    return tables.rate_card(product, terms, amounts, credit_risks, loan_to_values)
 
 
-    return NIM + FC_premia + Term_Premia + Size_Premia + Credit_Premia
+def compiled_market(s3):
+    """
+    Function used to get the term discount table compiled into a grid indexed by term, it is only rebuilt when the table changes
+    Args:
+        s3: s3 connection
+    Returns:
+        grid: MarketGrid of the term discount table
+        version: ETag of the table
+    """
+    (discount,), version = read_tables(s3, (MARKET_TABLE_KEY,))
+
+    return config_cache.derived("market", version, lambda: MarketGrid(discount)), version
+
+def compiled_market_simple(s3):
+    """
+    Function used to get the market simple table compiled into a grid indexed by term, it is only rebuilt when the table changes
+    Args:
+        s3: s3 connection
+    Returns:
+        grid: MarketSimpleGrid of the market simple table
+        version: ETag of the table
+    """
+    (market_simple,), version = read_tables(s3, (MARKET_SIMPLE_TABLE_KEY,))
 
+    return config_cache.derived("market_simple", version, lambda: MarketSimpleGrid(market_simple)), version
 
 def pricing_calc_market(s3, credit_risk: float, term: int):
     """
@@ -156,24 +426,14 @@ def pricing_calc_market(s3, credit_risk: float, term: int):
     Returns:
         price: predicted price for the loan
     """
-    df_discount = open_pricingband_market(s3)
+    grid, version = compiled_market(s3)
 
-    
     if isinstance(credit_risk, str):
         return {'statusCode': 400, "body": f"Credit risk must be a value between 1 and 10 for this pricing type"}
 
-    if credit_risk >= 7.5:
-        risk_bucket = "Strong"
-    elif (7.5 > credit_risk) & (credit_risk >= 5):
-        risk_bucket = "Good"
-    elif (5 > credit_risk) & (credit_risk >= 2.5):
-        risk_bucket = "Satisfactory"
-    else:
-        risk_bucket = "Weak"
+    key = quote_key("market", None, credit_risk, term)
 
-    term_discount = df_discount.loc[(df_discount["Term"] == int(term)), risk_bucket].values[0]/100
-    
-    return (- 1.3333333 * credit_risk + 28.333333) - term_discount
+    return quote_cache.get_or_price("market", version, key, lambda: grid.price(credit_risk, term))
 
 def pricing_calc_market_simple(s3, credit_risk: float, term: int):
     """
@@ -188,18 +448,109 @@ def pricing_calc_market_simple(s3, credit_risk: float, term: int):
     if isinstance(credit_risk, str):
         return {'statusCode': 400, "body": f"Credit risk must be a value between 1 and 10 for this pricing type"}
 
-    df_market_simple = open_pricingband_market_simple(s3)
+    grid, version = compiled_market_simple(s3)
+    key = quote_key("market_simple", None, credit_risk, term)
 
-    Credit_Premia = df_market_simple[(df_market_simple['DimOneValMin'] < int(term)) & (df_market_simple['DimOneValMax'] >= int(term))].reset_index()
-    Credit_Premia_Val = Credit_Premia.loc[(np.abs(df_market_simple["DimTwoValue"] - float(credit_risk))).idxmin(), 'Value']/100
-    
-    return Credit_Premia_Val
+    return quote_cache.get_or_price("market_simple", version, key, lambda: grid.price(credit_risk, term))
+
+def _risk_buckets(credit_risk):
+    """
+    Function used to map numeric credit risks onto the columns of the term discount table
+    Args:
+        credit_risk: numpy array of credit risks between 1 and 10
+    Returns:
+        risk_bucket: numpy array of risk bucket names
+    """
+    return np.select([credit_risk >= 7.5, credit_risk >= 5, credit_risk >= 2.5], ["Strong", "Good", "Satisfactory"], "Weak")
+
+def pricing_calc_market_batch(s3, credit_risk, term):
+    """
+    Vectorised version of pricing_calc_market used to price many loans at once
+    Args:
+        credit_risk: numpy array of credit risks (floats)
+        term: numpy array of integer terms
+        s3: s3 connections
+    Returns:
+        prices: numpy array of predicted prices, NaN where the loan could not be priced
+        errors: list of error messages, None where the loan was priced
+    """
+    grid, _ = compiled_market(s3)
+    credit_risk = np.asarray(credit_risk, dtype=float)
+    term = np.asarray(term)
+    prices = np.full(len(term), np.nan)
+    errors = [None] * len(term)
+
+    row = grid.rows_many(term)
+    found = row >= 0
+
+    risk_bucket = _risk_buckets(credit_risk)
+    term_discount = np.full(len(term), np.nan)
+    for bucket in set(risk_bucket[found].tolist()):
+        idx = np.flatnonzero((risk_bucket == bucket) & found)
+        term_discount[idx] = grid.column(bucket)[row[idx]]/100
+
+    prices[found] = (- 1.3333333 * credit_risk[found] + 28.333333) - term_discount[found]
+    for i in np.flatnonzero(~found):
+        errors[i] = f"No term discount for term {term[i]}"
+
+    return prices, errors
+
+def pricing_calc_market_simple_batch(s3, credit_risk, term):
+    """
+    Vectorised version of pricing_calc_market_simple used to price many loans at once
+    Args:
+        credit_risk: numpy array of credit risks (floats)
+        term: numpy array of integer terms
+        s3: s3 connections
+    Returns:
+        prices: numpy array of predicted prices, NaN where the loan could not be priced
+        errors: list of error messages, None where the loan was priced
+    """
+    grid, _ = compiled_market_simple(s3)
+    credit_risk = np.asarray(credit_risk, dtype=float)
+    term = np.asarray(term)
+
+    prices, found = grid.values_many(credit_risk, term)
+    errors = [None] * len(term)
+    for i in np.flatnonzero(~found):
+        errors[i] = f"No market price for term {term[i]} and credit risk {credit_risk[i]}"
+
+    return prices, errors
 
 # Connections to aws resources are made outside of the handler
 # function so that connections can be pooled by concurrent 
 # lambda executions
-s3 = boto3.client('s3')
-dynamodb = boto3.client('dynamodb', region_name = 'eu-west-2')
+s3 = boto3.client('s3', config = Config(max_pool_connections = AWS_MAX_POOL_CONNECTIONS))
+dynamodb = boto3.client('dynamodb', region_name = 'eu-west-2', config = Config(max_pool_connections = AWS_MAX_POOL_CONNECTIONS))
+
+# Audit rows go through the sink so that AUDIT_MODE decides whether a
+# request waits for its row to be stored in the pricing_apirunlog table
+audit_sink = AuditSink(dynamodb)
+atexit.register(audit_sink.flush, timeout = 2)
+
+# With IDEMPOTENCY_WINDOW set, a loan claims its key before it is priced and its response is kept for that many seconds
+# and replayed with its original run_id to retries, which are neither priced nor written to pricing_apirunlog again
+idempotency_store = IdempotencyStore(dynamodb)
+
+
+# Pricing types are dispatched through this table, a new pricing method is added by
+# registering a function of (s3, request) that returns the price
+PRICING_METHODS = {}
+
+# pricing_type that prices a loan with every pricing method of its product
+COMPARE_PRICING_TYPE = "compare"
+
+@register_pricing_method(PRICING_METHODS, "model", audit_params = ("loan_to_value", "de_run_id"), input_params = ("loan_to_value", "de_run_id"))
+def _dispatch_model(s3, request: PricingRequest):
+    return pricing_calc_model(s3, request.product, request.credit_risk, request.term, request.amount, loan_to_value = request.loan_to_value)
+
+@register_pricing_method(PRICING_METHODS, "market", audit_params = ("de_run_id",))
+def _dispatch_market(s3, request: PricingRequest):
+    return pricing_calc_market(s3, request.credit_score(), request.term)
+
+@register_pricing_method(PRICING_METHODS, "market_simple", audit_params = ("de_run_id",))
+def _dispatch_market_simple(s3, request: PricingRequest):
+    return pricing_calc_market_simple(s3, request.credit_score(), request.term)
 
 
 def handler(event, context):
@@ -211,84 +562,552 @@ def handler(event, context):
         statusCode 200: returns run results and meta data on run
         statusCode 400: advises users that the correct params wherenot supplied with invocation
     """
+    spans = Spans()
+    if should_profile(event):
+        response, report = profile_call(_route, event, spans)
+        print(report)
+    else:
+        response = _route(event, spans)
+
+    if AUDIT_FLUSH_EACH_INVOCATION and audit_sink.mode != "sync":
+        with spans.span("audit_flush"):
+            flush_audit()
+
+    emit_metrics(spans, {'statusCode': response.get('statusCode')})
+    return response
+
+def flush_audit():
+    """
+    Function used to write the audit rows that buffered and async audit modes are holding before lambda can freeze the container
+    """
+    try:
+        if not audit_sink.flush(timeout = AUDIT_FLUSH_TIMEOUT):
+            print(f"Audit rows were still being written after {AUDIT_FLUSH_TIMEOUT}s: {audit_sink.stats()}")
+    except Exception as e:
+        print(f"Unable to write buffered audit rows: {e!r}")
+
+def _audit_unavailable(e: Exception):
+    print(e)
+    return {'statusCode': 503, "body": "The pricing run could not be recorded, please try again"}
+
+def _route(event, spans: Spans):
+    if is_warmup_event(event):
+        spans.dimensions['pricing_type'] = "warmup"
+        return warmup_handler(spans)
+
+    with spans.span("parse_request"):
+        items = batch_items(event)
+    if items is not None:
+        spans.dimensions['pricing_type'] = "batch"
+        return batch_handler(items, spans)
+
+    return single_handler(event, spans)
+
+def single_handler(event, spans: Optional[Spans] = None):
+    """
+    Function used to price the single loan passed in the query string of an invocation
+    Args:
+        event: event passed through API Gateway
+        spans: stage durations of the invocation
+    Returns:
+        statusCode 200: returns run results and meta data on run
+        statusCode 400: advises users that the correct params wherenot supplied with invocation
+    """
+    spans = Spans() if spans is None else spans
+    params = event.get('queryStringParameters')
+    # values that are not pricing methods are grouped so they cannot add metric dimensions
+    pricing_type = (params or {}).get('pricing_type')
+    spans.dimensions['pricing_type'] = pricing_type if pricing_type in PRICING_METHODS or pricing_type == COMPARE_PRICING_TYPE else "other"
+
+    # a retry is answered before any config table is read, the first request claims its key so that a concurrent retry is not priced too
+    replay = None
+    if params and idempotency_store.enabled:
+        with spans.span("idempotency_claim"):
+            replay = replay_key(event, params)
+            try:
+                response = idempotency_store.claim(*replay) if replay is not None else None
+            except IdempotencyConflict as e:
+                return {'statusCode': 422, "body": str(e)}
+            except IdempotencyInProgress as e:
+                return {'statusCode': 409, 'headers': {'Retry-After': "1"}, "body": str(e)}
+        if response is not None:
+            return response
+
+    try:
+        response = _price_loan(params, pricing_type, spans)
+    except BaseException:
+        if replay is not None:
+            idempotency_store.release(replay[0])
+        raise
+
+    return _remember_response(replay, response, spans)
+
+
+def _price_loan(params: dict, pricing_type: str, spans: Spans):
+    """
+    Function used to price the loan of a single invocation and write its audit row
+    Args:
+        params: query string parameters of the invocation
+        pricing_type: pricing type of the invocation
+        spans: stage durations of the invocation
+    Returns:
+        statusCode 200: returns run results and meta data on run
+        statusCode 400: advises users that the correct params wherenot supplied with invocation
+    """
+    fetch_timings, parse_timings = {}, {}
+    try:
+        with spans.span("config_fetch"):
+            # a comparison needs the tables of every method, they are fetched in the same concurrent round
+            prefetch_tables(s3, list(PRICING_METHODS) if pricing_type == COMPARE_PRICING_TYPE else [pricing_type], fetch_timings, parse_timings)
+    except ConfigLoadError as e:
+        print(e)
+        return {'statusCode': 503, "body": "Pricing config is currently unavailable, please try again"}
+
     try: 
-        supported, params, supported_pricing_methods = product_specification(s3, json.dumps(event['queryStringParameters']['product']).strip('\"'))
+        with spans.span("product_specification"):
+            supported, required_params, supported_pricing_methods = product_specification(s3, param_text(params['product']))
     except Exception as e:
         print(e)
         return {'statusCode': 400, "body": "Please make sure that you have selected a valid product"}
 
     if supported == 0:
-        return {'statusCode': 400, "body": f"Selected product {event['queryStringParameters']['product']} is not currently supported"}
-    
+        return {'statusCode': 400, "body": f"Selected product {params['product']} is not currently supported"}
+
+    missing = set(required_params) - set(params)
+    if missing:
+        return {'statusCode': 400, "body": "missing required parameters " + str(missing)}
+
     idempotency_key = str(uuid4())
+    start_time = time.process_time()
+    date = datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
 
-    if all(param in list(event['queryStringParameters'].keys()) for param in params):
+    if params['pricing_type'] == COMPARE_PRICING_TYPE:
+        return compare_handler(params, supported_pricing_methods, spans, idempotency_key, date, start_time, fetch_timings, parse_timings)
 
-        start_time = time.process_time()
-        date = datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+    if params['pricing_type'] not in supported_pricing_methods:
+        return {'statusCode': 400, "body": f"The product {params['product']} does not support pricing method {params['pricing_type']}"}
 
-        if event['queryStringParameters']['pricing_type'] not in supported_pricing_methods:
-            return {'statusCode': 400, "body": f"The product {event['queryStringParameters']['product']} does not support pricing method {event['queryStringParameters']['pricing_type']}"}
-    
-        if event['queryStringParameters']['pricing_type'] == "market":
+    # pricing types without a method of their own have always been priced with the model
+    method = PRICING_METHODS.get(params['pricing_type'], PRICING_METHODS["model"])
+    try:
+        with spans.span("parse_request"):
+            request = PricingRequest(params)
+        with spans.span("pricing"):
+            price = method.price(s3, request)
+    except (RequestError, TableLookupError) as e:
+        return {'statusCode': 400, "body": str(e)}
+    # the pricing functions return a 400 response for a credit risk they cannot price
+    if isinstance(price, dict):
+        return price
 
-            if 'de_run_id' in list(event['queryStringParameters'].keys()):
-                price  = pricing_calc_market(s3, float(json.dumps(event['queryStringParameters']['credit_risk']).strip('\"')), json.dumps(event['queryStringParameters']['term']).strip('\"'))
-                payload = create_dataframe(json.dumps(event['queryStringParameters']['product']), json.dumps(event['queryStringParameters']['credit_risk']), json.dumps(event['queryStringParameters']['term']), json.dumps(event['queryStringParameters']['amount']), json.dumps(event['queryStringParameters']['loan_id']), idempotency_key, date, str(price), json.dumps(event['queryStringParameters']['user_name']), json.dumps(event['queryStringParameters']['source_name']), pricing_type = json.dumps(event['queryStringParameters']['pricing_type']), de_run_id = json.dumps(event['queryStringParameters']['de_run_id']))
-                Response = {"statusCode": 200, "output": price, "input":[{"product": event['queryStringParameters']['product'], "credit_risk": event['queryStringParameters']['credit_risk'], "amount": event['queryStringParameters']['amount'], "term": event['queryStringParameters']['term'], "loan_id": event['queryStringParameters']['loan_id']}], "meta_data":{"run_id": idempotency_key,"run_date": date}}
-            
-            else:
-                price  = pricing_calc_market(s3, float(json.dumps(event['queryStringParameters']['credit_risk']).strip('\"')), json.dumps(event['queryStringParameters']['term']).strip('\"'))
-                payload = create_dataframe(json.dumps(event['queryStringParameters']['product']), json.dumps(event['queryStringParameters']['credit_risk']), json.dumps(event['queryStringParameters']['term']), json.dumps(event['queryStringParameters']['amount']), json.dumps(event['queryStringParameters']['loan_id']), idempotency_key, date, str(price), json.dumps(event['queryStringParameters']['user_name']), json.dumps(event['queryStringParameters']['source_name']), pricing_type = json.dumps(event['queryStringParameters']['pricing_type']))
-                Response = {"statusCode": 200, "output": price, "input":[{"product": event['queryStringParameters']['product'], "credit_risk": event['queryStringParameters']['credit_risk'], "amount": event['queryStringParameters']['amount'], "term": event['queryStringParameters']['term'], "loan_id": event['queryStringParameters']['loan_id']}], "meta_data":{"run_id": idempotency_key,"run_date": date}}
-        
-        elif event['queryStringParameters']['pricing_type'] == "market_simple":
-
-            if 'de_run_id' in list(event['queryStringParameters'].keys()):
-                price  = pricing_calc_market_simple(s3, float(json.dumps(event['queryStringParameters']['credit_risk']).strip('\"')), json.dumps(event['queryStringParameters']['term']).strip('\"'))
-                payload = create_dataframe(json.dumps(event['queryStringParameters']['product']), json.dumps(event['queryStringParameters']['credit_risk']), json.dumps(event['queryStringParameters']['term']), json.dumps(event['queryStringParameters']['amount']), json.dumps(event['queryStringParameters']['loan_id']), idempotency_key, date, str(price), json.dumps(event['queryStringParameters']['user_name']), json.dumps(event['queryStringParameters']['source_name']), pricing_type = json.dumps(event['queryStringParameters']['pricing_type']), de_run_id = json.dumps(event['queryStringParameters']['de_run_id']))
-                Response = {"statusCode": 200, "output": price, "input":[{"product": event['queryStringParameters']['product'], "credit_risk": event['queryStringParameters']['credit_risk'], "amount": event['queryStringParameters']['amount'], "term": event['queryStringParameters']['term'], "loan_id": event['queryStringParameters']['loan_id']}], "meta_data":{"run_id": idempotency_key,"run_date": date}}
-            
+    try:
+        with spans.span("audit_write"):
+            audit = request.audit_params(method.audit_params)
+            audit_sink.write(create_dataframe(audit.pop('product'), audit.pop('credit_risk'), audit.pop('term'), audit.pop('amount'), audit.pop('loan_id'), idempotency_key, date, str(price), audit.pop('user_name'), audit.pop('source_name'), **audit))
+    except AuditWriteError as e:
+        return _audit_unavailable(e)
+
+    Response = {"statusCode": 200, "output": price, "input": [request.input(method.input_params)], "meta_data": {"run_id": idempotency_key, "run_date": date}}
+
+    return _single_response(Response, start_time, spans, fetch_timings, parse_timings)
+
+
+def _remember_response(replay, response: dict, spans: Spans):
+    """
+    Function used to keep the response of a priced loan for its retries, responses that are not a price are cheaper to answer again than to store
+    and give up the claim on their key instead
+    Args:
+        replay: key and fingerprint from replay_key, None when the request is not replayed
+        response: response of the handler
+        spans: stage durations of the invocation
+    Returns:
+        response: the response to return
+    """
+    if replay is None:
+        return response
+    if response.get('statusCode') != 200:
+        idempotency_store.release(replay[0])
+        return response
+    with spans.span("idempotency_store"):
+        return idempotency_store.store(*replay, response)
+
+
+def _single_response(Response: dict, start_time: float, spans: Spans, fetch_timings: dict, parse_timings: dict):
+    """
+    Function used to add the run time, cache statistics and stage durations to the response of a single loan and serialize it
+    """
+    # End the timer
+    end_time = time.process_time()
+
+    # Calculate the runtime
+    runtime = end_time - start_time
+    Response['meta_data']['run_time'] = runtime
+    Response['meta_data']['config_cache'] = config_cache.stats()
+    Response['meta_data']['quote_cache'] = quote_cache.stats()
+    Response['meta_data']['s3_fetch_ms'] = fetch_timings
+    Response['meta_data']['parse_ms'] = parse_timings
+    # serialization happens after the response is built, so it is only in the metrics log line
+    Response['meta_data']['spans_ms'] = dict(spans.durations, total = spans.total())
+    print(Response)
+    with spans.span("serialization"):
+        body = json.dumps(Response)
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': body}
+
+
+def _compare_request(request: PricingRequest, method):
+    """
+    Function used to get the request a method prices in a comparison. The model prices credit risk grades, a numeric credit risk
+    is compared in the credit_grade param when it is passed and otherwise in the grade the market methods bucket it into
+    Args:
+        request: parsed request of the comparison
+        method: PricingMethod of the comparison
+    Returns:
+        request: request for the method
+    """
+    if method.name != "model":
+        return request
+    grade = request.params.get('credit_grade')
+    if grade is None:
+        try:
+            grade = str(_risk_buckets(np.array(float(request.credit_risk))))
+        except ValueError:
+            return request
+    return PricingRequest(dict(request.params, credit_risk = grade))
+
+
+def compare_handler(params: dict, supported_pricing_methods: list, spans: Spans, idempotency_key: str, date: str, start_time: float, fetch_timings: dict, parse_timings: dict):
+    """
+    Function used to price a loan with every pricing method of its product in one invocation, the prices are returned side by side and stored in one audit row
+    Args:
+        params: query string parameters of the invocation
+        supported_pricing_methods: pricing methods of the product
+        spans: stage durations of the invocation
+        idempotency_key: run id of the invocation
+        date: run date of the invocation
+        start_time: process time the run started at
+        fetch_timings: fetch duration in milliseconds of each config table
+        parse_timings: parse duration in milliseconds of each config table that had to be parsed
+    Returns:
+        statusCode 200: returns the price of every method that could price the loan, with errors for the ones that could not
+        statusCode 400: advises users that none of the methods could price the loan
+    """
+    methods = [PRICING_METHODS[name] for name in supported_pricing_methods if name in PRICING_METHODS]
+    if not methods:
+        return {'statusCode': 400, "body": f"The product {params['product']} does not support any pricing method"}
+
+    try:
+        with spans.span("parse_request"):
+            request = PricingRequest(params)
+    except RequestError as e:
+        return {'statusCode': 400, "body": str(e)}
+
+    optional_params = tuple(dict.fromkeys(param for method in methods for param in method.audit_params + method.input_params))
+    # the grade the model prices is stored and echoed with the prices, also when it was derived from a numeric credit risk
+    if PRICING_METHODS["model"] in methods:
+        graded = _compare_request(request, PRICING_METHODS["model"])
+        if graded is not request:
+            request = PricingRequest(dict(params, credit_grade = graded.credit_risk))
+            optional_params += ('credit_grade',)
+
+    prices, errors = {}, {}
+    with spans.span("pricing"):
+        for method in methods:
+            try:
+                price = method.price(s3, _compare_request(request, method))
+            except (RequestError, TableLookupError) as e:
+                price = {'statusCode': 400, "body": str(e)}
+            except ValueError as e:
+                # a term or amount that is not a number
+                price = {'statusCode': 400, "body": f"Unable to price loan with pricing method {method.name}: {e}"}
+            if isinstance(price, dict):
+                errors[method.name] = price['body']
             else:
-                price  = pricing_calc_market_simple(s3, float(json.dumps(event['queryStringParameters']['credit_risk']).strip('\"')), json.dumps(event['queryStringParameters']['term']).strip('\"'))
-                payload = create_dataframe(json.dumps(event['queryStringParameters']['product']), json.dumps(event['queryStringParameters']['credit_risk']), json.dumps(event['queryStringParameters']['term']), json.dumps(event['queryStringParameters']['amount']), json.dumps(event['queryStringParameters']['loan_id']), idempotency_key, date, str(price), json.dumps(event['queryStringParameters']['user_name']), json.dumps(event['queryStringParameters']['source_name']), pricing_type = json.dumps(event['queryStringParameters']['pricing_type']))
-                Response = {"statusCode": 200, "output": price, "input":[{"product": event['queryStringParameters']['product'], "credit_risk": event['queryStringParameters']['credit_risk'], "amount": event['queryStringParameters']['amount'], "term": event['queryStringParameters']['term'], "loan_id": event['queryStringParameters']['loan_id']}], "meta_data":{"run_id": idempotency_key,"run_date": date}}
-        
-        else:
+                prices[method.name] = price
+    if not prices:
+        return {'statusCode': 400, "body": json.dumps(errors)}
 
-            if "loan_to_value" in list(event['queryStringParameters'].keys()) and 'de_run_id' not in list(event['queryStringParameters'].keys()):
-                price  = pricing_calc_model(s3, json.dumps(event['queryStringParameters']['product']).strip('\"'), json.dumps(event['queryStringParameters']['credit_risk']).strip('\"'), json.dumps(event['queryStringParameters']['term']).strip('\"'), json.dumps(event['queryStringParameters']['amount']).strip('\"'), loan_to_value = json.dumps(event['queryStringParameters']['loan_to_value']).strip('\"'))
-                payload = create_dataframe(json.dumps(event['queryStringParameters']['product']), json.dumps(event['queryStringParameters']['credit_risk']), json.dumps(event['queryStringParameters']['term']), json.dumps(event['queryStringParameters']['amount']), json.dumps(event['queryStringParameters']['loan_id']), idempotency_key, date, str(price), json.dumps(event['queryStringParameters']['user_name']), json.dumps(event['queryStringParameters']['source_name']), pricing_type = json.dumps(event['queryStringParameters']['pricing_type']), loan_to_value = json.dumps(event['queryStringParameters']['loan_to_value']))
-                Response = {"statusCode": 200, "output": price, "input":[{"product": event['queryStringParameters']['product'], "credit_risk": event['queryStringParameters']['credit_risk'], "amount": event['queryStringParameters']['amount'], "term": event['queryStringParameters']['term'], "loan_id": event['queryStringParameters']['loan_id'], "loan_to_value": event['queryStringParameters']['loan_to_value']}], "meta_data":{"run_id": idempotency_key,"run_date": date}}
-
-            elif "loan_to_value" not in list(event['queryStringParameters'].keys()) and 'de_run_id' in list(event['queryStringParameters'].keys()):
-                price  = pricing_calc_model(s3, json.dumps(event['queryStringParameters']['product']).strip('\"'), json.dumps(event['queryStringParameters']['credit_risk']).strip('\"'), json.dumps(event['queryStringParameters']['term']).strip('\"'), json.dumps(event['queryStringParameters']['amount']).strip('\"'), de_run_id = json.dumps(event['queryStringParameters']['de_run_id']).strip('\"'))
-                payload = create_dataframe(json.dumps(event['queryStringParameters']['product']), json.dumps(event['queryStringParameters']['credit_risk']), json.dumps(event['queryStringParameters']['term']), json.dumps(event['queryStringParameters']['amount']), json.dumps(event['queryStringParameters']['loan_id']), idempotency_key, date, str(price), json.dumps(event['queryStringParameters']['user_name']), json.dumps(event['queryStringParameters']['source_name']), pricing_type = json.dumps(event['queryStringParameters']['pricing_type']), de_run_id = json.dumps(event['queryStringParameters']['de_run_id']))
-                Response = {"statusCode": 200, "output": price, "input":[{"product": event['queryStringParameters']['product'], "credit_risk": event['queryStringParameters']['credit_risk'], "amount": event['queryStringParameters']['amount'], "term": event['queryStringParameters']['term'], "loan_id": event['queryStringParameters']['loan_id'], "de_run_id": event['queryStringParameters']['de_run_id']}], "meta_data":{"run_id": idempotency_key,"run_date": date}}
-            
-            elif "loan_to_value" in list(event['queryStringParameters'].keys()) and 'de_run_id' in list(event['queryStringParameters'].keys()):
-                price  = pricing_calc_model(s3, json.dumps(event['queryStringParameters']['product']).strip('\"'), json.dumps(event['queryStringParameters']['credit_risk']).strip('\"'), json.dumps(event['queryStringParameters']['term']).strip('\"'), json.dumps(event['queryStringParameters']['amount']).strip('\"'), json.dumps(event['queryStringParameters']['loan_to_value']).strip('\"'))
-                payload = create_dataframe(json.dumps(event['queryStringParameters']['product']), json.dumps(event['queryStringParameters']['credit_risk']), json.dumps(event['queryStringParameters']['term']), json.dumps(event['queryStringParameters']['amount']), json.dumps(event['queryStringParameters']['loan_id']), idempotency_key, date, str(price), json.dumps(event['queryStringParameters']['user_name']), json.dumps(event['queryStringParameters']['source_name']), pricing_type = json.dumps(event['queryStringParameters']['pricing_type']), loan_to_value = json.dumps(event['queryStringParameters']['loan_to_value']), de_run_id = json.dumps(event['queryStringParameters']['de_run_id']))
-                Response = {"statusCode": 200, "output": price, "input":[{"product": event['queryStringParameters']['product'], "credit_risk": event['queryStringParameters']['credit_risk'], "amount": event['queryStringParameters']['amount'], "term": event['queryStringParameters']['term'], "loan_id": event['queryStringParameters']['loan_id'], "loan_to_value": event['queryStringParameters']['loan_to_value'], "de_run_id": event['queryStringParameters']['de_run_id']}], "meta_data":{"run_id": idempotency_key,"run_date": date}}
+    try:
+        with spans.span("audit_write"):
+            audit = request.audit_params(optional_params)
+            audit_sink.write(create_dataframe(audit.pop('product'), audit.pop('credit_risk'), audit.pop('term'), audit.pop('amount'), audit.pop('loan_id'), idempotency_key, date, json.dumps(prices), audit.pop('user_name'), audit.pop('source_name'), **audit))
+    except AuditWriteError as e:
+        return _audit_unavailable(e)
+
+    Response = {"statusCode": 200, "output": prices, "input": [request.input(optional_params)], "meta_data": {"run_id": idempotency_key, "run_date": date}}
+    if errors:
+        Response['errors'] = errors
+
+    return _single_response(Response, start_time, spans, fetch_timings, parse_timings)
+
+
+def batch_items(event):
+    """
+    Function used to recognise a batch invocation, where the request body is a JSON array of loans
+    Args:
+        event: event passed through API Gateway
+    Returns:
+        items: list of loan requests, None when the event is not a batch invocation
+    """
+    body = event.get('body') if isinstance(event, dict) else None
+    if not body:
+        return None
+    try:
+        items = json.loads(body)
+    except (TypeError, ValueError):
+        return None
 
+    return items if isinstance(items, list) else None
+
+def _validate_batch_item(item, specifications: dict):
+    """
+    Function used to run the product and parameter checks of the single loan invocation on one loan of a batch
+    Args:
+        item: loan request
+        specifications: product specifications already looked up for this batch
+    Returns:
+        error: message describing why the loan cannot be priced, None when it can
+    """
+    if not isinstance(item, dict):
+        return "Each loan in the batch must be a JSON object"
+
+    product = param_text(item.get('product'))
+    if product not in specifications:
+        try:
+            specifications[product] = product_specification(s3, product)
+        except Exception as e:
+            print(e)
+            specifications[product] = None
+    if specifications[product] is None:
+        return "Please make sure that you have selected a valid product"
+
+    supported, params, supported_pricing_methods = specifications[product]
+    if supported == 0:
+        return f"Selected product {item['product']} is not currently supported"
+    if not all(param in item for param in params):
+        return "missing required parameters " + str(set(params) - set(item))
+    if item.get('pricing_type') not in supported_pricing_methods:
+        return f"The product {item['product']} does not support pricing method {item.get('pricing_type')}"
+
+    return None
+
+def _parse_batch_item(item, pricing_type: str):
+    """
+    Function used to convert the parameters of a validated loan into the values used by the batch pricing functions
+    Args:
+        item: loan request
+        pricing_type: model, market or market_simple
+    Returns:
+        inputs: tuple of parsed pricing inputs
+    """
+    if pricing_type == "model":
+        credit_risk_model = ['Strong', 'Satisfactory', 'Good', 'Weak']
+        credit_risk = param_text(item['credit_risk'])
+        if credit_risk not in credit_risk_model:
+            raise ValueError(f"Credit risk must be a value in {credit_risk_model} for this pricing type")
+        loan_to_value = param_text(item['loan_to_value']) if 'loan_to_value' in item else None
+        try:
+            term, amount = int(param_text(item['term'])), int(param_text(item['amount']))
+            if loan_to_value is not None:
+                float(loan_to_value)
+        except ValueError:
+            raise ValueError("term, amount and loan_to_value must be numeric")
+        return param_text(item['product']), credit_risk, term, amount, loan_to_value
+
+    try:
+        credit_risk = float(param_text(item['credit_risk']))
+    except ValueError:
+        raise ValueError("Credit risk must be a value between 1 and 10 for this pricing type")
+    try:
+        term = int(param_text(item['term']))
+    except ValueError:
+        raise ValueError("term must be a whole number of months")
+    return credit_risk, term
+
+def price_items(items: list, date: str):
+    """
+    Function used to price a list of loans. Every pricing method prices all of its loans in one vectorised pass,
+    a loan that fails validation gets its own 400 result without failing the rest
+    Args:
+        items: list of loan requests, each with the same params as a single loan invocation
+        date: run date stored with every loan
+    Returns:
+        results: result per loan in the order of items
+        payloads: audit rows of the priced loans
+    """
+    results = [None] * len(items)
+    groups = {"model": [], "market": [], "market_simple": []}
+    inputs = {}
+    specifications = {}
+
+    for i, item in enumerate(items):
+        error = _validate_batch_item(item, specifications)
+        if error is None:
+            pricing_type = item['pricing_type'] if item['pricing_type'] in ("market", "market_simple") else "model"
+            try:
+                inputs[i] = _parse_batch_item(item, pricing_type)
+                groups[pricing_type].append(i)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            results[i] = {'statusCode': 400, "body": error}
+
+    payloads = []
+    for pricing_type, idx in groups.items():
+        if not idx:
+            continue
+        columns = list(zip(*(inputs[i] for i in idx)))
+        try:
+            if pricing_type == "model":
+                prices, errors = pricing_calc_model_batch(s3, list(columns[0]), list(columns[1]), np.array(columns[2]), np.array(columns[3]), list(columns[4]))
+            elif pricing_type == "market":
+                prices, errors = pricing_calc_market_batch(s3, np.array(columns[0]), np.array(columns[1]))
             else:
-                price  = pricing_calc_model(s3, json.dumps(event['queryStringParameters']['product']).strip('\"'), json.dumps(event['queryStringParameters']['credit_risk']).strip('\"'), json.dumps(event['queryStringParameters']['term']).strip('\"'), json.dumps(event['queryStringParameters']['amount']).strip('\"'))
-                payload = create_dataframe(json.dumps(event['queryStringParameters']['product']), json.dumps(event['queryStringParameters']['credit_risk']), json.dumps(event['queryStringParameters']['term']), json.dumps(event['queryStringParameters']['amount']), json.dumps(event['queryStringParameters']['loan_id']), idempotency_key, date, str(price), json.dumps(event['queryStringParameters']['user_name']), json.dumps(event['queryStringParameters']['source_name']), pricing_type = json.dumps(event['queryStringParameters']['pricing_type']))
-                Response = {"statusCode": 200, "output": price, "input":[{"product": event['queryStringParameters']['product'], "credit_risk": event['queryStringParameters']['credit_risk'], "amount": event['queryStringParameters']['amount'], "term": event['queryStringParameters']['term'], "loan_id": event['queryStringParameters']['loan_id'] }], "meta_data":{"run_id": idempotency_key,"run_date": date}}
-        
-        dynamodb.put_item(
-            TableName = "pricing_apirunlog",
-            Item = payload
-        )
-        
-        # End the timer
-        end_time = time.process_time()
-
-        # Calculate the runtime
-        runtime = end_time - start_time
-        Response['meta_data']['run_time'] = runtime
-        print(Response)
-        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(Response)}
-    else:
-        return {'statusCode': 400, "body": "missing required parameters " + str(set(params) - set(list(event['queryStringParameters'].keys())))}
-    
+                prices, errors = pricing_calc_market_simple_batch(s3, np.array(columns[0]), np.array(columns[1]))
+        except Exception as e:
+            print(e)
+            prices, errors = np.full(len(idx), np.nan), [f"Unable to price loan with pricing method {pricing_type}"] * len(idx)
+
+        for i, price, error in zip(idx, prices, errors):
+            if error is not None:
+                results[i] = {'statusCode': 400, "body": error}
+                continue
+            item = items[i]
+            run_id = str(uuid4())
+            method = PRICING_METHODS[pricing_type]
+            optional = {key: json.dumps(item[key]) for key in method.audit_params if key in item}
+            payloads.append(create_dataframe(json.dumps(item['product']), json.dumps(item['credit_risk']), json.dumps(item['term']), json.dumps(item.get('amount')), json.dumps(item.get('loan_id')), run_id, date, str(price), json.dumps(item.get('user_name')), json.dumps(item.get('source_name')), pricing_type = json.dumps(item['pricing_type']), **optional))
+            loan_input = {key: item.get(key) for key in INPUT_PARAMS}
+            loan_input.update({key: item[key] for key in method.input_params if key in item})
+            results[i] = {"statusCode": 200, "output": float(price), "input": [loan_input], "meta_data": {"run_id": run_id}}
+
+    return results, payloads
+
+def batch_handler(items: list, spans: Optional[Spans] = None):
+    """
+    Function used to price a batch of loans in a single invocation. Config tables are loaded once and the loans are priced with price_items
+    Args:
+        items: list of loan requests, each with the same params as a single loan invocation
+        spans: stage durations of the invocation
+    Returns:
+        statusCode 200: returns a result per loan and meta data on run
+        statusCode 400: advises users that the batch is too large
+    """
+    if len(items) > MAX_BATCH_SIZE:
+        return {'statusCode': 400, "body": f"A batch can contain at most {MAX_BATCH_SIZE} loans"}
+
+    spans = Spans() if spans is None else spans
+    start_time = time.process_time()
+    date = datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+    fetch_timings, parse_timings = {}, {}
+    try:
+        with spans.span("config_fetch"):
+            prefetch_tables(s3, {item.get('pricing_type') if item.get('pricing_type') in ("market", "market_simple") else "model" for item in items if isinstance(item, dict)}, fetch_timings, parse_timings)
+    except ConfigLoadError as e:
+        print(e)
+        return {'statusCode': 503, "body": "Pricing config is currently unavailable, please try again"}
+
+    with spans.span("pricing"):
+        results, payloads = price_items(items, date)
+    try:
+        with spans.span("audit_write"):
+            audit_sink.write_many(payloads)
+    except AuditWriteError as e:
+        return _audit_unavailable(e)
+
+    priced = sum(1 for result in results if result['statusCode'] == 200)
+    Response = {"statusCode": 200, "output": results, "meta_data": {"run_date": date, "loans": len(items), "priced": priced, "errors": len(items) - priced}}
+    Response['meta_data']['run_time'] = time.process_time() - start_time
+    Response['meta_data']['config_cache'] = config_cache.stats()
+    Response['meta_data']['s3_fetch_ms'] = fetch_timings
+    Response['meta_data']['parse_ms'] = parse_timings
+    Response['meta_data']['spans_ms'] = dict(spans.durations, total = spans.total())
+    print(Response['meta_data'])
+    with spans.span("serialization"):
+        body = json.dumps(Response)
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': body}
+
+
+def _table_nbytes(table):
+    if isinstance(table, (LazyCsvColumns, LazyCsvTable)):
+        return table.nbytes()
+    if hasattr(table, 'tables'):
+        return sum(_table_nbytes(columns) for columns in table.tables.values())
+    return sum(array_nbytes(column) for column in table.values())
+
+def config_memory_report():
+    """
+    Function used to report the memory held by the cached config tables and, out of it, by each product the model has priced
+    Returns:
+        report: dictionary of the bytes held by each table, their total, and the bytes held by the columns and credit premia bands of each product
+    """
+    tables = {key: _table_nbytes(table) for key, table in config_cache.values().items()}
+    compiled = config_cache.derived_value("model")
+    products = compiled.memory_report() if compiled is not None else {}
+
+    return {'total_bytes': sum(tables.values()), 'tables': tables, 'products': products}
+
+def is_warmup_event(event):
+    """
+    Function used to recognise the events that keep the lambda warm, an EventBridge scheduled event or a direct invocation with "warmup": true
+    Args:
+        event: event passed to the lambda
+    Returns:
+        True when the event is a warm-up event
+    """
+    if not isinstance(event, dict):
+        return False
+    return event.get('warmup') is True or (event.get('source') == "aws.events" and event.get('detail-type') == "Scheduled Event")
+
+def preload(s3, refresh: bool = False):
+    """
+    Function used to load every config table into the config cache and build the product specifications and compiled model tables from them
+    Args:
+        s3: s3 connection
+        refresh: revalidate the cached tables with S3 even when their TTL has not passed
+    Returns:
+        report: dictionary of the preload duration and the fetch and parse duration of each table
+    """
+    start = time.perf_counter()
+    if refresh:
+        config_cache.expire()
+    fetch_timings, parse_timings = {}, {}
+    prefetch_tables(s3, list(PRICING_METHODS), fetch_timings, parse_timings)
+    (prodspec,), _ = read_tables(s3, (PRODUCT_SPECIFICATION_KEY,))
+    tables, _ = compiled_pricingband_model(s3)
+    model_products = []
+    for product in prodspec['Idx'].tolist():
+        supported, _, pricing_methods = product_specification(s3, product)
+        if supported == 1 and "model" in pricing_methods:
+            model_products.append(product)
+    # only products that can be priced with the model have their model tables loaded
+    tables.load(model_products)
+
+    return {'ready': True, 'preload_ms': round((time.perf_counter() - start) * 1000, 3), 'products': len(prodspec['Idx']),
+            'config_cache': config_cache.stats(), 's3_fetch_ms': fetch_timings, 'parse_ms': parse_timings, 'config_memory': config_memory_report()}
+
+def warmup_handler(spans: Optional[Spans] = None):
+    """
+    Function used to answer a warm-up event, the config tables are revalidated and any that changed are loaded again. Nothing is written to the pricing_apirunlog table
+    Args:
+        spans: stage durations of the invocation
+    Returns:
+        statusCode 200: returns the preload report
+        statusCode 503: advises that the config tables could not be loaded
+    """
+    spans = Spans() if spans is None else spans
+    try:
+        with spans.span("config_fetch"):
+            report = preload(s3, refresh = True)
+    except Exception as e:
+        print(json.dumps({'ready': False, 'error': repr(e)}))
+        return {'statusCode': 503, "body": "Pricing config is currently unavailable, please try again"}
+    print(json.dumps(report))
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(report)}
+
+
+if PRELOAD_CONFIG:
+    # a failed preload leaves the tables to be loaded by the first invocation instead of failing the init
+    try:
+        print(json.dumps(preload(s3)))
+    except Exception as e:
+        print(json.dumps({'ready': False, 'error': repr(e)}))
@@ -0,0 +1,105 @@
+import json
+
+# Params echoed back in the input of the response, in this order, followed by the optional params of the pricing method
+INPUT_PARAMS = ("product", "credit_risk", "amount", "term", "loan_id")
+
+
+class RequestError(ValueError):
+    """
+    Raised when the params of an invocation cannot be priced, the message is returned to the client with a 400
+    """
+
+
+def param_text(value):
+    # query string parameters have always been read as json.dumps(value).strip('"')
+    return json.dumps(value).strip('\"')
+
+
+class PricingRequest:
+    """
+    Params of a single loan invocation, read from the query string once. The raw params are kept for the
+    audit row and the response, the text values are what the pricing functions are called with
+    """
+
+    __slots__ = ('params', 'product', 'pricing_type', 'credit_risk', 'term', 'amount', 'loan_to_value', 'de_run_id')
+
+    def __init__(self, params: dict):
+        self.params = params
+        self.product = param_text(params['product'])
+        self.pricing_type = params.get('pricing_type')
+        try:
+            self.credit_risk = param_text(params['credit_risk'])
+            self.term = param_text(params['term'])
+            self.amount = param_text(params['amount'])
+        except KeyError as e:
+            raise RequestError(f"missing required parameters {{'{e.args[0]}'}}")
+        self.loan_to_value = param_text(params['loan_to_value']) if 'loan_to_value' in params else None
+        self.de_run_id = param_text(params['de_run_id']) if 'de_run_id' in params else None
+
+    def credit_score(self):
+        """
+        Function used to read the credit risk as the 1-10 score used by the market pricing methods
+        Returns:
+            credit_risk: credit risk as a float
+        """
+        try:
+            return float(self.credit_risk)
+        except ValueError:
+            raise RequestError("Credit risk must be a value between 1 and 10 for this pricing type")
+
+    def audit_params(self, optional_params: tuple):
+        """
+        Function used to get the params stored in the audit row the way create_dataframe expects them
+        Args:
+            optional_params: optional params of the pricing method that are stored when they were passed
+        Returns:
+            params: dictionary of json encoded params
+        """
+        params = self.params
+        audit = {key: json.dumps(params.get(key)) for key in ("product", "credit_risk", "term", "amount", "loan_id", "user_name", "source_name", "pricing_type")}
+        audit.update({key: json.dumps(params[key]) for key in optional_params if key in params})
+        return audit
+
+    def input(self, optional_params: tuple):
+        """
+        Function used to get the params echoed back in the response
+        Args:
+            optional_params: optional params of the pricing method that are echoed when they were passed
+        Returns:
+            input: dictionary of the params as they were passed
+        """
+        params = self.params
+        echoed = {key: params.get(key) for key in INPUT_PARAMS}
+        echoed.update({key: params[key] for key in optional_params if key in params})
+        return echoed
+
+
+class PricingMethod:
+    """
+    Entry of the pricing method dispatch table
+    """
+
+    __slots__ = ('name', 'price', 'audit_params', 'input_params')
+
+    def __init__(self, name: str, price, audit_params: tuple = (), input_params: tuple = ()):
+        self.name = name
+        self.price = price
+        self.audit_params = audit_params
+        self.input_params = input_params
+
+
+def register_pricing_method(methods: dict, name: str, audit_params: tuple = (), input_params: tuple = ()):
+    """
+    Function used to add a pricing method to a dispatch table
+    Args:
+        methods: dispatch table of pricing type to PricingMethod
+        name: pricing type the method is selected with
+        audit_params: optional params stored in the audit row when they were passed
+        input_params: optional params echoed back in the response when they were passed
+    Returns:
+        register: decorator taking a function of (s3, request) that returns the price
+    """
+    def register(price):
+        methods[name] = PricingMethod(name, price, audit_params, input_params)
+        return price
+    return register
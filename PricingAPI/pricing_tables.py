@@ -0,0 +1,620 @@
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+import numpy as np
+from csv_table import array_nbytes
+
+
+class TableLookupError(IndexError):
+    """
+    Raised when a config table has no row for the requested inputs
+    """
+
+
+def _column(table, name: str):
+    """
+    Function used to read a column of a config table as a numpy array
+    Args:
+        table: dataframe (or mapping of column name to values) of a config table
+        name: column name
+    Returns:
+        values: numpy array of the column
+    """
+    return np.asarray(table[name])
+
+
+class NearestLookup:
+    """
+    Sorted breakpoints of a config table axis (term, size) that return the row nearest to a value.
+    Ties resolve to the row that appears first in the table, matching np.abs(column - value).idxmin()
+    """
+    __slots__ = ('breakpoints', 'rows', '_breakpoints_list', '_rows_list')
+
+    def __init__(self, breakpoints):
+        breakpoints = np.asarray(breakpoints)
+        valid = np.flatnonzero(~np.isnan(breakpoints.astype(float)))
+        # np.unique keeps the first occurrence of duplicated breakpoints, idxmin does the same
+        self.breakpoints, first = np.unique(breakpoints[valid], return_index=True)
+        self.rows = valid[first]
+        self._breakpoints_list = self.breakpoints.tolist()
+        self._rows_list = self.rows.tolist()
+
+    def row(self, value):
+        """
+        Function used to find the table row nearest to a value
+        Args:
+            value: value to search for
+        Returns:
+            row: positional index of the nearest row
+        """
+        breakpoints, rows = self._breakpoints_list, self._rows_list
+        if not breakpoints:
+            raise TableLookupError("Lookup table is empty")
+        i = bisect_left(breakpoints, value)
+        if i == 0:
+            return rows[0]
+        if i == len(breakpoints):
+            return rows[-1]
+        below = abs(breakpoints[i - 1] - value)
+        above = abs(breakpoints[i] - value)
+        if below < above or (below == above and rows[i - 1] < rows[i]):
+            return rows[i - 1]
+        return rows[i]
+
+    def rows_many(self, values):
+        """
+        Function used to find the table rows nearest to an array of values
+        Args:
+            values: numpy array of values to search for
+        Returns:
+            rows: numpy array of positional row indexes
+        """
+        if len(self.breakpoints) == 0:
+            raise TableLookupError("Lookup table is empty")
+        values = np.asarray(values)
+        i = np.searchsorted(self.breakpoints, values)
+        lo = np.clip(i - 1, 0, len(self.breakpoints) - 1)
+        hi = np.clip(i, 0, len(self.breakpoints) - 1)
+        below = np.abs(self.breakpoints[lo] - values)
+        above = np.abs(self.breakpoints[hi] - values)
+        pick_lo = (below < above) | ((below == above) & (self.rows[lo] < self.rows[hi]))
+        return np.where(pick_lo, self.rows[lo], self.rows[hi])
+
+
+class IntervalLookup:
+    """
+    DimOneValMin/DimOneValMax bands of the credit premia table for one product and credit risk.
+    The first band (in table order) with DimOneValMin <= value <= DimOneValMax is returned.
+    """
+    __slots__ = ('mins', 'maxs', 'values', 'disjoint', '_mins_list', '_maxs_list')
+
+    def __init__(self, mins, maxs, values):
+        mins, maxs, values = np.asarray(mins, dtype=float), np.asarray(maxs, dtype=float), np.asarray(values)
+        # rows with a missing bound can never satisfy the band comparison
+        valid = ~(np.isnan(mins) | np.isnan(maxs))
+        mins, maxs, values = mins[valid], maxs[valid], values[valid]
+        order = np.argsort(mins, kind='stable')
+        sorted_mins, sorted_maxs = mins[order], maxs[order]
+        self.disjoint = bool(np.all(sorted_mins <= sorted_maxs) and np.all(sorted_maxs[:-1] < sorted_mins[1:]))
+        if self.disjoint:
+            mins, maxs, values = sorted_mins, sorted_maxs, values[order]
+        self.mins, self.maxs, self.values = mins, maxs, values
+        self._mins_list = mins.tolist()
+        self._maxs_list = maxs.tolist()
+
+    def value(self, value: float):
+        """
+        Function used to find the value of the band that contains a value
+        Args:
+            value: value to search for
+        Returns:
+            value: Value column of the matching band
+        """
+        if self.disjoint:
+            i = bisect_right(self._mins_list, value) - 1
+            if i >= 0 and value <= self._maxs_list[i]:
+                return self.values[i]
+        else:
+            for i, (low, high) in enumerate(zip(self._mins_list, self._maxs_list)):
+                if low <= value <= high:
+                    return self.values[i]
+        raise TableLookupError(f"No credit premia band contains {value}")
+
+    def values_many(self, values):
+        """
+        Function used to find the band values for an array of values
+        Args:
+            values: numpy array of values to search for
+        Returns:
+            values: numpy array of band values, NaN where no band contains the value
+            found: boolean numpy array that is False where no band contains the value
+        """
+        values = np.asarray(values, dtype=float)
+        if self.disjoint:
+            i = np.searchsorted(self.mins, values, side='right') - 1
+            safe = np.clip(i, 0, max(len(self.mins) - 1, 0))
+            found = (i >= 0) & (len(self.mins) > 0)
+            if len(self.mins):
+                found &= values <= self.maxs[safe]
+        else:
+            inside = (self.mins[None, :] <= values[:, None]) & (self.maxs[None, :] >= values[:, None])
+            found = inside.any(axis=1)
+            safe = inside.argmax(axis=1)
+        result = np.full(values.shape, np.nan)
+        if len(self.values):
+            result[found] = self.values[safe[found]]
+        return result, found
+
+
+class ProductColumns(Mapping):
+    """
+    Value columns of a table with an axis column and one column per product. The column of a product
+    is only read from the table the first time the product is priced, and is then kept
+    """
+
+    def __init__(self, table, axis: str):
+        self._table = table
+        self._products = frozenset(name for name in list(table) if name != axis)
+        self._values = {}
+
+    def __getitem__(self, product: str):
+        values = self._values.get(product)
+        if values is None:
+            if product not in self._products:
+                raise KeyError(product)
+            values = self._values.setdefault(product, _column(self._table, product))
+        return values
+
+    def __contains__(self, product):
+        return product in self._products
+
+    def __iter__(self):
+        return iter(self._products)
+
+    def __len__(self):
+        return len(self._products)
+
+    def load(self, products):
+        """
+        Function used to read the columns of several products, a LazyCsvColumns converts them in one read of the file
+        Args:
+            products: products to read
+        """
+        products = [product for product in products if product in self._products and product not in self._values]
+        if hasattr(self._table, 'convert'):
+            self._table.convert(products)
+        for product in products:
+            self[product]
+
+    def loaded(self):
+        """
+        Function used to get the columns of the products that have been read
+        """
+        return dict(self._values)
+
+
+class ProductCreditPremia:
+    """
+    IntervalLookups of the credit premia table keyed on (product, credit risk). The lookups of a product are
+    built from its rows the first time the product is priced, a table that can read the rows of one product
+    (LazyCsvTable) does so without converting the rows of the other products
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._positions = None
+        self._products = {}
+
+    def get(self, key, default=None):
+        product, credit_risk = key
+        lookups = self._products.get(product)
+        if lookups is None:
+            lookups = self._products.setdefault(product, self._build(product))
+        return lookups.get(credit_risk, default)
+
+    def load(self, products):
+        """
+        Function used to build the lookups of several products, every column of the table is converted once instead of reading the rows of each product
+        Args:
+            products: products to build the lookups for
+        """
+        if hasattr(self._table, 'convert'):
+            self._table.convert(('Product', 'DimTwoVal', 'DimOneValMin', 'DimOneValMax', 'Value'))
+        for product in products:
+            if product not in self._products:
+                self._products.setdefault(product, self._build(product, whole_table = True))
+
+    def _rows(self, product: str, whole_table: bool = False):
+        if hasattr(self._table, 'rows') and not whole_table:
+            return self._table.rows('Product', product)
+        if self._positions is None:
+            positions = {}
+            for row, key in enumerate(_column(self._table, 'Product').tolist()):
+                positions.setdefault(key, []).append(row)
+            self._positions = positions
+        rows = self._positions.get(product, [])
+        return {name: _column(self._table, name)[rows] for name in ('DimTwoVal', 'DimOneValMin', 'DimOneValMax', 'Value')}
+
+    def _build(self, product: str, whole_table: bool = False):
+        """
+        Function used to build the credit premia lookups of a product
+        Args:
+            product: product to build the lookups for
+            whole_table: read the rows of the product from the converted columns of the whole table
+        Returns:
+            lookups: dictionary of credit risk to IntervalLookup
+        """
+        rows = self._rows(product, whole_table)
+        mins, maxs, values = _column(rows, 'DimOneValMin'), _column(rows, 'DimOneValMax'), _column(rows, 'Value')
+        groups = {}
+        for row, credit_risk in enumerate(_column(rows, 'DimTwoVal').tolist()):
+            groups.setdefault(credit_risk, []).append(row)
+        return {credit_risk: IntervalLookup(mins[positions], maxs[positions], values[positions]) for credit_risk, positions in groups.items()}
+
+    def loaded(self):
+        """
+        Function used to get the lookups of the products that have been built
+        """
+        return dict(self._products)
+
+
+class CompiledModelTables:
+    """
+    Lookup structures for the model pricing method, built from the finance, funding curve, size premia,
+    term premia and credit premia tables and reused for every quote on that config version. The axes are
+    built up front, the columns and credit premia bands of a product the first time it is priced
+    """
+
+    def __init__(self, df_finance, df_fundingcurve, df_sizepremia, df_termpremia, df_creditpremia):
+        nim = {}
+        for product, value in zip(_column(df_finance, "Idx").tolist(), _column(df_finance, "NIM")):
+            nim.setdefault(product, value)
+        self.nim = nim
+
+        self.funding_curve, self.funding_curve_values = self._curve(df_fundingcurve, "Time(in months)")
+        self.term_premia, self.term_premia_values = self._curve(df_termpremia, "Time(in months)")
+        self.size_premia, self.size_premia_values = self._curve(df_sizepremia, "Size(in thousands)")
+
+        self.credit_premia = ProductCreditPremia(df_creditpremia)
+
+    @staticmethod
+    def _curve(table, axis: str):
+        """
+        Function used to compile a table with an axis column and one value column per product
+        Args:
+            table: dataframe of the curve table
+            axis: name of the axis column
+        Returns:
+            lookup: NearestLookup over the axis column
+            values: ProductColumns of product to numpy array of values
+        """
+        return NearestLookup(_column(table, axis)), ProductColumns(table, axis)
+
+    def load(self, products):
+        """
+        Function used to read the columns and build the credit premia bands of products before they are priced
+        Args:
+            products: products to load
+        """
+        for curve in (self.funding_curve_values, self.term_premia_values, self.size_premia_values):
+            curve.load(products)
+        self.credit_premia.load(products)
+
+    def memory_report(self):
+        """
+        Function used to report the memory held for each product that has been loaded
+        Returns:
+            report: dictionary of product to the bytes held by its curve columns and credit premia bands
+        """
+        report = {}
+        for curve in (self.funding_curve_values, self.term_premia_values, self.size_premia_values):
+            for product, values in curve.loaded().items():
+                report[product] = report.get(product, 0) + array_nbytes(values)
+        for product, lookups in self.credit_premia.loaded().items():
+            if not lookups:
+                continue
+            held = sum(lookup.mins.nbytes + lookup.maxs.nbytes + array_nbytes(lookup.values) for lookup in lookups.values())
+            report[product] = report.get(product, 0) + held
+        return report
+
+    def nim_value(self, product: str):
+        if product not in self.nim:
+            raise TableLookupError(f"Product {product} is not in the finance table")
+        return self.nim[product]
+
+    def credit_premia_value(self, product: str, credit_risk: str, value: float):
+        lookup = self.credit_premia.get((product, credit_risk))
+        if lookup is None:
+            raise TableLookupError(f"No credit premia for product {product} and credit risk {credit_risk}")
+        return lookup.value(value)
+
+    def price(self, product: str, credit_risk: str, term, amount, loan_to_value=None):
+        """
+        Function used to calculate the model price of a loan
+        Args:
+            product: product that we want to price for
+            credit_risk: credit risk of the loan we want to price for
+            term: term of the loan in months
+            amount: amount the loan is for
+            loan_to_value: loan to value of the loan, used instead of term for the credit premia band when supplied
+        Returns:
+            price: predicted price for the loan
+        """
+        NIM = self.nim_value(product) * 100
+
+        FC_premia = self.funding_curve_values[product][self.funding_curve.row(int(term))]/100
+        Term_Premia = self.term_premia_values[product][self.term_premia.row(int(term))]/100
+        Size_Premia = self.size_premia_values[product][self.size_premia.row(int(amount)/1000)]/100
+
+        band = float(term) if loan_to_value is None else float(loan_to_value)
+        Credit_Premia = self.credit_premia_value(product, credit_risk, band)/100
+
+        return NIM + FC_premia + Term_Premia + Size_Premia + Credit_Premia
+
+    def price_many(self, products, credit_risks, terms, amounts, bands):
+        """
+        Function used to calculate the model price of many loans at once
+        Args:
+            products: list of products
+            credit_risks: list of credit risks
+            terms: numpy array of integer terms in months
+            amounts: numpy array of integer loan amounts
+            bands: numpy array of the values used to find the credit premia band (loan to value, or term when there is none)
+        Returns:
+            prices: numpy array of prices, NaN where the loan could not be priced
+            errors: list of error messages, None where the loan was priced
+        """
+        products = np.asarray(products, dtype=object)
+        credit_risks = np.asarray(credit_risks, dtype=object)
+        terms = np.asarray(terms)
+        sizes = np.asarray(amounts)/1000
+        bands = np.asarray(bands, dtype=float)
+        prices = np.full(len(products), np.nan)
+        errors = [None] * len(products)
+        if len(products) == 0:
+            return prices, errors
+
+        funding_curve_rows = self.funding_curve.rows_many(terms)
+        term_premia_rows = self.term_premia.rows_many(terms)
+        size_premia_rows = self.size_premia.rows_many(sizes)
+
+        for product in set(products.tolist()):
+            idx = np.flatnonzero(products == product)
+            curves = (self.funding_curve_values, self.term_premia_values, self.size_premia_values)
+            if product not in self.nim or any(product not in curve for curve in curves):
+                for i in idx:
+                    errors[i] = f"Product {product} is not in the pricing tables"
+                continue
+
+            Credit_Premia = np.full(len(idx), np.nan)
+            found = np.zeros(len(idx), dtype=bool)
+            for credit_risk in set(credit_risks[idx].tolist()):
+                sub = np.flatnonzero(credit_risks[idx] == credit_risk)
+                lookup = self.credit_premia.get((product, credit_risk))
+                if lookup is not None:
+                    Credit_Premia[sub], found[sub] = lookup.values_many(bands[idx[sub]])
+
+            NIM = self.nim[product] * 100
+            FC_premia = self.funding_curve_values[product][funding_curve_rows[idx]]/100
+            Term_Premia = self.term_premia_values[product][term_premia_rows[idx]]/100
+            Size_Premia = self.size_premia_values[product][size_premia_rows[idx]]/100
+
+            prices[idx] = NIM + FC_premia + Term_Premia + Size_Premia + Credit_Premia/100
+            for i in idx[~found]:
+                errors[i] = f"No credit premia band for product {product}, credit risk {credit_risks[i]} and value {bands[i]}"
+                prices[i] = np.nan
+
+        return prices, errors
+
+    def rate_card(self, product: str, terms, amounts, credit_risks, loan_to_values=None):
+        """
+        Function used to calculate the model price of every combination of term, amount, credit risk and loan to value for a product.
+        Every axis is looked up once and the cube is built by broadcasting, each cell equals price for the same inputs
+        Args:
+            product: product that we want to price for
+            terms: terms in months
+            amounts: loan amounts
+            credit_risks: credit risk grades
+            loan_to_values: loan to values used for the credit premia band, None to use the term as price does without one
+        Returns:
+            prices: numpy array of shape (terms, amounts, credit_risks) or (terms, amounts, credit_risks, loan_to_values), NaN where no credit premia band applies
+        """
+        curves = (self.funding_curve_values, self.term_premia_values, self.size_premia_values)
+        if any(product not in curve for curve in curves):
+            raise TableLookupError(f"Product {product} is not in the pricing tables")
+        NIM = self.nim_value(product) * 100
+
+        terms = np.asarray(terms).astype(np.int64)
+        sizes = np.asarray(amounts).astype(np.int64)/1000
+        FC_premia = self.funding_curve_values[product][self.funding_curve.rows_many(terms)]/100
+        Term_Premia = self.term_premia_values[product][self.term_premia.rows_many(terms)]/100
+        Size_Premia = self.size_premia_values[product][self.size_premia.rows_many(sizes)]/100
+
+        # credit premia has an axis per credit risk and one for the band, which is the term unless loan to values are given
+        bands = terms.astype(float) if loan_to_values is None else np.asarray(loan_to_values, dtype=float)
+        Credit_Premia = np.full((len(credit_risks), len(bands)), np.nan)
+        for i, credit_risk in enumerate(credit_risks):
+            lookup = self.credit_premia.get((product, credit_risk))
+            if lookup is not None:
+                Credit_Premia[i] = lookup.values_many(bands)[0]/100
+
+        # the terms are added in the order price adds them so every cell is bit for bit the same
+        if loan_to_values is None:
+            base = NIM + FC_premia[:, None, None] + Term_Premia[:, None, None] + Size_Premia[None, :, None]
+            return base + Credit_Premia.T[:, None, :]
+        base = NIM + FC_premia[:, None, None, None] + Term_Premia[:, None, None, None] + Size_Premia[None, :, None, None]
+        return base + Credit_Premia[None, None, :, :]
+
+
+def _risk_bucket(credit_risk: float):
+    """
+    Function used to map a numeric credit risk onto a column of the term discount table
+    """
+    if credit_risk >= 7.5:
+        return "Strong"
+    if credit_risk >= 5:
+        return "Good"
+    if credit_risk >= 2.5:
+        return "Satisfactory"
+    return "Weak"
+
+
+def _integer_terms(values):
+    """
+    Function used to find the rows of a term column that an integer term can equal
+    Args:
+        values: term column
+    Returns:
+        rows: positions of the rows holding a whole number
+        terms: the whole numbers of those rows as int64
+    """
+    values = np.asarray(values, dtype=float)
+    # a whole number beyond int64 cannot be the term of a loan
+    rows = np.flatnonzero(np.isfinite(values) & (values == np.floor(values)) & (np.abs(values) < 2.0 ** 63))
+    return rows, values[rows].astype(np.int64)
+
+
+class MarketGrid:
+    """
+    Term discount table of the market pricing method compiled into the sorted whole terms of the table, each with
+    the first row of the table for that term as the equality filter on Term found it. A term is found with a bisect,
+    so a table with a very large term holds no more than its rows
+    """
+    __slots__ = ('terms', 'rows', 'columns', '_terms_list')
+
+    def __init__(self, discount):
+        rows, terms = _integer_terms(_column(discount, "Term"))
+        # a repeated term keeps its first row
+        self.terms, first = np.unique(terms, return_index=True)
+        self.rows = rows[first].astype(np.int64)
+        self._terms_list = self.terms.tolist()
+        self.columns = {bucket: _column(discount, bucket) for bucket in ("Strong", "Good", "Satisfactory", "Weak") if bucket in discount}
+
+    def _terms(self):
+        return f"{self._terms_list[0]} to {self._terms_list[-1]}" if self._terms_list else "none"
+
+    def row(self, term):
+        """
+        Function used to find the row of the term discount table for a term
+        Args:
+            term: term of the loan in months
+        Returns:
+            row: positional index of the row
+        """
+        term = int(term)
+        i = bisect_left(self._terms_list, term)
+        if i == len(self._terms_list) or self._terms_list[i] != term:
+            raise TableLookupError(f"No term discount for term {term}, the table has terms {self._terms()}")
+        return int(self.rows[i])
+
+    def column(self, bucket: str):
+        if bucket not in self.columns:
+            raise TableLookupError(f"The term discount table has no {bucket} column")
+        return self.columns[bucket]
+
+    def price(self, credit_risk: float, term):
+        """
+        Function used to calculate the market price of a loan
+        Args:
+            credit_risk: credit risk of the loan between 1 and 10
+            term: term of the loan in months
+        Returns:
+            price: predicted price for the loan
+        """
+        term_discount = self.column(_risk_bucket(credit_risk))[self.row(term)]/100
+
+        return (- 1.3333333 * credit_risk + 28.333333) - term_discount
+
+    def rows_many(self, terms):
+        """
+        Function used to find the rows of the term discount table for an array of terms
+        Args:
+            terms: numpy array of integer terms
+        Returns:
+            rows: numpy array of positional row indexes, -1 where the table has no row for the term
+        """
+        terms = np.asarray(terms, dtype=np.int64)
+        i = np.searchsorted(self.terms, terms)
+        inside = i < len(self.terms)
+        inside[inside] = self.terms[i[inside]] == terms[inside]
+        rows = np.full(terms.shape, -1, dtype=np.int64)
+        rows[inside] = self.rows[i[inside]]
+        return rows
+
+
+class MarketSimpleGrid:
+    """
+    Market simple table compiled into segments of terms covered by the same rows. A row covers the whole terms
+    with DimOneValMin < term <= DimOneValMax, the segments start at every term where a band starts or ends, and each
+    holds the rows covering its terms in table order, padded with -1. Bands can be open ended (inf) or very wide,
+    a segment is found by a bisect over the segment starts. The row nearest to the credit risk is found over the
+    whole table and read by position from the rows of the term, as pricing_calc_market_simple has always done
+    """
+    __slots__ = ('starts', 'terms', 'bands', 'counts', 'nearest', 'values', '_starts_list', '_counts_list')
+
+    def __init__(self, market_simple):
+        mins = np.asarray(_column(market_simple, 'DimOneValMin'), dtype=float)
+        maxs = np.asarray(_column(market_simple, 'DimOneValMax'), dtype=float)
+        self.values = _column(market_simple, 'Value')
+        self.nearest = NearestLookup(_column(market_simple, 'DimTwoValue'))
+
+        # the whole terms of a band are floor(min) + 1 to floor(max), rows with a missing bound are in no band
+        valid = np.flatnonzero(~(np.isnan(mins) | np.isnan(maxs)))
+        lows, ends = np.floor(mins[valid]) + 1, np.floor(maxs[valid]) + 1
+        valid, lows, ends = valid[lows < ends], lows[lows < ends], ends[lows < ends]
+        self.terms = (lows.min(), ends.max() - 1) if len(valid) else None
+        self.starts = np.unique(np.concatenate([lows, ends]))
+
+        # one entry per row and segment it covers, ordered by segment and then by row so the rows of a segment keep table order
+        first, last = np.searchsorted(self.starts, lows), np.searchsorted(self.starts, ends)
+        widths = last - first
+        rows = np.repeat(valid, widths)
+        segments = np.repeat(first - np.cumsum(widths) + widths, widths) + np.arange(int(widths.sum()))
+        order = np.lexsort((rows, segments))
+        rows, segments = rows[order], segments[order]
+        self.counts = np.bincount(segments, minlength = len(self.starts)).astype(np.int64)
+        rank = np.arange(len(segments)) - np.repeat(np.cumsum(self.counts) - self.counts, self.counts)
+        self.bands = np.full((len(self.starts), int(self.counts.max()) if len(self.starts) else 0), -1, dtype=np.int64)
+        self.bands[segments, rank] = rows
+        self._starts_list = self.starts.tolist()
+        self._counts_list = self.counts.tolist()
+
+    def _table_terms(self):
+        if self.terms is None:
+            return "none"
+        return " to ".join(str(int(term)) if np.isfinite(term) else str(term) for term in self.terms)
+
+    def price(self, credit_risk: float, term):
+        """
+        Function used to read the market simple price of a loan
+        Args:
+            credit_risk: credit risk of the loan between 1 and 10
+            term: term of the loan in months
+        Returns:
+            price: predicted price for the loan
+        """
+        i = bisect_right(self._starts_list, int(term)) - 1
+        if i < 0 or self._counts_list[i] == 0:
+            raise TableLookupError(f"No market price for term {term}, the table has terms {self._table_terms()}")
+        nearest = self.nearest.row(float(credit_risk))
+        if nearest >= self._counts_list[i]:
+            raise TableLookupError(f"No market price for term {term} and credit risk {credit_risk}")
+
+        return self.values[self.bands[i, nearest]]/100
+
+    def values_many(self, credit_risks, terms):
+        """
+        Function used to read the market simple prices of many loans
+        Args:
+            credit_risks: numpy array of credit risks
+            terms: numpy array of integer terms
+        Returns:
+            prices: numpy array of prices, NaN where the table has no price for the loan
+            found: boolean numpy array that is False where the table has no price for the loan
+        """
+        i = np.searchsorted(self.starts, np.asarray(terms, dtype=np.int64), side='right') - 1
+        nearest = self.nearest.rows_many(np.asarray(credit_risks, dtype=float))
+        found = i >= 0
+        found[found] = nearest[found] < self.counts[i[found]]
+        prices = np.full(i.shape, np.nan)
+        prices[found] = self.values[self.bands[i[found], nearest[found]]]/100
+        return prices, found
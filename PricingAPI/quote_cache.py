@@ -0,0 +1,108 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Most quotes held in memory, the least recently used quote is evicted first
+QUOTE_CACHE_SIZE = int(os.environ.get("QUOTE_CACHE_SIZE", "10000"))
+
+
+def quote_key(pricing_type: str, product: str, credit_risk, term, amount=None, loan_to_value=None):
+    """
+    Function used to build a cache key from pricing inputs, equivalent inputs such as "24" and 24 give the same key
+    Args:
+        pricing_type: model, market or market_simple
+        product: product that we want to price for
+        credit_risk: credit risk of the loan, a grade for model and a number for the market pricing types
+        term: term of the loan in months
+        amount: amount the loan is for, only used by model
+        loan_to_value: loan to value of the loan, only used by model
+    Returns:
+        key: tuple of normalised inputs, None when an input cannot be normalised
+    """
+    try:
+        if pricing_type == "model":
+            return (str(product), str(credit_risk), int(term), int(amount), None if loan_to_value is None else float(loan_to_value))
+        return (float(credit_risk), int(term))
+    except (TypeError, ValueError):
+        return None
+
+
+class QuoteCache:
+    """
+    In process LRU cache of prices. Entries are grouped by pricing type together with the version of
+    the config tables they were priced with, a new table version drops every quote of that pricing type
+    """
+
+    def __init__(self, maxsize: int = QUOTE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._quotes = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_price(self, pricing_type: str, version: tuple, key, price):
+        """
+        Function used to return a cached price or calculate and cache it
+        Args:
+            pricing_type: model, market or market_simple
+            version: ETags of the config tables the price depends on
+            key: normalised inputs from quote_key
+            price: callable calculating the price on a cache miss
+        Returns:
+            price: price of the loan
+        """
+        if key is None or self.maxsize <= 0 or None in version:
+            return price()
+
+        with self._lock:
+            if self._versions.get(pricing_type) != version:
+                stale = [cached for cached in self._quotes if cached[0] == pricing_type]
+                for cached in stale:
+                    del self._quotes[cached]
+                if pricing_type in self._versions:
+                    self.invalidations += 1
+                self._versions[pricing_type] = version
+            cached = self._quotes.get((pricing_type,) + key)
+            if cached is not None:
+                self._quotes.move_to_end((pricing_type,) + key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        value = price()
+
+        with self._lock:
+            if self._versions.get(pricing_type) == version:
+                self._quotes[(pricing_type,) + key] = value
+                while len(self._quotes) > self.maxsize:
+                    self._quotes.popitem(last = False)
+                    self.evictions += 1
+
+        return value
+
+    def stats(self):
+        """
+        Function used to report cache counters
+        Returns:
+            dictionary of hits, misses, hit rate, evictions, invalidations and the number of cached quotes
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._quotes),
+        }
+
+    def clear(self):
+        """
+        Function used to drop every cached quote, counters are left as they are
+        """
+        with self._lock:
+            self._quotes.clear()
+            self._versions.clear()
@@ -0,0 +1,160 @@
+"""
+Rate cards of the model pricing method.
+
+Prices every combination of term, amount, credit risk grade and (optionally) loan to value
+for a product in one vectorised pass over the finance, funding curve, size premia, term premia
+and credit premia tables, instead of one pricing_calc_model call per cell.
+
+Axes are given as comma separated values or as start:stop:step ranges that include stop.
+The card is written as a long CSV (one row per cell), as a .npz file holding the price cube
+and its axes, or as Parquet when pyarrow is installed.
+
+Usage:
+    python rate_card.py --product B --terms 6:360:6 --amounts 10000:2000000:10000 --output card.csv
+                        [--credit-risks Strong,Good,Satisfactory,Weak] [--loan-to-values 0:100:5] [--decimals 4]
+"""
+import argparse
+import csv
+import sys
+import time
+from io import StringIO
+import numpy as np
+
+CREDIT_RISKS = ['Strong', 'Good', 'Satisfactory', 'Weak']
+CSV_HEADER = ['product', 'term', 'amount', 'credit_risk', 'loan_to_value', 'price']
+
+
+def parse_axis(text: str, dtype=float):
+    """
+    Function used to read the values of a rate card axis
+    Args:
+        text: comma separated values, or start:stop:step with stop included
+        dtype: type of the values
+    Returns:
+        values: numpy array of the axis values
+    """
+    if ':' in text:
+        start, stop, step = (float(part) for part in text.split(':'))
+        if step <= 0:
+            raise ValueError(f"The step of the range {text} must be positive")
+        # half a step past stop so that stop is included despite rounding
+        return np.arange(start, stop + step / 2, step).astype(dtype)
+    return np.array([float(value) for value in text.split(',')]).astype(dtype)
+
+
+def card_columns(product: str, terms, amounts, credit_risks, loan_to_values, prices, term_index: int):
+    """
+    Function used to get the rows of a rate card for one term as columns
+    Args:
+        product: product of the rate card
+        terms: terms of the rate card
+        amounts: amounts of the rate card
+        credit_risks: credit risks of the rate card
+        loan_to_values: loan to values of the rate card, None when the term is used for the credit premia band
+        prices: price cube
+        term_index: position of the term
+    Returns:
+        columns: list of columns in the order of CSV_HEADER
+    """
+    block = prices[term_index]
+    shape = block.shape
+    amount_column = np.repeat(amounts, int(np.prod(shape[1:])))
+    credit_risk_column = np.tile(np.repeat(np.array(credit_risks, dtype=object), shape[2] if len(shape) == 3 else 1), shape[0])
+    if loan_to_values is None:
+        loan_to_value_column = [None] * block.size
+    else:
+        loan_to_value_column = np.tile(loan_to_values, shape[0] * shape[1]).tolist()
+    return [[product] * block.size, [int(terms[term_index])] * block.size, amount_column.tolist(), credit_risk_column.tolist(), loan_to_value_column, block.ravel()]
+
+
+def _csv_line(values):
+    output = StringIO()
+    csv.writer(output, lineterminator = '').writerow(values)
+    return output.getvalue()
+
+
+def write_csv(path: str, product: str, terms, amounts, credit_risks, loan_to_values, prices, decimals: int = None):
+    """
+    Function used to write a rate card as a long CSV, one term at a time so the text of the whole card is never held in memory.
+    The amount, credit risk and loan to value of a row repeat for every term, so their text is only built once
+    """
+    columns = card_columns(product, terms, amounts, credit_risks, loan_to_values, prices, 0)
+    cells = [_csv_line([amount, credit_risk, '' if loan_to_value is None else loan_to_value]) for amount, credit_risk, loan_to_value in zip(*columns[2:5])]
+    with open(path, 'w', newline='') as f:
+        f.write(_csv_line(CSV_HEADER) + '\n')
+        for term_index, term in enumerate(terms.tolist()):
+            block = prices[term_index].ravel()
+            if decimals is not None:
+                block = np.round(block, decimals)
+            prefix = _csv_line([product, term]) + ','
+            # cells without a credit premia band are written empty
+            f.write(''.join(f"{prefix}{cell},{'' if price != price else price}\n" for cell, price in zip(cells, block.tolist())))
+
+
+def write_parquet(path: str, product: str, terms, amounts, credit_risks, loan_to_values, prices, decimals: int = None):
+    """
+    Function used to write a rate card as a long Parquet file, pyarrow has to be installed
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise SystemExit("Writing Parquet needs pyarrow, install it or write the rate card as .csv or .npz")
+    import pandas as pd
+
+    blocks = [card_columns(product, terms, amounts, credit_risks, loan_to_values, prices, term_index) for term_index in range(len(terms))]
+    df = pd.DataFrame({name: np.concatenate([np.asarray(block[i], dtype=object if i in (0, 3, 4) else None) for block in blocks]) for i, name in enumerate(CSV_HEADER)})
+    if decimals is not None:
+        df['price'] = df['price'].round(decimals)
+    df.to_parquet(path, index = False)
+
+
+def write_npz(path: str, product: str, terms, amounts, credit_risks, loan_to_values, prices, decimals: int = None):
+    """
+    Function used to write the price cube of a rate card with its axes, the most compact form of the card
+    """
+    axes = {'terms': terms, 'amounts': amounts, 'credit_risks': np.array(credit_risks)}
+    if loan_to_values is not None:
+        axes['loan_to_values'] = loan_to_values
+    np.savez_compressed(path, product = np.array(product), prices = prices if decimals is None else np.round(prices, decimals), **axes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Price a rate card for a product with the model pricing method")
+    parser.add_argument('--product', required=True, help="product to price")
+    parser.add_argument('--terms', required=True, help="terms in months, for example 12,24,36 or 6:360:6")
+    parser.add_argument('--amounts', required=True, help="loan amounts, for example 10000:2000000:10000")
+    parser.add_argument('--credit-risks', default=",".join(CREDIT_RISKS), help="credit risk grades")
+    parser.add_argument('--loan-to-values', help="loan to values, the term is used for the credit premia band when they are not given")
+    parser.add_argument('--decimals', type=int, help="round prices to this many decimals")
+    parser.add_argument('--output', required=True, help="file to write, .csv, .npz or .parquet")
+    args = parser.parse_args(argv)
+
+    writers = {'.csv': write_csv, '.npz': write_npz, '.parquet': write_parquet}
+    extension = args.output[args.output.rfind('.'):].lower() if '.' in args.output else ''
+    if extension not in writers:
+        parser.error(f"--output must end in one of {sorted(writers)}")
+
+    import main as api
+
+    supported, _, pricing_methods = api.product_specification(api.s3, args.product)
+    if supported == 0 or "model" not in pricing_methods:
+        parser.error(f"Product {args.product} is not priced with the model pricing method")
+
+    terms = parse_axis(args.terms, np.int64)
+    amounts = parse_axis(args.amounts, np.int64)
+    credit_risks = [credit_risk.strip() for credit_risk in args.credit_risks.split(',')]
+    loan_to_values = parse_axis(args.loan_to_values) if args.loan_to_values else None
+
+    start = time.perf_counter()
+    prices = api.pricing_calc_model_rate_card(api.s3, args.product, terms, amounts, credit_risks, loan_to_values)
+    priced = time.perf_counter() - start
+    writers[extension](args.output, args.product, terms, amounts, credit_risks, loan_to_values, prices, args.decimals)
+
+    missing = int(np.isnan(prices).sum())
+    print(f"Priced {prices.size} cells {prices.shape} in {priced:.3f}s, wrote {args.output} in {time.perf_counter() - start - priced:.3f}s", file = sys.stderr)
+    if missing:
+        print(f"{missing} cells have no credit premia band and were left empty", file = sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Offline bulk repricing of a portfolio of loans.
+
+Pricing requests are read from a JSONL file, one API event ({"queryStringParameters": {...}})
+or one object of params per line, or from a CSV file with a column per param. The requests are
+cut into chunks that are priced by a pool of worker processes with the same vectorised pricing
+functions as batch invocations. Every worker loads the config tables once and keeps them for the
+whole run, results are written to the output in input order as chunks complete, so memory stays
+bounded by the number of chunks in flight whatever the size of the input.
+
+Usage:
+    python reprice.py requests.jsonl --output prices.jsonl [--workers 8] [--chunk-size 1000] [--audit skip]
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from itertools import islice
+from multiprocessing import get_context
+
+# skip: no audit rows are written
+# batch: the audit rows of each chunk are written with BatchWriteItem by the worker that priced it
+AUDIT_OPTIONS = ("skip", "batch")
+
+OUTPUT_FIELDS = ("line", "statusCode", "output", "body", "run_id", "input")
+
+_audit_sink = None
+_run_date = None
+_output_csv = False
+
+
+def read_requests(path: str):
+    """
+    Function used to stream the pricing requests of a file
+    Args:
+        path: JSONL file of API events or params, or a CSV file with a header row of params
+    Returns:
+        requests: iterator of the text of each JSONL line, or of a params dictionary per CSV row
+    """
+    with open(path, newline='') as f:
+        if path.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                # an empty cell is a param that was not passed
+                yield {key: value for key, value in row.items() if key and value not in ('', None)}
+            return
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def parse_request(request):
+    """
+    Function used to read the params of a request
+    Args:
+        request: text of a JSONL line or a params dictionary
+    Returns:
+        params: params dictionary, or a message saying why the request cannot be read
+    """
+    if isinstance(request, dict):
+        return request
+    try:
+        event = json.loads(request)
+    except ValueError as e:
+        return f"Unable to read request: {e}"
+    if isinstance(event, dict):
+        event = event.get('queryStringParameters', event)
+    return event if isinstance(event, dict) else "Each request must be a JSON object"
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def init_worker(audit: str, run_date: str, output_csv: bool):
+    """
+    Function used to set up a worker process, config tables are loaded and then kept for the rest of the run
+    Args:
+        audit: one of AUDIT_OPTIONS
+        run_date: run date stored with every loan
+        output_csv: whether records are formatted as CSV rows instead of JSONL
+    """
+    global _audit_sink, _run_date, _output_csv
+    import main
+    from audit import AuditSink
+
+    main.config_cache.ttl = float('inf')
+    main.prefetch_tables(main.s3, main.PRICING_TABLE_KEYS)
+    _audit_sink = AuditSink(main.dynamodb, mode = "sync") if audit == "batch" else None
+    _run_date = run_date
+    _output_csv = output_csv
+
+
+def price_chunk(start: int, requests: list):
+    """
+    Function used to price a chunk of requests in a worker process. Requests are parsed and records formatted
+    here so the process writing the output only joins text
+    Args:
+        start: number of the first request of the chunk, requests are numbered from 1
+        requests: requests as yielded by read_requests
+    Returns:
+        text: output records of the chunk
+        counts: dictionary of priced, errors and audit_failures
+    """
+    import main
+
+    requests = [parse_request(request) for request in requests]
+    items = [request for request in requests if isinstance(request, dict)]
+    priced, payloads = main.price_items(items, _run_date)
+    priced = iter(priced)
+    results = [next(priced) if isinstance(request, dict) else {'statusCode': 400, "body": request} for request in requests]
+
+    counts = {'priced': 0, 'errors': 0, 'audit_failures': 0}
+    if _audit_sink is not None and payloads:
+        written = _audit_sink.written
+        try:
+            _audit_sink.write_many(payloads)
+        except Exception as e:
+            print(f"Unable to write audit rows of requests {start}-{start + len(requests) - 1}: {e!r}", file = sys.stderr)
+            counts['audit_failures'] = len(payloads) - (_audit_sink.written - written)
+
+    output = StringIO()
+    writer = csv.DictWriter(output, OUTPUT_FIELDS) if _output_csv else None
+    for line, result in enumerate(results, start):
+        record = {'line': line, 'statusCode': result['statusCode']}
+        if result['statusCode'] == 200:
+            counts['priced'] += 1
+            record.update(output = result['output'], run_id = result['meta_data']['run_id'], input = result['input'][0])
+        else:
+            counts['errors'] += 1
+            record['body'] = result['body']
+        if writer is None:
+            output.write(json.dumps(record) + '\n')
+        else:
+            writer.writerow(dict(record, input = json.dumps(record['input'])) if 'input' in record else record)
+
+    return output.getvalue(), counts
+
+
+def reprice(input_path: str, output_path: str, workers: int = 0, chunk_size: int = 1000, audit: str = "skip"):
+    """
+    Function used to price every request of a file and stream the results to an output file
+    Args:
+        input_path: JSONL or CSV file of pricing requests
+        output_path: JSONL or CSV file the results are written to, in input order
+        workers: number of worker processes, 0 prices in this process
+        chunk_size: number of requests priced together by a worker
+        audit: one of AUDIT_OPTIONS
+    Returns:
+        summary: dictionary of counts and throughput of the run
+    """
+    if audit not in AUDIT_OPTIONS:
+        raise ValueError(f"Audit option must be one of {AUDIT_OPTIONS}")
+
+    start_time = time.perf_counter()
+    run_date = datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+    output_csv = output_path.lower().endswith('.csv')
+    summary = {'requests': 0, 'priced': 0, 'errors': 0, 'audit_failures': 0}
+
+    chunks = chunked(read_requests(input_path), chunk_size)
+    with open(output_path, 'w', newline='') as f:
+        if output_csv:
+            csv.DictWriter(f, OUTPUT_FIELDS).writeheader()
+
+        def collect(text, counts):
+            f.write(text)
+            for key, value in counts.items():
+                summary[key] += value
+
+        start = 1
+        if workers <= 0:
+            init_worker(audit, run_date, output_csv)
+            for chunk in chunks:
+                collect(*price_chunk(start, chunk))
+                start += len(chunk)
+        else:
+            # a few chunks are queued per worker so that no worker waits for work,
+            # results are written in order so only completed chunks ahead of a slow one are held
+            max_in_flight = workers * 2
+            in_flight = deque()
+            with ProcessPoolExecutor(max_workers = workers, mp_context = get_context("spawn"), initializer = init_worker, initargs = (audit, run_date, output_csv)) as pool:
+                for chunk in chunks:
+                    if len(in_flight) >= max_in_flight:
+                        collect(*in_flight.popleft().result())
+                    in_flight.append(pool.submit(price_chunk, start, chunk))
+                    start += len(chunk)
+                while in_flight:
+                    collect(*in_flight.popleft().result())
+
+    seconds = time.perf_counter() - start_time
+    summary['requests'] = start - 1
+    summary['seconds'] = round(seconds, 3)
+    summary['requests_per_second'] = round(summary['requests'] / seconds, 1) if seconds else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Price a file of pricing requests offline with a pool of worker processes")
+    parser.add_argument('input', help="JSONL file of API events or params, or a CSV file with a column per param")
+    parser.add_argument('--output', required=True, help="JSONL or CSV file the results are written to")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="number of worker processes, 0 prices in this process")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="number of requests priced together by a worker")
+    parser.add_argument('--audit', choices=AUDIT_OPTIONS, default="skip", help="skip writing audit rows or write them in batches to the pricing_apirunlog table")
+    args = parser.parse_args(argv)
+
+    summary = reprice(args.input, args.output, args.workers, args.chunk_size, args.audit)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
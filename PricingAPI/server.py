@@ -0,0 +1,344 @@
+"""
+Standalone HTTP server for running the pricer as a long lived service instead of a lambda.
+
+A GET is turned into an event with the query string as queryStringParameters and a POST into an
+event with the request body as body, the same events API Gateway passes to handler. Each worker
+process serves many connections from one asyncio loop and prices on a thread pool, so concurrent
+requests share the config and quote caches and the pooled S3 and dynamoDB connections of main.py.
+
+With --workers above 1 the listening socket is opened once and shared by forked worker processes.
+SIGTERM or SIGINT drains every worker: /health answers 503 so the load balancer stops routing to it,
+no new connections are accepted, requests in flight are finished within --drain-timeout seconds
+and queued audit rows are written before the process exits.
+
+--fakes serves synthetic config tables from the in process S3 and dynamoDB stand ins of the benchmarks,
+so the server can be run and load tested locally without AWS credentials.
+
+Usage:
+    python server.py [--host 0.0.0.0] [--port 8080] [--workers 4] [--threads 32] [--drain-timeout 30]
+                     [--fakes] [--s3-latency-ms 20] [--dynamodb-latency-ms 8]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+# Requests priced at the same time by one worker process
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "32"))
+# Seconds a worker waits for the requests in flight to finish when it is asked to stop
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "30"))
+
+HEALTH_PATH = "/health"
+# Largest request body accepted, a batch of MAX_BATCH_SIZE loans is well below it
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_HEADERS = 100
+
+
+class BadRequest(Exception):
+    """
+    Raised when a request cannot be read as HTTP/1.x or turned into an event for the handler
+    """
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def request_event(method: str, target: str, body: bytes, headers: dict = None):
+    """
+    Function used to turn an HTTP request into the event API Gateway would pass to handler
+    Args:
+        method: request method
+        target: request target, the path and query string
+        body: request body
+        headers: request headers, passed on so that handler sees an Idempotency-Key header
+    Returns:
+        event: event for handler, None when the method is not served
+    Raises:
+        BadRequest: when the body is not UTF-8
+    """
+    if method == "GET":
+        query = urllib.parse.urlsplit(target).query
+        event = {'queryStringParameters': dict(urllib.parse.parse_qsl(query)) or None}
+    elif method == "POST":
+        try:
+            event = {'body': body.decode('utf-8')}
+        except UnicodeDecodeError:
+            raise BadRequest(HTTPStatus.BAD_REQUEST, "Request bodies must be UTF-8")
+    else:
+        return None
+    if headers:
+        event['headers'] = headers
+    return event
+
+
+async def read_request(reader: asyncio.StreamReader, line: bytes):
+    """
+    Function used to read the rest of a request from a connection
+    Args:
+        reader: stream of the connection
+        line: request line, already read
+    Returns:
+        request: tuple of method, target, version, headers and body
+    """
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise BadRequest(HTTPStatus.BAD_REQUEST, "Malformed request line")
+    if not version.startswith("HTTP/1."):
+        raise BadRequest(HTTPStatus.HTTP_VERSION_NOT_SUPPORTED, f"{version} is not supported")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise BadRequest(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Too many headers")
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise BadRequest(HTTPStatus.LENGTH_REQUIRED, "Send the body with a Content-Length")
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise BadRequest(HTTPStatus.BAD_REQUEST, "Malformed Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Request bodies are limited to {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+
+    return method.upper(), target, version, headers, body
+
+
+def response_bytes(status: int, headers: dict, body: bytes, keep_alive: bool):
+    """
+    Function used to write an HTTP/1.1 response
+    Args:
+        status: status code
+        headers: response headers
+        body: response body
+        keep_alive: leave the connection open for another request
+    Returns:
+        response: bytes of the status line, headers and body
+    """
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ""
+    lines = [f"HTTP/1.1 {int(status)} {reason}"]
+    lines += [f"{name}: {value}" for name, value in headers.items() if name.lower() not in ('content-length', 'connection')]
+    lines += [f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
+
+
+class PricingServer:
+    """
+    asyncio HTTP server that passes every request to a handler of (event, context) on a thread pool
+    """
+
+    def __init__(self, handler, threads: int = SERVER_THREADS, drain_timeout: float = DRAIN_TIMEOUT):
+        self.handler = handler
+        self.drain_timeout = drain_timeout
+        self.executor = ThreadPoolExecutor(max_workers = threads, thread_name_prefix = "pricing")
+        self.draining = False
+        self.in_flight = 0
+        self.served = 0
+        self._server = None
+        self._idle = set()
+        self._done = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0, sock: socket.socket = None):
+        """
+        Function used to start accepting connections
+        Args:
+            host: address to listen on
+            port: port to listen on, 0 picks a free port
+            sock: listening socket shared with other worker processes, host and port are ignored when it is given
+        Returns:
+            port: port the server is listening on
+        """
+        self._done = asyncio.Event()
+        if sock is not None:
+            self._server = await asyncio.start_server(self._connection, sock = sock)
+        else:
+            self._server = await asyncio.start_server(self._connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while not self.draining:
+                # a connection waiting for its next request is closed straight away by a drain
+                self._idle.add(writer)
+                try:
+                    line = await reader.readline()
+                finally:
+                    self._idle.discard(writer)
+                if not line:
+                    return
+                try:
+                    request = await read_request(reader, line)
+                except BadRequest as e:
+                    writer.write(response_bytes(e.status, {'Content-Type': 'text/plain'}, str(e).encode(), False))
+                    await writer.drain()
+                    return
+                method, target, version, headers, body = request
+                status, response_headers, response_body = await self._respond(method, target, body, headers)
+                connection = headers.get('connection', '').lower()
+                keep_alive = not self.draining and connection != 'close' and (version != "HTTP/1.0" or connection == 'keep-alive')
+                writer.write(response_bytes(status, response_headers, response_body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method: str, target: str, body: bytes, headers: dict = None):
+        """
+        Function used to answer one request
+        Args:
+            method: request method
+            target: request target
+            body: request body
+            headers: request headers
+        Returns:
+            status: status code
+            headers: response headers
+            body: response body
+        """
+        if urllib.parse.urlsplit(target).path == HEALTH_PATH:
+            status = HTTPStatus.SERVICE_UNAVAILABLE if self.draining else HTTPStatus.OK
+            return status, {'Content-Type': 'application/json'}, json.dumps({'status': "draining" if self.draining else "ok", 'in_flight': self.in_flight, 'served': self.served}).encode()
+
+        try:
+            event = request_event(method, target, body, headers)
+        except BadRequest as e:
+            return e.status, {'Content-Type': 'text/plain'}, str(e).encode()
+        if event is None:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'Content-Type': 'text/plain', 'Allow': 'GET, POST'}, b"Only GET and POST are served"
+
+        self.in_flight += 1
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(self.executor, self.handler, event, None)
+        except Exception as e:
+            print(f"Unhandled error pricing request: {e!r}")
+            response = {'statusCode': 500, 'body': "Internal server error"}
+        finally:
+            self.in_flight -= 1
+            self.served += 1
+            if self.draining and self.in_flight == 0:
+                self._done.set()
+
+        body = response.get('body', '')
+        headers = response.get('headers') or {'Content-Type': 'text/plain'}
+        return response.get('statusCode', 500), headers, body.encode('utf-8') if isinstance(body, str) else body
+
+    async def drain(self):
+        """
+        Function used to stop the server gracefully, new connections are refused, idle keep-alive connections are closed
+        and the requests in flight are given drain_timeout seconds to finish
+        Returns:
+            True when every request in flight finished in time
+        """
+        self.draining = True
+        self._server.close()
+        for writer in list(self._idle):
+            writer.close()
+        finished = True
+        if self.in_flight:
+            try:
+                await asyncio.wait_for(self._done.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                finished = False
+        self.executor.shutdown(wait = False)
+        return finished
+
+
+def _use_fakes(api, args):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+    from fakes import install_fakes
+
+    install_fakes(args.size, "csv", args.s3_latency_ms / 1000, args.dynamodb_latency_ms / 1000)
+
+
+async def _serve(api, sock: socket.socket, args):
+    server = PricingServer(api.handler, args.threads, args.drain_timeout)
+    port = await server.start(sock = sock)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    print(json.dumps({'server': "ready", 'pid': os.getpid(), 'port': port, 'threads': args.threads}), flush = True)
+
+    await stop.wait()
+    finished = await server.drain()
+    api.audit_sink.flush(timeout = args.drain_timeout)
+    print(json.dumps({'server': "stopped", 'pid': os.getpid(), 'served': server.served, 'drained': finished}), flush = True)
+
+
+def serve_worker(sock: socket.socket, args):
+    """
+    Function used to run one worker process, main is imported here so that every process has its own AWS clients
+    Args:
+        sock: listening socket
+        args: parsed command line arguments
+    """
+    # every thread pricing a request can hold a connection to S3 and to dynamoDB at the same time as the config fetches
+    os.environ.setdefault("AWS_MAX_POOL_CONNECTIONS", str(args.threads + int(os.environ.get("S3_FETCH_WORKERS", "8"))))
+    # a worker is never frozen between requests, buffered audit rows are written as the buffer fills and when it drains
+    os.environ.setdefault("AUDIT_FLUSH_EACH_INVOCATION", "0")
+    import main as api
+
+    if args.fakes:
+        _use_fakes(api, args)
+    asyncio.run(_serve(api, sock, args))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the pricer over HTTP from long lived worker processes")
+    parser.add_argument('--host', default="0.0.0.0", help="address to listen on")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes sharing the port")
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help="requests priced at the same time by each worker")
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT, help="seconds a worker waits for requests in flight when it is stopped")
+    parser.add_argument('--fakes', action='store_true', help="serve synthetic config tables from in process stand ins of S3 and dynamoDB")
+    parser.add_argument('--size', choices=('realistic', 'stress'), default='realistic', help="size of the synthetic config tables with --fakes")
+    parser.add_argument('--s3-latency-ms', type=float, default=0.0, help="time every S3 call takes with --fakes")
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=0.0, help="time every dynamoDB call takes with --fakes")
+    args = parser.parse_args(argv)
+
+    sock = socket.create_server((args.host, args.port), backlog = 1024)
+    if args.workers <= 1:
+        serve_worker(sock, args)
+        return
+
+    # workers are forked before main is imported, so no AWS client or thread pool is shared between processes
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target = serve_worker, args = (sock, args), name = f"pricing-worker-{i}") for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    sock.close()
+
+    def stop(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest.mock as mock
+from io import BytesIO
+import pytest
+import main
+
+# the fakes and the benchmark scripts in benchmarks/ are imported by the tests as top level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+CONFIG_TABLES = {
+    "CPPricer/parquetfiles/product_specifications.csv": (
+        'Idx,Supported,Parameters,Pricing_Methods\n'
+        'B,1,"[""product"", ""credit_risk"", ""term"", ""amount"", ""loan_id"", ""pricing_type""]","[""model"", ""market"", ""market_simple""]"\n'
+        'C,0,[],[]\n'
+    ),
+    "CPPricer/parquetfiles/finance.csv": "Idx,NIM\nB,0.05",
+    "CPPricer/parquetfiles/fundingcurve.csv": "Time(in months),B\n12,2.0\n24,2.5\n36,3.0",
+    "CPPricer/parquetfiles/sizepremia.csv": "Size(in thousands),B\n10,1.0\n100,0.5",
+    "CPPricer/parquetfiles/termpremia.csv": "Time(in months),B\n12,0.1\n36,0.3",
+    "CPPricer/parquetfiles/credit_premia.csv": "Product,DimOneValMin,DimOneValMax,DimTwoVal,Value\nB,0,24,Good,150\nB,25,60,Good,200\nB,0,60,Weak,400",
+    "CPPricer/parquetfiles/term_risk_discount.csv": "Term,Strong,Good,Satisfactory,Weak\n12,10,20,30,40\n24,15,25,35,45",
+    "CPPricer/parquetfiles/market_simple_table.csv": "DimOneValMin,DimOneValMax,DimTwoValue,Value\n0,24,2,900\n0,24,8,500\n24,60,5,700\n24,60,9,300",
+}
+
+
+@pytest.fixture
+def config_tables():
+    """
+    Config csv files of product B, keyed on their S3 key, a copy the test can edit
+    """
+    return dict(CONFIG_TABLES)
+
+
+@pytest.fixture
+def config_s3(config_tables):
+    """
+    Mock s3 client serving config_tables without ETags, so nothing it serves is cached between tests
+    """
+    mock_s3_client = mock.Mock()
+    mock_s3_client.get_object.side_effect = lambda Bucket, Key: {'Body': BytesIO(config_tables[Key].encode())}
+    return mock_s3_client
+
+
+@pytest.fixture
+def api_fakes():
+    """
+    Puts back the AWS clients, caches and config format of main when the test ends, so the test can point main at the
+    in process fakes of benchmarks/fakes.py. Returns install_fakes, called with the table size and latencies the test needs
+    """
+    from fakes import install_fakes
+
+    with mock.patch.multiple(main, s3=main.s3, dynamodb=main.dynamodb, audit_sink=main.audit_sink, config_cache=main.config_cache, quote_cache=main.quote_cache,
+                             idempotency_store=main.idempotency_store, CONFIG_FORMAT=main.CONFIG_FORMAT, _bundle_unavailable_until=main._bundle_unavailable_until):
+        yield install_fakes
@@ -0,0 +1,99 @@
+import threading
+import unittest.mock as mock
+import pytest
+from botocore.exceptions import ClientError
+from audit import AuditSink, AuditWriteError
+
+
+def payload(run_id):
+    return {'run_id': {'S': run_id}, 'price': {'S': '5.0'}}
+
+
+def test_audit_sink_sync_writes_before_returning():
+    client = mock.Mock()
+    sink = AuditSink(client, mode="sync")
+
+    sink.write(payload("1"))
+
+    client.put_item.assert_called_once_with(TableName="pricing_apirunlog", Item=payload("1"))
+    assert sink.stats()['written'] == 1
+
+
+def test_audit_sink_buffered_batches_and_retries_unprocessed_items():
+    client = mock.Mock()
+    unprocessed = {"pricing_apirunlog": [{'PutRequest': {'Item': payload("3")}}]}
+    client.batch_write_item.side_effect = [{'UnprocessedItems': unprocessed}, {'UnprocessedItems': {}}]
+    sink = AuditSink(client, mode="buffered", buffer_size=3, flush_interval=60, sleep=mock.Mock())
+
+    sink.write(payload("1"))
+    sink.write(payload("2"))
+    client.batch_write_item.assert_not_called()
+    sink.write(payload("3"))
+
+    assert client.batch_write_item.call_count == 2
+    assert len(client.batch_write_item.call_args_list[0].kwargs['RequestItems']["pricing_apirunlog"]) == 3
+    assert client.batch_write_item.call_args_list[1].kwargs['RequestItems'] == unprocessed
+    assert sink.stats() == {'mode': 'buffered', 'written': 3, 'failed': 0, 'pending': 0}
+
+
+def test_audit_sink_async_writes_in_background():
+    client = mock.Mock()
+    client.batch_write_item.return_value = {'UnprocessedItems': {}}
+    sink = AuditSink(client, mode="async")
+
+    sink.write_many([payload(str(i)) for i in range(60)])
+
+    assert sink.flush(timeout=5)
+    written = sum(len(call.kwargs['RequestItems']["pricing_apirunlog"]) for call in client.batch_write_item.call_args_list)
+    assert written == 60
+    assert sink.stats()['written'] == 60
+
+
+def test_audit_sink_sync_raises_when_rows_are_not_written():
+    client = mock.Mock()
+    client.batch_write_item.return_value = {'UnprocessedItems': {"pricing_apirunlog": [{'PutRequest': {'Item': payload("1")}}]}}
+    sink = AuditSink(client, mode="sync", max_attempts=2, sleep=mock.Mock())
+
+    with pytest.raises(AuditWriteError):
+        sink.write_many([payload("1"), payload("2")])
+    assert sink.stats()['failed'] == 1
+
+    client.put_item.side_effect = RuntimeError("throttled")
+    with pytest.raises(AuditWriteError):
+        sink.write(payload("3"))
+    assert sink.stats()['failed'] == 2
+
+
+def test_audit_sink_counts_rows_dynamodb_refuses():
+    throttled = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Rate exceeded'}}, 'BatchWriteItem')
+    client = mock.Mock()
+    client.batch_write_item.side_effect = [throttled, {'UnprocessedItems': {}}]
+    sink = AuditSink(client, mode="buffered", buffer_size=25, flush_interval=60, sleep=mock.Mock(), write_workers=1)
+
+    # the write that fills the buffer does not raise, the chunk that was refused is counted as failed and the next is written
+    with mock.patch('builtins.print'):
+        sink.write_many([payload(str(i)) for i in range(30)])
+    assert sink.stats() == {'mode': 'buffered', 'written': 5, 'failed': 25, 'pending': 0}
+
+    client.batch_write_item.side_effect = throttled
+    sink = AuditSink(client, mode="sync", sleep=mock.Mock())
+    with mock.patch('builtins.print'), pytest.raises(AuditWriteError):
+        sink.write_many([payload(str(i)) for i in range(30)])
+    assert sink.stats()['failed'] == 30
+
+
+def test_audit_sink_sends_the_chunks_of_a_batch_concurrently():
+    chunks = 4
+    barrier = threading.Barrier(chunks, timeout=5)
+    client = mock.Mock()
+
+    def batch_write_item(RequestItems):
+        # every chunk has to be in flight at the same time for the barrier to open
+        barrier.wait()
+        return {'UnprocessedItems': {}}
+
+    client.batch_write_item.side_effect = batch_write_item
+    sink = AuditSink(client, mode="sync", write_workers=chunks)
+
+    sink.write_many([payload(str(i)) for i in range(25 * chunks)])
+    assert sink.stats()['written'] == 25 * chunks
@@ -0,0 +1,112 @@
+import unittest.mock as mock
+from io import BytesIO
+import numpy as np
+from botocore.exceptions import ClientError
+from config_bundle import write_bundle, read_bundle
+from config_cache import ConfigCache
+from csv_table import parse_csv
+import main
+
+TABLES = {
+    main.PRODUCT_SPECIFICATION_KEY: 'Idx,Supported,Parameters,Pricing_Methods\nB,1,"[""product""]","[""model"", ""market""]"\nC,0,,[]\n',
+    "CPPricer/parquetfiles/finance.csv": "Idx,NIM\nB,0.05",
+    "CPPricer/parquetfiles/fundingcurve.csv": "Time(in months),B\n12,2.0\n24,2.5\n36,3.0",
+    "CPPricer/parquetfiles/sizepremia.csv": "Size(in thousands),B\n10,1.0\n100,0.5",
+    "CPPricer/parquetfiles/termpremia.csv": "Time(in months),B\n12,0.1\n36,0.3",
+    "CPPricer/parquetfiles/credit_premia.csv": "Product,DimOneValMin,DimOneValMax,DimTwoVal,Value\nB,0,24,Good,150\nB,25,60,Good,200",
+    main.MARKET_TABLE_KEY: "Term,Strong,Good,Satisfactory,Weak\n12,10,20,30,40\n24,15,25,35,45",
+    main.MARKET_SIMPLE_TABLE_KEY: "DimOneValMin,DimOneValMax,DimTwoValue,Value\n0,24,2,900\n0,24,8,500",
+}
+
+
+def make_bundle():
+    tables = {key: parse_csv(body.encode()) for key, body in TABLES.items()}
+    return write_bundle(tables, {key: '"csv"' for key in TABLES})
+
+
+def make_s3(objects):
+    mock_s3_client = mock.Mock()
+
+    def get_object(Bucket, Key, IfNoneMatch=None):
+        body, etag = objects[Key]
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        return {'Body': BytesIO(body), 'ETag': etag}
+
+    mock_s3_client.get_object.side_effect = get_object
+    return mock_s3_client
+
+
+def test_bundle_round_trip_matches_csv_tables():
+    bundle = read_bundle(make_bundle())
+
+    for key, body in TABLES.items():
+        df = parse_csv(body.encode())
+        table = bundle.table(key)
+        assert list(table) == list(df)
+        for name in df:
+            if np.asarray(df[name]).dtype == object:
+                assert table[name].tolist() == ['' if value != value else value for value in df[name].tolist()]
+            else:
+                assert table[name].dtype == df[name].dtype
+                np.testing.assert_array_equal(table[name], df[name])
+    assert bundle.sources[main.MARKET_TABLE_KEY] == '"csv"'
+
+
+def test_bundle_spilled_to_disk_is_reused_by_a_new_runtime(tmp_path):
+    s3 = make_s3({main.BUNDLE_KEY: (make_bundle(), '"b1"')})
+    ConfigCache(spill_dir=str(tmp_path)).get_versioned(s3, "bucket", main.BUNDLE_KEY, read_bundle, spill=False)
+    assert not list(tmp_path.iterdir())
+
+    first = ConfigCache(spill_dir=str(tmp_path))
+    first.get_versioned(s3, "bucket", main.BUNDLE_KEY, read_bundle, spill=True)
+
+    # a new runtime only revalidates the spilled copy and maps it from disk
+    second = ConfigCache(spill_dir=str(tmp_path))
+    bundle, etag = second.get_versioned(s3, "bucket", main.BUNDLE_KEY, read_bundle, spill=True)
+
+    assert etag == '"b1"'
+    assert s3.get_object.call_args.kwargs['IfNoneMatch'] == '"b1"'
+    assert second.stats()['revalidations'] == 1
+    assert second.stats()['misses'] == 0
+    assert bundle.table(main.MARKET_TABLE_KEY)['Term'].tolist() == [12, 24]
+
+
+def test_pricing_reads_bundle_instead_of_csv(tmp_path):
+    objects = {key: (body.encode(), '"csv"') for key, body in TABLES.items()}
+    objects[main.BUNDLE_KEY] = (make_bundle(), '"b1"')
+    s3 = make_s3(objects)
+
+    with mock.patch.object(main, 'config_cache', ConfigCache(spill_dir=str(tmp_path))), mock.patch.object(main, '_bundle_unavailable_until', 0.0):
+        bundle_price = main.pricing_calc_model(s3, 'B', 'Good', '24', '50000')
+        market_price = main.pricing_calc_market(s3, 5.1, '24')
+        supported, params, methods = main.product_specification(s3, 'B')
+        downloads = {call.kwargs['Key'] for call in s3.get_object.call_args_list if call.kwargs.get('IfNoneMatch') != '"csv"'}
+
+    # the csv files are only revalidated against the ETags the bundle was built from
+    assert downloads == {main.BUNDLE_KEY}
+    assert (supported, params, methods) == (1, ["product"], ["model", "market"])
+
+    with mock.patch.object(main, 'config_cache', ConfigCache(spill_dir=None)), mock.patch.object(main, 'CONFIG_FORMAT', 'csv'):
+        assert main.pricing_calc_model(s3, 'B', 'Good', '24', '50000') == bundle_price
+        assert main.pricing_calc_market(s3, 5.1, '24') == market_price
+
+
+def test_csv_edited_after_the_bundle_is_priced_from_the_csv(tmp_path, capsys):
+    objects = {key: (body.encode(), '"csv"') for key, body in TABLES.items()}
+    objects[main.BUNDLE_KEY] = (make_bundle(), '"b1"')
+    # the market table is edited on rbCore and the bundle is not rebuilt
+    objects[main.MARKET_TABLE_KEY] = (b"Term,Strong,Good,Satisfactory,Weak\n12,10,20,30,40\n24,15,99,35,45", '"edited"')
+    s3 = make_s3(objects)
+
+    with mock.patch.object(main, 'config_cache', ConfigCache(spill_dir=None)), mock.patch.object(main, 'CONFIG_FORMAT', 'csv'):
+        csv_price = main.pricing_calc_market(s3, 5.1, '24')
+
+    with mock.patch.object(main, 'config_cache', ConfigCache(spill_dir=str(tmp_path))), mock.patch.object(main, '_bundle_unavailable_until', 0.0):
+        assert main.pricing_calc_market(s3, 5.1, '24') == csv_price
+        _, version = main.read_tables(s3, (main.MARKET_TABLE_KEY, main.MARKET_SIMPLE_TABLE_KEY))
+        assert main.read_tables(s3, (main.MARKET_SIMPLE_TABLE_KEY,))[0][0] is main.load_bundle(s3)[0].table(main.MARKET_SIMPLE_TABLE_KEY)
+
+    assert version == ('"edited"', '"csv"')
+    warnings = [line for line in capsys.readouterr().out.splitlines() if line.startswith("Warning")]
+    assert len(warnings) == 1 and main.MARKET_TABLE_KEY in warnings[0]
@@ -0,0 +1,113 @@
+import unittest.mock as mock
+from io import BytesIO
+from botocore.exceptions import ClientError
+from config_cache import ConfigCache
+
+
+def make_s3(objects):
+    """
+    Function used to create a mock s3 client that honours If-None-Match against the ETag of each object
+    """
+    mock_s3_client = mock.Mock()
+
+    def get_object(Bucket, Key, IfNoneMatch=None):
+        body, etag = objects[Key]
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        return {'Body': BytesIO(body), 'ETag': etag}
+
+    mock_s3_client.get_object.side_effect = get_object
+    return mock_s3_client
+
+
+def test_config_cache_hit_within_ttl():
+    s3 = make_s3({"finance.csv": (b"Idx,NIM\nA,0.05", '"v1"')})
+    cache = ConfigCache(ttl=60)
+    parse = mock.Mock(side_effect=lambda body: body.decode())
+
+    assert cache.get(s3, "bucket", "finance.csv", parse) == "Idx,NIM\nA,0.05"
+    assert cache.get(s3, "bucket", "finance.csv", parse) == "Idx,NIM\nA,0.05"
+
+    assert s3.get_object.call_count == 1
+    assert parse.call_count == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.version("bucket", "finance.csv") == '"v1"'
+
+
+def test_config_cache_revalidates_and_refreshes_after_ttl():
+    clock = mock.Mock(return_value=0)
+    objects = {"finance.csv": (b"v1", '"v1"')}
+    s3 = make_s3(objects)
+    cache = ConfigCache(ttl=60, clock=clock)
+    parse = lambda body: body.decode()
+
+    cache.get(s3, "bucket", "finance.csv", parse)
+
+    # unchanged object, conditional GET answers 304 and the cached value is kept
+    clock.return_value = 61
+    assert cache.get(s3, "bucket", "finance.csv", parse) == "v1"
+    assert s3.get_object.call_args.kwargs['IfNoneMatch'] == '"v1"'
+    assert cache.stats()['revalidations'] == 1
+
+    # business edit on rbCore shows up once the ttl has passed
+    objects["finance.csv"] = (b"v2", '"v2"')
+    assert cache.get(s3, "bucket", "finance.csv", parse) == "v1"
+    clock.return_value = 200
+    assert cache.get(s3, "bucket", "finance.csv", parse) == "v2"
+    assert cache.stats()['refreshes'] == 1
+    assert cache.version("bucket", "finance.csv") == '"v2"'
+
+
+def test_config_cache_does_not_cache_without_etag():
+    mock_s3_client = mock.Mock()
+    mock_s3_client.get_object.side_effect = lambda Bucket, Key: {'Body': BytesIO(b"data")}
+    cache = ConfigCache(ttl=60)
+
+    cache.get(mock_s3_client, "bucket", "finance.csv", bytes)
+    cache.get(mock_s3_client, "bucket", "finance.csv", bytes)
+
+    assert mock_s3_client.get_object.call_count == 2
+    assert cache.stats()['entries'] == 0
+
+
+def test_config_cache_derived_rebuilds_on_new_version():
+    cache = ConfigCache(ttl=60)
+    build = mock.Mock(side_effect=lambda: object())
+
+    first = cache.derived("model", ('"v1"', '"v1"'), build)
+    assert cache.derived("model", ('"v1"', '"v1"'), build) is first
+    assert cache.derived("model", ('"v1"', '"v2"'), build) is not first
+    # tables without an ETag are never cached
+    cache.derived("model", ('"v1"', None), build)
+    cache.derived("model", ('"v1"', None), build)
+
+    assert build.call_count == 4
+
+
+def test_config_cache_derived_from_table_fetched_with_etag():
+    s3 = make_s3({"finance.csv": (b"v1", '"v1"')})
+    cache = ConfigCache(ttl=60)
+    build = mock.Mock(side_effect=lambda: object())
+
+    _, etag = cache.get_versioned(s3, "bucket", "finance.csv", lambda body: body.decode())
+    first = cache.derived("finance", (etag,), build)
+
+    assert cache.derived("finance", (etag,), build) is first
+    assert build.call_count == 1
+
+
+def test_config_cache_expire_revalidates_before_ttl():
+    objects = {"finance.csv": (b"v1", '"v1"')}
+    s3 = make_s3(objects)
+    cache = ConfigCache(ttl=60, clock=mock.Mock(return_value=0))
+    parse = lambda body: body.decode()
+
+    cache.get(s3, "bucket", "finance.csv", parse)
+    cache.expire()
+    assert cache.get(s3, "bucket", "finance.csv", parse) == "v1"
+    assert cache.stats()['revalidations'] == 1
+
+    objects["finance.csv"] = (b"v2", '"v2"')
+    cache.expire()
+    assert cache.get(s3, "bucket", "finance.csv", parse) == "v2"
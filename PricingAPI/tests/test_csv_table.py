@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+import tracemalloc
+from io import StringIO
+import numpy as np
+import pandas as pd
+from csv_table import LazyCsvColumns, LazyCsvTable, array_nbytes, parse_csv
+
+CSV_FILES = [
+    "Idx,NIM\nA,0.05\nB,0.1",
+    "Time(in months),A,B\n12,2,2.5\n24,3,\n36,4,3.5",
+    "Product,DimOneValMin,DimOneValMax,DimTwoVal,Value\nproduct1, 10, 50,Good, 0.025\nproduct1,51,100,NA,1e2",
+    'Idx,Supported,Parameters,Pricing_Methods\nB,1,"[""product"", ""term""]","[""model""]"\nC,0,None,[]\n\n',
+    "Term,Strong,Good\n12,10,20\n24,15,25",
+]
+
+
+def test_parse_csv_matches_pandas():
+    for body in CSV_FILES:
+        df = pd.read_csv(StringIO(body))
+        table = parse_csv(body.encode())
+
+        assert list(table) == list(df)
+        for name in df:
+            assert table[name].dtype == df[name].to_numpy().dtype, (body, name)
+            expected = df[name].to_numpy()
+            if expected.dtype == object:
+                assert [value if value == value else None for value in table[name].tolist()] == [value if value == value else None for value in expected.tolist()]
+            else:
+                np.testing.assert_array_equal(table[name], expected)
+
+
+def test_main_does_not_import_pandas():
+    code = "import sys, main; sys.exit('pandas' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    assert result.returncode == 0
+
+
+def test_lazy_csv_table_matches_parse_csv():
+    for body in CSV_FILES + [CSV_FILES[2].replace("\n", "\r\n") + "\r\n\r\nproduct2,1,2,Good,3"]:
+        table = parse_csv(body.encode())
+        lazy = LazyCsvTable(body.encode())
+
+        assert list(lazy) == list(table)
+        values = lambda column: [value if value == value else None for value in column.tolist()]
+        for name in reversed(list(table)):
+            assert lazy[name].dtype == table[name].dtype
+            assert values(lazy[name]) == values(table[name])
+        key = list(table)[0]
+        for value in set(table[key].tolist()):
+            rows = lazy.rows(key, value)
+            selected = table[key] == value
+            assert {name: values(rows[name]) for name in rows} == {name: values(table[name][selected]) for name in table}
+
+
+def test_lazy_csv_columns_only_convert_columns_that_are_read():
+    for body in CSV_FILES:
+        table = parse_csv(body.encode())
+        lazy = LazyCsvColumns(body.encode())
+        assert list(lazy) == list(table)
+        values = lambda column: [value if value == value else None for value in column.tolist()]
+        for name in reversed(list(table)):
+            assert lazy[name].dtype == table[name].dtype
+            assert values(lazy[name]) == values(table[name])
+
+    lazy = LazyCsvColumns(CSV_FILES[1].encode())
+    assert "A" in lazy and "C" not in lazy
+    assert lazy["A"].tolist() == [2, 3, 4]
+    assert list(lazy._converted) == ["A"]
+    lazy.convert(["B", "Time(in months)", "A"])
+    assert list(lazy._converted) == ["A", "B", "Time(in months)"]
+
+
+def test_lazy_csv_columns_hold_the_file_and_the_products_read():
+    rng = np.random.default_rng(0)
+    # a curve with a column per product and distinct values, as the funding curve of a large catalogue
+    body = ("Time(in months)," + ",".join(f"P{i}" for i in range(400)) + "\n" + "\n".join(
+        f"{term}," + ",".join(f"{value:.6f}" for value in rng.uniform(0, 5, 400)) for term in range(600))).encode()
+    parsed = sum(array_nbytes(column) for column in parse_csv(body).values())
+
+    lazy = LazyCsvColumns(body)
+    assert lazy.nbytes() < 1.2 * parsed
+    lazy.convert(["Time(in months)"] + [f"P{i}" for i in range(5)])
+    assert lazy.nbytes() - sys.getsizeof(body) == 6 * 600 * 8
+
+
+def test_lazy_csv_table_reports_the_memory_it_holds():
+    body = "Product,DimOneValMin,DimOneValMax,DimTwoVal,Value\n" + "".join(f"P{i % 50},{i},{i + 10},Good,{i * 0.5}\n" for i in range(20000))
+
+    tracemalloc.start()
+    try:
+        lazy = LazyCsvTable(body.encode())
+        held = [(tracemalloc.get_traced_memory()[0], lazy.nbytes())]
+        lazy.convert(["Product", "Value"])
+        held.append((tracemalloc.get_traced_memory()[0], lazy.nbytes()))
+        lazy.convert(lazy.header)
+        held.append((tracemalloc.get_traced_memory()[0], lazy.nbytes()))
+    finally:
+        tracemalloc.stop()
+
+    # the text of a column is dropped once it is converted, and the figure follows what the table allocated
+    assert held[0][1] > held[1][1] > held[2][1]
+    assert lazy._raw == {}
+    for allocated, reported in held:
+        assert abs(reported - allocated) < 0.1 * allocated
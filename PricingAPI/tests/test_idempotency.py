@@ -0,0 +1,170 @@
+import json
+import threading
+import unittest.mock as mock
+import pytest
+from botocore.exceptions import EndpointConnectionError
+import main
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, replay_key
+
+
+def response(run_id):
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'output': 5.0, 'meta_data': {'run_id': run_id}})}
+
+
+def test_replay_key_prefers_the_client_key():
+    params = {"product": "B", "term": "24", "loan_id": "l1"}
+
+    key, fingerprint = replay_key({}, params)
+    assert key == "loan#l1#" + fingerprint
+    assert replay_key({}, dict(reversed(list(params.items())))) == (key, fingerprint)
+    assert replay_key({}, dict(params, term="36"))[0] != key
+
+    assert replay_key({'headers': {'Idempotency-Key': "abc"}}, params) == ("key#abc", fingerprint)
+    assert replay_key({}, dict(params, idempotency_key="abc")) == ("key#abc", fingerprint)
+    assert replay_key({}, {"product": "B"}) is None
+
+
+def test_idempotency_store_replays_from_memory_then_table():
+    from fakes import FakeDynamoDB
+    client = FakeDynamoDB()
+    now = [1000.0]
+    store = IdempotencyStore(client, window=60, clock=lambda: now[0])
+
+    assert store.claim("key#a", "f1") is None
+    assert store.store("key#a", "f1", response("r1")) == response("r1")
+
+    replayed = store.claim("key#a", "f1")
+    assert replayed['body'] == response("r1")['body'] and replayed['headers']['Idempotent-Replayed'] == "true"
+    with pytest.raises(IdempotencyConflict):
+        store.claim("key#a", "f2")
+
+    # another container finds the response in the table, and a request it priced at the same time gets the first response
+    other = IdempotencyStore(client, window=60, clock=lambda: now[0])
+    assert other.store("key#a", "f1", response("r2"))['body'] == response("r1")['body']
+    other.clear()
+    assert other.claim("key#a", "f1")['body'] == response("r1")['body']
+    assert (store.stats()['hits'], other.stats()['table_hits'], store.stats()['conflicts']) == (1, 1, 1)
+
+    # once the window has passed the request is priced again
+    now[0] += 61
+    assert store.claim("key#a", "f1") is None
+    assert store.store("key#a", "f1", response("r3")) == response("r3")
+    assert other.claim("key#a", "f1")['body'] == response("r3")['body']
+
+
+def test_handler_prices_requests_when_the_table_cannot_be_reached(api_fakes):
+    from fakes import synthetic_loans
+
+    s3, products = api_fakes()
+    unreachable = mock.Mock()
+    for call in (unreachable.put_item, unreachable.get_item, unreachable.delete_item):
+        call.side_effect = EndpointConnectionError(endpoint_url="https://dynamodb.eu-west-1.amazonaws.com")
+    with mock.patch('builtins.print'):
+        main.idempotency_store = IdempotencyStore(unreachable, window=60)
+        loan = synthetic_loans(products, 1)[0]
+
+        first = main.handler({'queryStringParameters': loan}, None)
+        assert first['statusCode'] == 200
+        # the retry is replayed from memory, and a container without the response prices it instead of answering 409
+        assert main.handler({'queryStringParameters': dict(loan)}, None)['body'] == first['body']
+        assert IdempotencyStore(unreachable, window=60).claim(*replay_key({}, loan)) is None
+        # a request that is not priced leaves no claim behind
+        unsupported = dict(loan, product="Z", loan_id="l2")
+        for _ in range(2):
+            assert main.handler({'queryStringParameters': unsupported}, None)['statusCode'] == 400
+        assert main.idempotency_store.stats()['in_progress'] == 0
+
+
+def test_idempotency_store_claims_a_key_before_it_is_priced():
+    from fakes import FakeDynamoDB
+    client = FakeDynamoDB()
+    now = [1000.0]
+    store = IdempotencyStore(client, window=60, clock=lambda: now[0], claim_timeout=30)
+    other = IdempotencyStore(client, window=60, clock=lambda: now[0], claim_timeout=30)
+
+    # a retry in the same container or in another one is refused while the first request holds the claim
+    assert store.claim("key#a", "f1") is None
+    with pytest.raises(IdempotencyInProgress):
+        store.claim("key#a", "f1")
+    with pytest.raises(IdempotencyInProgress):
+        other.claim("key#a", "f1")
+    with pytest.raises(IdempotencyConflict):
+        other.claim("key#a", "f2")
+
+    # and answered with the response once it is stored
+    assert store.store("key#a", "f1", response("r1")) == response("r1")
+    assert other.claim("key#a", "f1")['body'] == response("r1")['body']
+    assert (store.stats()['in_progress'], other.stats()['in_progress']) == (1, 1)
+
+    # a released claim is taken by the next retry, and so is a claim left by a container that stopped once it expires
+    assert store.claim("key#b", "f1") is None
+    store.release("key#b")
+    assert other.claim("key#b", "f1") is None
+    now[0] += 31
+    assert store.claim("key#b", "f1") is None
+    assert store.store("key#b", "f1", response("r2")) == response("r2")
+    assert other.store("key#b", "f1", response("r3"))['body'] == response("r2")['body']
+
+
+def test_handler_prices_concurrent_retries_once(api_fakes):
+    from fakes import synthetic_loans
+
+    s3, products = api_fakes(s3_latency=0.02)
+    with mock.patch('builtins.print'):
+        main.idempotency_store = IdempotencyStore(main.dynamodb, window=60)
+        loan = synthetic_loans(products, 1)[0]
+
+        start, responses = threading.Barrier(2), []
+        def retry():
+            start.wait()
+            responses.append(main.handler({'queryStringParameters': dict(loan)}, None))
+        threads = [threading.Thread(target=retry) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        priced = [response for response in responses if response['statusCode'] == 200 and 'Idempotent-Replayed' not in response['headers']]
+        assert len(priced) == 1
+        for response in responses:
+            assert response is priced[0] or response['statusCode'] == 409 or response['body'] == priced[0]['body']
+        audit_rows = [item for (table, _), item in main.dynamodb.items.items() if table == "pricing_apirunlog"]
+        assert len(audit_rows) == 1
+
+        # once the response is stored the retry is replayed
+        assert main.handler({'queryStringParameters': dict(loan)}, None)['body'] == priced[0]['body']
+
+        # a request that is not answered with a price gives up its claim, so its retry is priced again
+        unsupported, failing = dict(loan, product="Z", loan_id="l2"), dict(loan, term="x", loan_id="l3")
+        assert main.handler({'queryStringParameters': unsupported}, None)['statusCode'] == 400
+        assert main.handler({'queryStringParameters': unsupported}, None)['statusCode'] == 400
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                main.handler({'queryStringParameters': failing}, None)
+        assert main.idempotency_store.stats()['in_progress'] == sum(response['statusCode'] == 409 for response in responses)
+
+
+def test_handler_replays_retries_without_pricing_or_audit(api_fakes):
+    from fakes import synthetic_loans
+
+    s3, products = api_fakes()
+    with mock.patch('builtins.print'):
+        main.idempotency_store = IdempotencyStore(main.dynamodb, window=60)
+        loan = synthetic_loans(products, 1)[0]
+
+        first = main.handler({'queryStringParameters': loan}, None)
+        s3_calls, dynamodb_calls = s3.calls, main.dynamodb.calls
+        retry = main.handler({'queryStringParameters': dict(loan)}, None)
+        assert retry['statusCode'] == 200 and retry['body'] == first['body'] and retry['headers']['Idempotent-Replayed'] == "true"
+        assert (s3.calls, main.dynamodb.calls) == (s3_calls, dynamodb_calls)
+
+        # a retry that reaches a container without the response in memory reads it from the table
+        main.idempotency_store.clear()
+        assert main.handler({'queryStringParameters': loan}, None)['body'] == first['body']
+        audit_rows = [item for (table, _), item in main.dynamodb.items.items() if table == "pricing_apirunlog"]
+        assert len(audit_rows) == 1 and audit_rows[0]['run_id']['S'] == json.loads(first['body'])['meta_data']['run_id']
+
+        # other params for the same loan are priced, a client key reused with other params is refused
+        assert 'Idempotent-Replayed' not in main.handler({'queryStringParameters': dict(loan, term="12")}, None)['headers']
+        main.handler({'queryStringParameters': loan, 'headers': {'Idempotency-Key': "k1"}}, None)
+        assert main.handler({'queryStringParameters': dict(loan, term="12"), 'headers': {'Idempotency-Key': "k1"}}, None)['statusCode'] == 422
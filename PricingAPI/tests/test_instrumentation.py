@@ -0,0 +1,47 @@
+import json
+import unittest.mock as mock
+import main
+from audit import AuditSink
+from instrumentation import Spans, metrics_record, profile_call
+
+
+def test_metrics_record_is_embedded_metric_format():
+    spans = Spans()
+    spans.add("pricing", 1.5)
+    spans.add("pricing", 1.0)
+    spans.dimensions['pricing_type'] = "model"
+
+    record = metrics_record(spans, {'statusCode': 200}, namespace = "Test", timestamp = 1700000000)
+
+    directive = record['_aws']['CloudWatchMetrics'][0]
+    assert record['_aws']['Timestamp'] == 1700000000000
+    assert directive['Namespace'] == "Test"
+    assert directive['Dimensions'] == [["pricing_type"]]
+    assert {metric['Name'] for metric in directive['Metrics']} == {"pricing_ms", "total_ms"}
+    assert record['pricing_ms'] == 2.5
+    assert record['pricing_type'] == "model"
+    assert record['statusCode'] == 200
+
+
+def test_profile_call_reports_the_profiled_function():
+    result, report = profile_call(sorted, [3, 1, 2])
+
+    assert result == [1, 2, 3]
+    assert "function calls" in report
+
+
+def test_handler_logs_stage_spans(capsys, config_s3):
+    loan = {"product": "B", "credit_risk": "Good", "term": "24", "amount": "50000", "loan_id": "l1", "pricing_type": "model", "user_name": "u", "source_name": "s"}
+
+    with mock.patch('main.s3', config_s3), mock.patch('main.audit_sink', AuditSink(mock.Mock(), mode="sync")):
+        response = main.handler({'queryStringParameters': loan, 'profile': True}, None)
+
+    spans = json.loads(response['body'])['meta_data']['spans_ms']
+    assert {"config_fetch", "product_specification", "parse_request", "pricing", "audit_write", "total"} <= set(spans)
+
+    lines = capsys.readouterr().out.splitlines()
+    record = json.loads(lines[-1])
+    assert record['pricing_type'] == "model"
+    assert record['statusCode'] == 200
+    assert "serialization_ms" in record
+    assert any("function calls" in line for line in lines)
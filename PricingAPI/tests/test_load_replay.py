@@ -0,0 +1,31 @@
+import unittest.mock as mock
+
+
+def test_load_replay_reports_by_pricing_type_and_product(api_fakes):
+    import load_replay
+    from fakes import synthetic_loans
+
+    _, products = api_fakes(s3_latency = 0.001, dynamodb_latency = 0.001)
+    events = [{'queryStringParameters': loan} for loan in synthetic_loans(products[:2], 30)]
+    events.append({'queryStringParameters': dict(events[0]['queryStringParameters'], product = "unknown")})
+    stream = load_replay.event_stream(events)
+
+    with mock.patch('builtins.print'):
+        samples, seconds = load_replay.replay(load_replay.inprocess_invoke, stream, len(events), concurrency = 4, rate = 500)
+    result = load_replay.report(samples, seconds)
+
+    assert result['overall']['requests'] == len(events)
+    assert result['overall']['status_codes'] == {'200': 30, '400': 1}
+    assert set(result['by_pricing_type']) == {"model", "market", "market_simple"}
+    assert result['by_product']['unknown']['error_rate'] == 1.0
+    assert result['overall']['p50_ms'] <= result['overall']['p95_ms'] <= result['overall']['p99_ms']
+
+
+def test_event_stream_draws_pricing_types_from_the_mix():
+    import load_replay
+    events = [{'queryStringParameters': {'pricing_type': pricing_type, 'product': "B"}} for pricing_type in ("model", "market")]
+
+    stream = load_replay.event_stream(events, load_replay.parse_mix("model=3,market=1"))
+    drawn = [next(stream)['queryStringParameters']['pricing_type'] for _ in range(2000)]
+
+    assert 0.7 < drawn.count("model") / len(drawn) < 0.8
@@ -1,6 +1,7 @@
 import unittest.mock as mock
 from io import BytesIO
 import json
+import pytest
 from main import (
     create_dataframe,
     product_specification,
@@ -11,6 +12,7 @@ from main import (
     pricing_calc_market,
     pricing_calc_market_simple
 )
+from pricing_tables import TableLookupError
 
 # Test create_dataframe function
 def test_create_dataframe():
@@ -225,3 +227,240 @@ def test_pricing_calc_market_simple(mock_boto3_client):
     expected_result = 6
 
     assert result == expected_result
+
+
+def test_pricing_calc_market_batch_matches_single_loan(config_s3):
+    import numpy as np
+    from main import pricing_calc_market_batch
+    s3 = config_s3
+    credit_risk = np.array([1.0, 2.5, 5.1, 7.5, 9.9, 5.0])
+    term = np.array([12, 24, 12, 24, 12, 18])
+
+    prices, errors = pricing_calc_market_batch(s3, credit_risk, term)
+
+    for i in range(5):
+        assert errors[i] is None
+        assert prices[i] == pricing_calc_market(s3, credit_risk[i].item(), str(term[i]))
+    assert errors[5] is not None
+
+
+def test_pricing_calc_market_simple_batch_matches_single_loan(config_s3):
+    import numpy as np
+    from main import pricing_calc_market_simple_batch
+    s3 = config_s3
+    credit_risk = np.array([1.0, 7.9, 1.5, 7.0, 4.0])
+    term = np.array([12, 12, 30, 30, 30])
+
+    prices, errors = pricing_calc_market_simple_batch(s3, credit_risk, term)
+
+    for i in range(4):
+        assert errors[i] is None
+        assert prices[i] == pricing_calc_market_simple(s3, credit_risk[i].item(), str(term[i]))
+    # the single loan function has no row to read for this loan either
+    assert errors[4] is not None
+    with pytest.raises(TableLookupError, match="No market price for term 30 and credit risk 4.0"):
+        pricing_calc_market_simple(s3, 4.0, '30')
+    with pytest.raises(TableLookupError, match="No market price for term 61, the table has terms 1 to 60"):
+        pricing_calc_market_simple(s3, 4.0, '61')
+
+
+def test_handler_batch(config_s3):
+    import main
+    from audit import AuditSink
+    mock_dynamodb = mock.Mock()
+    mock_dynamodb.batch_write_item.return_value = {'UnprocessedItems': {}}
+    loan = {"product": "B", "credit_risk": "Good", "term": "24", "amount": "50000", "loan_id": "l1", "pricing_type": "model", "user_name": "u", "source_name": "s"}
+    items = [
+        loan,
+        dict(loan, pricing_type="market", credit_risk="5.1"),
+        dict(loan, pricing_type="market_simple", credit_risk=7.9, term=12),
+        dict(loan, credit_risk="Excellent"),
+        dict(loan, product="C"),
+        {key: value for key, value in loan.items() if key != "term"},
+        dict(loan, loan_to_value="30", credit_risk="Weak"),
+    ]
+
+    with mock.patch('main.s3', config_s3), mock.patch('main.audit_sink', AuditSink(mock_dynamodb, mode="sync")):
+        response = main.handler({'body': json.dumps(items)}, None)
+        body = json.loads(response['body'])
+        statuses = [result['statusCode'] for result in body['output']]
+
+        assert statuses == [200, 200, 200, 400, 400, 400, 200]
+        assert body['output'][0]['output'] == pricing_calc_model(main.s3, 'B', 'Good', '24', '50000')
+        assert body['output'][6]['output'] == pricing_calc_model(main.s3, 'B', 'Weak', '24', '50000', loan_to_value='30')
+        assert body['output'][1]['output'] == pricing_calc_market(main.s3, 5.1, '24')
+        assert body['meta_data']['priced'] == 4
+    written = mock_dynamodb.batch_write_item.call_args.kwargs['RequestItems']['pricing_apirunlog']
+    assert len(written) == 4
+
+
+def test_handler_writes_buffered_audit_rows_before_returning(config_s3):
+    import main
+    from audit import AuditSink
+    from botocore.exceptions import ClientError
+    mock_dynamodb = mock.Mock()
+    mock_dynamodb.batch_write_item.return_value = {'UnprocessedItems': {}}
+    loan = {"product": "B", "credit_risk": "Good", "term": "24", "amount": "50000", "loan_id": "l1", "pricing_type": "model", "user_name": "u", "source_name": "s"}
+
+    with mock.patch('main.s3', config_s3):
+        for mode in ("buffered", "async"):
+            sink = AuditSink(mock_dynamodb, mode=mode, flush_interval=60)
+            with mock.patch('main.audit_sink', sink):
+                assert main.handler({'queryStringParameters': loan}, None)['statusCode'] == 200
+            assert sink.stats()['pending'] == 0 and sink.stats()['written'] == 1
+
+        # a run that cannot be recorded is not returned as priced, for a single loan or a batch
+        mock_dynamodb.put_item.side_effect = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+        mock_dynamodb.batch_write_item.side_effect = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'BatchWriteItem')
+        with mock.patch('main.audit_sink', AuditSink(mock_dynamodb, mode="sync")), mock.patch('builtins.print'):
+            assert main.handler({'queryStringParameters': loan}, None)['statusCode'] == 503
+            assert main.handler({'body': json.dumps([loan, loan])}, None) == {'statusCode': 503, "body": "The pricing run could not be recorded, please try again"}
+
+
+def test_read_tables_fetches_concurrently(config_tables):
+    import threading
+    from main import read_tables, MODEL_TABLE_KEYS
+    barrier = threading.Barrier(len(MODEL_TABLE_KEYS), timeout=5)
+    mock_s3_client = mock.Mock()
+
+    def get_object(Bucket, Key):
+        # every fetch has to be in flight at the same time for the barrier to open
+        barrier.wait()
+        return {'Body': BytesIO(config_tables[Key].encode())}
+
+    mock_s3_client.get_object.side_effect = get_object
+    timings = {}
+
+    with mock.patch('main.CONFIG_FORMAT', 'csv'):
+        tables, version = read_tables(mock_s3_client, MODEL_TABLE_KEYS, timings)
+
+    assert len(tables) == len(MODEL_TABLE_KEYS)
+    assert set(timings) == set(MODEL_TABLE_KEYS)
+
+
+def test_read_tables_serves_fresh_tables_inline(api_fakes):
+    import main
+
+    s3, products = api_fakes()
+    tables, version = main.read_tables(s3, main.MODEL_TABLE_KEYS)
+    calls = s3.calls
+
+    # fresh tables are neither fetched nor handed to the fetch pool
+    with mock.patch('main._fetch_pool') as fetch_pool:
+        timings = {}
+        assert main.read_tables(s3, main.MODEL_TABLE_KEYS, timings) == (tables, version)
+        fetch_pool.submit.assert_not_called()
+        assert s3.calls == calls and set(timings) == set(main.MODEL_TABLE_KEYS)
+
+    # once they are stale they are revalidated through the pool again
+    main.config_cache.expire()
+    assert main.read_tables(s3, main.MODEL_TABLE_KEYS) == (tables, version)
+    assert s3.calls == calls + len(main.MODEL_TABLE_KEYS)
+
+
+def test_read_tables_surfaces_failed_table(config_tables):
+    from main import read_tables, MODEL_TABLE_KEYS
+    from config_cache import ConfigLoadError
+    tables = config_tables
+    del tables["CPPricer/parquetfiles/sizepremia.csv"]
+    mock_s3_client = mock.Mock()
+    mock_s3_client.get_object.side_effect = lambda Bucket, Key: {'Body': BytesIO(tables[Key].encode())}
+
+    with pytest.raises(ConfigLoadError, match="sizepremia"):
+        read_tables(mock_s3_client, MODEL_TABLE_KEYS)
+
+
+def test_handler_single_loan_dispatch(config_s3):
+    import main
+    from audit import AuditSink
+    mock_dynamodb = mock.Mock()
+    loan = {"product": "B", "credit_risk": "Good", "term": "24", "amount": "50000", "loan_id": "l1", "pricing_type": "model", "user_name": "u", "source_name": "s"}
+
+    with mock.patch('main.s3', config_s3), mock.patch('main.audit_sink', AuditSink(mock_dynamodb, mode="sync")):
+        # a model invocation with a de_run_id but no loan_to_value
+        response = main.handler({'queryStringParameters': dict(loan, de_run_id="d1")}, None)
+        body = json.loads(response['body'])
+        assert body['output'] == pricing_calc_model(main.s3, 'B', 'Good', '24', '50000')
+        assert body['input'] == [dict({key: loan[key] for key in ("product", "credit_risk", "amount", "term", "loan_id")}, de_run_id="d1")]
+        payload = mock_dynamodb.put_item.call_args.kwargs['Item']
+        assert payload['de_run_id'] == {'S': '"d1"'}
+        assert payload['loan_to_value'] == {'S': 'None'}
+        assert payload['product'] == {'S': '"B"'}
+
+        response = main.handler({'queryStringParameters': dict(loan, pricing_type="market", credit_risk="5.1", de_run_id="d2", loan_to_value="30")}, None)
+        body = json.loads(response['body'])
+        assert body['output'] == pricing_calc_market(main.s3, 5.1, '24')
+        assert "de_run_id" not in body['input'][0] and "loan_to_value" not in body['input'][0]
+        payload = mock_dynamodb.put_item.call_args.kwargs['Item']
+        assert payload['de_run_id'] == {'S': '"d2"'}
+        assert payload['loan_to_value'] == {'S': 'None'}
+
+        assert main.handler({'queryStringParameters': dict(loan, pricing_type="market_simple", credit_risk="Good")}, None)['statusCode'] == 400
+        assert main.handler({'queryStringParameters': dict(loan, credit_risk="Excellent")}, None)['statusCode'] == 400
+        assert main.handler({'queryStringParameters': {key: value for key, value in loan.items() if key != "amount"}}, None)['statusCode'] == 400
+    assert mock_dynamodb.put_item.call_count == 2
+
+
+def test_handler_compare(config_s3):
+    import main
+    from audit import AuditSink
+    mock_dynamodb = mock.Mock()
+    loan = {"product": "B", "credit_risk": "8.0", "term": "24", "amount": "50000", "loan_id": "l1", "pricing_type": "compare", "user_name": "u", "source_name": "s"}
+
+    with mock.patch('main.s3', config_s3), mock.patch('main.audit_sink', AuditSink(mock_dynamodb, mode="sync")):
+        # the model prices the credit_grade passed alongside a numeric credit risk
+        body = json.loads(main.handler({'queryStringParameters': dict(loan, credit_grade="Good")}, None)['body'])
+        assert body['output'] == {
+            "model": pricing_calc_model(main.s3, 'B', 'Good', '24', '50000'),
+            "market": pricing_calc_market(main.s3, 8.0, '24'),
+            "market_simple": pricing_calc_market_simple(main.s3, 8.0, '24'),
+        }
+        assert "errors" not in body
+        assert body['input'][0]['credit_grade'] == "Good"
+        assert json.loads(mock_dynamodb.put_item.call_args.kwargs['Item']['pricing_type']['S']) == "compare"
+
+        # without one it prices the grade the numeric credit risk buckets into, and records that grade
+        request = main.PricingRequest(dict(loan, credit_risk="5.1"))
+        assert main._compare_request(request, main.PRICING_METHODS["model"]).credit_risk == "Good"
+        assert main._compare_request(request, main.PRICING_METHODS["market"]) is request
+        body = json.loads(main.handler({'queryStringParameters': dict(loan, credit_risk="5.1")}, None)['body'])
+        assert body['output']['model'] == pricing_calc_model(main.s3, 'B', 'Good', '24', '50000')
+        assert body['input'][0]['credit_grade'] == "Good"
+        assert json.loads(mock_dynamodb.put_item.call_args.kwargs['Item']['credit_grade']['S']) == "Good"
+
+        # a grade can only be priced by the model, the market methods report why
+        body = json.loads(main.handler({'queryStringParameters': dict(loan, credit_risk="Good")}, None)['body'])
+        assert list(body['output']) == ["model"]
+        assert set(body['errors']) == {"market", "market_simple"}
+
+        assert "credit_grade" not in body['input'][0]
+
+        assert main.handler({'queryStringParameters': dict(loan, credit_risk="Excellent")}, None)['statusCode'] == 400
+    assert mock_dynamodb.put_item.call_count == 3
+
+
+def test_warmup_event_preloads_without_audit(api_fakes):
+    import main
+
+    s3, products = api_fakes()
+    scheduled = {"source": "aws.events", "detail-type": "Scheduled Event", "detail": {}}
+    assert main.is_warmup_event(scheduled) and main.is_warmup_event({"warmup": True})
+    assert not main.is_warmup_event({'queryStringParameters': {"warmup": True}})
+
+    response = main.handler(scheduled, None)
+    report = json.loads(response['body'])
+    assert response['statusCode'] == 200 and report['ready'] and report['products'] == len(products)
+    assert set(report['parse_ms']) == set(main.CONFIG_TABLE_KEYS)
+    assert set(report['config_memory']['products']) == set(products)
+    assert set(report['config_memory']['tables']) == set(main.CONFIG_TABLE_KEYS)
+
+    # a second warm-up revalidates every table and parses none of them
+    report = json.loads(main.handler({"warmup": True}, None)['body'])
+    assert report['parse_ms'] == {} and s3.not_modified == len(main.CONFIG_TABLE_KEYS)
+    assert main.dynamodb.calls == 0
+
+    # the first customer request finds every table and the compiled model ready
+    calls = s3.calls
+    loan = {"product": products[0], "credit_risk": "Good", "term": "12", "amount": "50000", "loan_id": "l1", "pricing_type": "model", "user_name": "u", "source_name": "s"}
+    assert main.handler({'queryStringParameters': loan}, None)['statusCode'] == 200
+    assert s3.calls == calls and main.dynamodb.calls == 1
@@ -0,0 +1,16 @@
+import json
+
+
+def test_pricing_bench_reports_cold_and_warm_runs(tmp_path, api_fakes):
+    import pricing_bench
+    output = tmp_path / "bench.json"
+
+    # the benchmark points main at its fakes, they are put back when the test ends
+    pricing_bench.main(["--repeat", "3", "--cold-repeat", "2", "--format", "bundle", "--filter", "handler_market", "--output", str(output)])
+
+    report = json.loads(output.read_text())
+    assert [(result['name'], result['mode']) for result in report['results']] == [
+        ("handler_market", "cold"), ("handler_market", "warm"), ("handler_market_simple", "cold"), ("handler_market_simple", "warm"),
+    ]
+    assert all(result['calls'] > 0 and result['median_us'] > 0 for result in report['results'])
+    assert pricing_bench.compare(report, report)[0].endswith("x1.00")
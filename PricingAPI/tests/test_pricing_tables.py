@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+import pytest
+from csv_table import LazyCsvColumns, LazyCsvTable, parse_csv
+from pricing_tables import CompiledModelTables, MarketGrid, MarketSimpleGrid, NearestLookup, IntervalLookup, TableLookupError
+
+
+def reference_price(df_finance, df_fundingcurve, df_sizepremia, df_termpremia, df_creditpremia, product, credit_risk, term, amount, loan_to_value=None):
+    # pandas implementation of pricing_calc_model the compiled tables must reproduce exactly
+    NIM = df_finance.loc[df_finance["Idx"] == product, "NIM"].values[0] * 100
+    FC_premia = df_fundingcurve.loc[(np.abs(df_fundingcurve["Time(in months)"] - int(term))).idxmin(), product]/100
+    Term_Premia = df_termpremia.loc[(np.abs(df_termpremia["Time(in months)"] - int(term))).idxmin(), product]/100
+    Size_Premia = df_sizepremia.loc[(np.abs(df_sizepremia["Size(in thousands)"] - int(amount)/1000)).idxmin(), product]/100
+    df_creditpremia = df_creditpremia[df_creditpremia['Product'] == product]
+    band = float(term) if loan_to_value is None else float(loan_to_value)
+    Credit_Premia = df_creditpremia.loc[(df_creditpremia['DimOneValMin'] <= band) & (df_creditpremia['DimOneValMax'] >= band) & (df_creditpremia['DimTwoVal'] == credit_risk), 'Value'].values[0]/100
+    return NIM + FC_premia + Term_Premia + Size_Premia + Credit_Premia
+
+
+def make_tables(rng):
+    products = ['A', 'B', 'C']
+    df_finance = pd.DataFrame({'Idx': products, 'NIM': rng.uniform(0, 0.1, len(products))})
+    # unsorted breakpoints with a duplicate so that tie breaking on row order is exercised
+    times = [24, 6, 12, 60, 36, 12, 120]
+    df_fundingcurve = pd.DataFrame({'Time(in months)': times, **{p: rng.uniform(0, 5, len(times)) for p in products}})
+    df_termpremia = pd.DataFrame({'Time(in months)': times[::-1], **{p: rng.uniform(0, 5, len(times)) for p in products}})
+    sizes = [50, 100, 250, 500, 1000]
+    df_sizepremia = pd.DataFrame({'Size(in thousands)': sizes, **{p: rng.integers(0, 500, len(sizes)) for p in products}})
+    rows = []
+    for p in products:
+        for risk in ['Strong', 'Satisfactory', 'Good', 'Weak']:
+            for low, high in [(0, 24), (25, 60), (61, 120)]:
+                rows.append({'Product': p, 'DimOneValMin': low, 'DimOneValMax': high, 'DimTwoVal': risk, 'Value': rng.uniform(0, 300)})
+    # overlapping band for one product, the first band in table order has to win
+    rows.append({'Product': 'C', 'DimOneValMin': 10, 'DimOneValMax': 30, 'DimTwoVal': 'Good', 'Value': 999.0})
+    df_creditpremia = pd.DataFrame(rows)
+    return df_finance, df_fundingcurve, df_sizepremia, df_termpremia, df_creditpremia
+
+
+def assert_matches(compiled, tables, *args, **kwargs):
+    try:
+        expected = reference_price(*tables, *args, **kwargs)
+    except IndexError:
+        with pytest.raises(TableLookupError):
+            compiled.price(*args, **kwargs)
+        return
+    assert compiled.price(*args, **kwargs) == expected
+
+
+def test_compiled_model_tables_match_pandas_lookup():
+    rng = np.random.default_rng(0)
+    tables = make_tables(rng)
+    compiled = CompiledModelTables(*tables)
+
+    for product in ['A', 'B', 'C']:
+        for risk in ['Strong', 'Satisfactory', 'Good', 'Weak']:
+            for term in [1, 6, 9, 18, 24, 30, 48, 90, 120, 500]:
+                for amount in [0, 75000, 175000, 3000000]:
+                    assert_matches(compiled, tables, product, risk, str(term), str(amount))
+            for ltv in [0, 24.5, 45, 61, 100]:
+                assert_matches(compiled, tables, product, risk, '24', '100000', loan_to_value=str(ltv))
+
+
+def test_nearest_lookup_vectorised_matches_scalar():
+    lookup = NearestLookup([24, 6, 12, 60, 36, 12, 120])
+    values = np.array([-5, 6, 9, 18, 30, 48, 90, 200])
+
+    assert lookup.rows_many(values).tolist() == [lookup.row(v) for v in values.tolist()]
+    # 9 is equidistant from 6 and 12, 6 is earlier in the table
+    assert lookup.row(9) == 1
+
+
+def test_interval_lookup_raises_when_no_band_matches():
+    lookup = IntervalLookup([0, 25], [24, 60], [1.0, 2.0])
+
+    assert lookup.value(24) == 1.0
+    with pytest.raises(TableLookupError):
+        lookup.value(24.5)
+    values, found = lookup.values_many([24, 24.5, 30])
+    assert found.tolist() == [True, False, True]
+    assert values[2] == 2.0
+
+
+def test_compiled_model_tables_load_products_lazily():
+    rng = np.random.default_rng(0)
+    tables = make_tables(rng)
+    # the tables with a column or rows per product are read from csv text as the lambda reads them
+    lazy = (tables[0],) + tuple(LazyCsvColumns(df.to_csv(index=False).encode()) for df in tables[1:4]) + (LazyCsvTable(tables[4].to_csv(index=False).encode()),)
+    expected = CompiledModelTables(*(tables[:1] + tuple(parse_csv(df.to_csv(index=False).encode()) for df in tables[1:])))
+    compiled = CompiledModelTables(*lazy)
+
+    assert compiled.memory_report() == {}
+    assert compiled.price('B', 'Good', '30', '120000') == expected.price('B', 'Good', '30', '120000')
+    assert list(compiled.memory_report()) == ['B']
+    assert set(lazy[1]._converted) == {'Time(in months)', 'B'}
+    with pytest.raises(TableLookupError):
+        compiled.price('B', 'Excellent', '30', '120000')
+
+    compiled.load(['A', 'C', 'D'])
+    assert set(compiled.memory_report()) == {'A', 'B', 'C'}
+    for product in ['A', 'C']:
+        for term in ['6', '20', '75']:
+            assert compiled.price(product, 'Good', term, '300000') == expected.price(product, 'Good', term, '300000')
+
+
+def reference_market(discount, credit_risk, term):
+    # scan of the term discount table the market grid must reproduce exactly
+    risk_bucket = "Strong" if credit_risk >= 7.5 else "Good" if credit_risk >= 5 else "Satisfactory" if credit_risk >= 2.5 else "Weak"
+    term_discount = discount[risk_bucket][np.flatnonzero(discount["Term"] == int(term))[0]]/100
+    return (- 1.3333333 * credit_risk + 28.333333) - term_discount
+
+
+def reference_market_simple(market_simple, credit_risk, term):
+    # scan of the market simple table the market simple grid must reproduce exactly
+    in_band = np.flatnonzero((market_simple['DimOneValMin'] < int(term)) & (market_simple['DimOneValMax'] >= int(term)))
+    nearest = np.nanargmin(np.abs(market_simple["DimTwoValue"] - float(credit_risk)))
+    return market_simple['Value'][in_band[nearest]]/100
+
+
+def test_market_grids_match_table_scans():
+    rng = np.random.default_rng(1)
+    # unsorted terms with a gap, a repeated term and a term that is not a whole number
+    discount = {"Term": np.array([24, 6, 12, 60, 12, 36, 12.5]), **{bucket: rng.uniform(0, 50, 7) for bucket in ["Strong", "Good", "Satisfactory", "Weak"]}}
+    # overlapping bands, bounds that are not whole numbers and a row with a missing bound
+    market_simple = {
+        'DimOneValMin': np.array([0, 0, 24, 24, 10.5, 0, np.nan]),
+        'DimOneValMax': np.array([24, 24, 60, 60, 30, 120.7, 90]),
+        'DimTwoValue': np.array([2, 8, 5, 9, 1, 6, 3]),
+        'Value': rng.uniform(100, 1000, 7),
+    }
+    market, market_simple_grid = MarketGrid(discount), MarketSimpleGrid(market_simple)
+
+    for term in range(-2, 130):
+        for credit_risk in [1.0, 2.4, 2.5, 4.99, 5.0, 6.3, 7.5, 9.9]:
+            for grid, reference, table in ((market, reference_market, discount), (market_simple_grid, reference_market_simple, market_simple)):
+                try:
+                    expected = reference(table, credit_risk, str(term))
+                except IndexError:
+                    with pytest.raises(TableLookupError):
+                        grid.price(credit_risk, str(term))
+                    continue
+                assert grid.price(credit_risk, str(term)) == expected
+
+    terms = np.arange(-2, 130).repeat(3)
+    credit_risks = rng.uniform(1, 10, len(terms))
+    rows = market.rows_many(terms)
+    prices, found = market_simple_grid.values_many(credit_risks, terms)
+    for i, (credit_risk, term) in enumerate(zip(credit_risks.tolist(), terms.tolist())):
+        assert (rows[i] >= 0) == (term in (6, 12, 24, 36, 60))
+        if found[i]:
+            assert prices[i] == market_simple_grid.price(credit_risk, term)
+        else:
+            with pytest.raises(TableLookupError):
+                market_simple_grid.price(credit_risk, term)
+
+
+def test_market_simple_grid_prices_open_ended_and_wide_bands():
+    # an open ended band, a band wider than any array indexed by term could be and one that starts below every term
+    market_simple = {
+        'DimOneValMin': np.array([0, 24, 24, 60, -np.inf]),
+        'DimOneValMax': np.array([24, np.inf, np.inf, 1e9, 0]),
+        'DimTwoValue': np.array([2, 5, 9, 5, 9]),
+        'Value': np.array([900.0, 700.0, 300.0, 100.0, 50.0]),
+    }
+    grid = MarketSimpleGrid(market_simple)
+
+    for term in [-5, 0, 1, 24, 25, 30, 60, 61, 10**6, 10**9, 10**9 + 1, 10**12]:
+        for credit_risk in [2.0, 5.0, 9.0]:
+            try:
+                expected = reference_market_simple(market_simple, credit_risk, str(term))
+            except IndexError:
+                with pytest.raises(TableLookupError):
+                    grid.price(credit_risk, str(term))
+                continue
+            assert grid.price(credit_risk, str(term)) == expected
+            prices, found = grid.values_many(np.array([credit_risk]), np.array([term]))
+            assert found[0] and prices[0] == expected
+    assert grid.price(2.0, 30) == 7.0
+    # the grid holds a few segments whatever the width of the bands
+    assert grid.bands.nbytes < 1000
+
+    with pytest.raises(TableLookupError, match="the table has terms 1 to 24"):
+        MarketSimpleGrid({'DimOneValMin': np.array([0]), 'DimOneValMax': np.array([24]), 'DimTwoValue': np.array([2]), 'Value': np.array([900.0])}).price(2.0, 30)
+    with pytest.raises(TableLookupError, match="the table has terms 25 to inf"):
+        MarketSimpleGrid({'DimOneValMin': np.array([24]), 'DimOneValMax': np.array([np.inf]), 'DimTwoValue': np.array([2]), 'Value': np.array([900.0])}).price(2.0, 12)
+
+
+def test_market_grid_holds_only_the_terms_of_the_table():
+    # sentinel terms far from the others, and one beyond int64
+    discount = {"Term": np.array([12, 24, 1e9, -1e9, 1e20]), "Strong": np.array([1.0, 2.0, 3.0, 4.0, 5.0])}
+    grid = MarketGrid(discount)
+
+    assert grid.rows.nbytes + grid.terms.nbytes < 100
+    for term, row in ((12, 0), (24, 1), (10**9, 2), (-10**9, 3)):
+        assert grid.row(str(term)) == row
+        assert grid.price(8.0, term) == reference_market(discount, 8.0, str(term))
+    assert grid.rows_many(np.array([12, 13, 10**9, -10**9, 10**12])).tolist() == [0, -1, 2, 3, -1]
+    with pytest.raises(TableLookupError, match="the table has terms -1000000000 to 1000000000"):
+        grid.row(13)
+
+
+def test_market_grid_errors_name_the_terms_of_the_table():
+    grid = MarketGrid({"Term": np.array([12, 24]), "Strong": np.array([1.0, 2.0])})
+
+    with pytest.raises(TableLookupError, match="No term discount for term 18, the table has terms 12 to 24"):
+        grid.price(8.0, 18)
+    with pytest.raises(TableLookupError, match="no Good column"):
+        grid.price(5.0, 12)
+    assert grid.price(8.0, 24) == (- 1.3333333 * 8.0 + 28.333333) - 0.02
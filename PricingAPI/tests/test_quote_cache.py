@@ -0,0 +1,56 @@
+import unittest.mock as mock
+from io import BytesIO
+from quote_cache import QuoteCache, quote_key
+from config_cache import ConfigCache
+import main
+
+
+def test_quote_key_normalises_equivalent_inputs():
+    assert quote_key("model", "B", "Good", "24", "3000", "45") == quote_key("model", "B", "Good", 24, 3000, 45.0)
+    assert quote_key("market", "B", "5.1", "24") == quote_key("market", "C", 5.1, 24)
+    assert quote_key("model", "B", "Good", "24.5", "3000") is None
+
+
+def test_quote_cache_evicts_least_recently_used():
+    cache = QuoteCache(maxsize=2)
+    price = mock.Mock(side_effect=[1.0, 2.0, 3.0, 4.0])
+
+    cache.get_or_price("market", ('"v1"',), (1.0, 12), price)
+    cache.get_or_price("market", ('"v1"',), (2.0, 12), price)
+    assert cache.get_or_price("market", ('"v1"',), (1.0, 12), price) == 1.0
+    cache.get_or_price("market", ('"v1"',), (3.0, 12), price)
+
+    # (2.0, 12) was the least recently used quote
+    assert cache.get_or_price("market", ('"v1"',), (2.0, 12), price) == 4.0
+    assert cache.stats()['evictions'] == 2
+    assert cache.stats()['hits'] == 1
+
+
+def test_quote_cache_drops_quotes_of_old_config_version():
+    cache = QuoteCache()
+
+    cache.get_or_price("market", ('"v1"',), (1.0, 12), lambda: 1.0)
+    cache.get_or_price("model", ('"m1"',), ("B", "Good", 12, 1000, None), lambda: 5.0)
+    assert cache.get_or_price("market", ('"v2"',), (1.0, 12), lambda: 2.0) == 2.0
+
+    assert cache.stats()['invalidations'] == 1
+    assert cache.get_or_price("model", ('"m1"',), ("B", "Good", 12, 1000, None), lambda: 6.0) == 5.0
+
+
+def test_pricing_functions_reuse_quotes_until_config_changes():
+    objects = {
+        main.MARKET_TABLE_KEY: [b"Term,Strong,Good,Satisfactory,Weak\n24,15,25,35,45", '"v1"'],
+    }
+    mock_s3_client = mock.Mock()
+    mock_s3_client.get_object.side_effect = lambda Bucket, Key, **kwargs: {'Body': BytesIO(objects[Key][0]), 'ETag': objects[Key][1]}
+
+    with mock.patch.object(main, 'config_cache', ConfigCache(ttl=0.001, spill_dir=None)), \
+            mock.patch.object(main, 'quote_cache', QuoteCache()), mock.patch.object(main, 'CONFIG_FORMAT', 'csv'):
+        first = main.pricing_calc_market(mock_s3_client, 5.1, '24')
+        assert main.pricing_calc_market(mock_s3_client, 5.1, 24) == first
+        assert main.quote_cache.stats()['hits'] == 1
+
+        objects[main.MARKET_TABLE_KEY] = [b"Term,Strong,Good,Satisfactory,Weak\n24,15,50,35,45", '"v2"']
+        main.config_cache.clear()
+        assert main.pricing_calc_market(mock_s3_client, 5.1, '24') == first - 0.25
+        assert main.quote_cache.stats()['invalidations'] == 1
@@ -0,0 +1,49 @@
+import csv
+import itertools
+import unittest.mock as mock
+import numpy as np
+import pytest
+import main
+import rate_card
+
+
+def test_rate_card_matches_single_loan_prices(config_s3):
+    s3 = config_s3
+    terms, amounts, credit_risks = np.array([1, 12, 24, 30, 60, 61]), np.array([5000, 50000, 250000]), ['Good', 'Weak', 'Strong']
+
+    cube = main.pricing_calc_model_rate_card(s3, 'B', terms, amounts, credit_risks)
+    assert cube.shape == (6, 3, 3)
+    for (t, term), (a, amount), (g, credit_risk) in itertools.product(enumerate(terms), enumerate(amounts), enumerate(credit_risks)):
+        try:
+            expected = main.pricing_calc_model(s3, 'B', credit_risk, str(term), str(amount))
+        except IndexError:
+            assert np.isnan(cube[t, a, g])
+            continue
+        assert cube[t, a, g] == expected
+
+    loan_to_values = np.array([10.0, 30.0, 70.0])
+    cube = main.pricing_calc_model_rate_card(s3, 'B', terms, amounts, credit_risks, loan_to_values)
+    assert cube.shape == (6, 3, 3, 3)
+    assert cube[2, 1, 0, 1] == main.pricing_calc_model(s3, 'B', 'Good', '24', '50000', loan_to_value = '30.0')
+    assert np.isnan(cube[:, :, :, 2]).all()
+
+    with pytest.raises(ValueError):
+        main.pricing_calc_model_rate_card(s3, 'B', terms, amounts, ['Excellent'])
+
+
+def test_rate_card_cli_writes_csv_and_npz(tmp_path, config_s3):
+    with mock.patch('main.s3', config_s3):
+        rate_card.main(["--product", "B", "--terms", "12:36:12", "--amounts", "10000,50000", "--credit-risks", "Good,Weak", "--output", str(tmp_path / "card.csv")])
+        rate_card.main(["--product", "B", "--terms", "12:36:12", "--amounts", "10000,50000", "--credit-risks", "Good,Weak", "--output", str(tmp_path / "card.npz")])
+        expected = main.pricing_calc_model(main.s3, 'B', 'Weak', '24', '50000')
+
+    with open(tmp_path / "card.csv", newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 3 * 2 * 2
+    row = next(row for row in rows if row['term'] == '24' and row['amount'] == '50000' and row['credit_risk'] == 'Weak')
+    assert float(row['price']) == expected
+
+    card = np.load(tmp_path / "card.npz")
+    assert card['prices'].shape == (3, 2, 2)
+    assert card['prices'][1, 1, 1] == expected
+    assert card['terms'].tolist() == [12, 24, 36]
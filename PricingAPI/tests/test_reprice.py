@@ -0,0 +1,55 @@
+import json
+import unittest.mock as mock
+import main
+from config_cache import ConfigCache
+from reprice import reprice
+
+
+LOAN = {"product": "B", "credit_risk": "Good", "term": "24", "amount": "50000", "loan_id": "l1", "pricing_type": "model", "user_name": "u", "source_name": "s"}
+
+
+def test_reprice_streams_jsonl_in_input_order(tmp_path, config_s3):
+    requests = tmp_path / "requests.jsonl"
+    requests.write_text("\n".join([
+        json.dumps({'queryStringParameters': LOAN}),
+        json.dumps(dict(LOAN, pricing_type="market", credit_risk="5.1", loan_id="l2")),
+        "not json",
+        json.dumps(dict(LOAN, credit_risk="Excellent")),
+        json.dumps(dict(LOAN, loan_to_value="30", credit_risk="Weak", loan_id="l5")),
+    ]) + "\n")
+    output = tmp_path / "prices.jsonl"
+    mock_dynamodb = mock.Mock()
+    mock_dynamodb.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+    with mock.patch('main.s3', config_s3), mock.patch('main.dynamodb', mock_dynamodb), mock.patch('main.config_cache', ConfigCache()):
+        summary = reprice(str(requests), str(output), workers = 0, chunk_size = 2, audit = "batch")
+        records = [json.loads(line) for line in output.read_text().splitlines()]
+
+        assert [record['line'] for record in records] == [1, 2, 3, 4, 5]
+        assert [record['statusCode'] for record in records] == [200, 200, 400, 400, 200]
+        assert records[0]['output'] == main.pricing_calc_model(main.s3, 'B', 'Good', '24', '50000')
+        assert records[1]['output'] == main.pricing_calc_market(main.s3, 5.1, '24')
+        assert records[4]['input']['loan_to_value'] == "30"
+    assert summary['priced'] == 3 and summary['errors'] == 2 and summary['audit_failures'] == 0
+    written = sum(len(call.kwargs['RequestItems']['pricing_apirunlog']) for call in mock_dynamodb.batch_write_item.call_args_list)
+    assert written == 3
+
+
+def test_reprice_reads_csv_and_skips_audit(tmp_path, config_s3):
+    requests = tmp_path / "requests.csv"
+    requests.write_text(
+        "product,credit_risk,term,amount,loan_id,pricing_type,loan_to_value\n"
+        "B,Good,24,50000,l1,model,\n"
+        "B,7.9,12,50000,l2,market_simple,\n"
+    )
+    output = tmp_path / "prices.csv"
+    mock_dynamodb = mock.Mock()
+
+    with mock.patch('main.s3', config_s3), mock.patch('main.dynamodb', mock_dynamodb), mock.patch('main.config_cache', ConfigCache()):
+        summary = reprice(str(requests), str(output), workers = 0, audit = "skip")
+        lines = output.read_text().splitlines()
+
+        assert lines[0] == "line,statusCode,output,body,run_id,input"
+        assert float(lines[2].split(",")[2]) == main.pricing_calc_market_simple(main.s3, 7.9, '12')
+    assert summary['priced'] == 2
+    mock_dynamodb.batch_write_item.assert_not_called()
@@ -0,0 +1,99 @@
+import asyncio
+import http.client
+import json
+import threading
+import time
+import unittest.mock as mock
+import urllib.parse
+import pytest
+import main
+import server
+
+
+def start_server(handler, threads=4, drain_timeout=5):
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    pricing_server = server.PricingServer(handler, threads, drain_timeout)
+    port = asyncio.run_coroutine_threadsafe(pricing_server.start(), loop).result()
+    return loop, pricing_server, port
+
+
+def test_server_adapts_requests_to_handler_events(api_fakes):
+    from fakes import synthetic_loans
+
+    _, products = api_fakes()
+    loans = synthetic_loans(products, 3)
+    loop, pricing_server, port = start_server(main.handler)
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+
+    with mock.patch('builtins.print'):
+        # requests share one keep-alive connection
+        connection.request("GET", "/?" + urllib.parse.urlencode(loans[0]))
+        response = connection.getresponse()
+        body = json.loads(response.read())
+        assert response.status == 200 and response.getheader('Content-Type') == 'application/json'
+        assert body['output'] == main.pricing_calc_model(main.s3, loans[0]['product'], loans[0]['credit_risk'], loans[0]['term'], loans[0]['amount'])
+
+        connection.request("POST", "/", body=json.dumps(loans[1:]))
+        response = connection.getresponse()
+        assert [result['statusCode'] for result in json.loads(response.read())['output']] == [200, 200]
+
+        connection.request("GET", "/?" + urllib.parse.urlencode(dict(loans[0], product="unknown")))
+        response = connection.getresponse()
+        response.read()
+        assert response.status == 400
+
+    connection.request("PUT", "/")
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 405
+    # a body that is not UTF-8 is refused and the connection stays open
+    connection.request("POST", "/", body=b'[{"product": "\xff"}]')
+    response = connection.getresponse()
+    assert response.status == 400 and response.read() == b"Request bodies must be UTF-8"
+    connection.request("GET", server.HEALTH_PATH)
+    assert json.loads(connection.getresponse().read()) == {'status': "ok", 'in_flight': 0, 'served': 3}
+
+    assert asyncio.run_coroutine_threadsafe(pricing_server.drain(), loop).result() is True
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_server_drains_requests_in_flight():
+    started = threading.Event()
+
+    def slow_handler(event, context):
+        started.set()
+        time.sleep(0.3)
+        return {'statusCode': 200, 'body': event['queryStringParameters']['loan_id']}
+
+    loop, pricing_server, port = start_server(slow_handler)
+    idle = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    idle.connect()
+    busy = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    busy.request("GET", "/?loan_id=l1")
+    assert started.wait(5)
+
+    drained = asyncio.run_coroutine_threadsafe(pricing_server.drain(), loop)
+    # the request in flight is answered and its connection closed
+    response = busy.getresponse()
+    assert response.status == 200 and response.read() == b"l1"
+    assert response.getheader('Connection') == 'close'
+    assert drained.result(5) is True
+
+    # idle connections are closed and new ones refused
+    with pytest.raises((ConnectionError, http.client.RemoteDisconnected)):
+        idle.request("GET", "/?loan_id=l2")
+        idle.getresponse()
+    with pytest.raises(ConnectionError):
+        http.client.HTTPConnection("127.0.0.1", port, timeout=2).request("GET", "/?loan_id=l3")
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_request_event():
+    assert server.request_event("GET", "/?product=B&term=24", b"") == {'queryStringParameters': {'product': "B", 'term': "24"}}
+    assert server.request_event("GET", "/", b"") == {'queryStringParameters': None}
+    assert server.request_event("POST", "/", b'[{"product": "B"}]') == {'body': '[{"product": "B"}]'}
+    assert server.request_event("GET", "/?product=B", b"", {'idempotency-key': "k1"}) == {'queryStringParameters': {'product': "B"}, 'headers': {'idempotency-key': "k1"}}
+    assert server.request_event("DELETE", "/", b"") is None
+    with pytest.raises(server.BadRequest):
+        server.request_event("POST", "/", b"\xff")